@@ -5,4 +5,5 @@ python src/article_relevance/relevance_prediction_model_retrain.py \
   --train_data_path="$TRAIN_DATA_PATH" \
   --model_folder="$MODEL_FOLDER" \
   --result_dir="$RESULT_DIR"\
-  --reviewed_folder_path="$REVIEWED_FOLDER_PATH"
\ No newline at end of file
+  --reviewed_folder_path="$REVIEWED_FOLDER_PATH" \
+  --embedding_store_path="$EMBEDDING_STORE_PATH"
\ No newline at end of file
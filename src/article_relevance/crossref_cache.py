@@ -0,0 +1,109 @@
+# Author Kelly Wu
+# 2023-06-28
+
+# Disk backed cache of CrossRef API responses keyed by lower-cased DOI
+
+import os
+import sys
+import json
+import sqlite3
+import time
+
+# Locate src module
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# sqlite limits the number of bound parameters per statement
+SQLITE_MAX_PARAMS = 500
+
+
+class CrossRefCache:
+    """Disk backed cache of CrossRef metadata with a time to live.
+
+    DOIs CrossRef doesn't know are cached too so they aren't requested again
+    until they expire, failed requests are never cached.
+
+    Args:
+        cache_path (str): Path to the sqlite database file, created if it doesn't exist.
+        ttl_days (float): Number of days a response is served from the cache.
+    """
+
+    def __init__(self, cache_path, ttl_days = 30):
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+
+        self.connection = sqlite3.connect(cache_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                doi TEXT PRIMARY KEY,
+                message TEXT,
+                fetched_at REAL NOT NULL
+            )"""
+        )
+        self.connection.commit()
+
+    def get_many(self, dois):
+        """Looks up the cached responses of many DOIs.
+
+        Args:
+            dois (list): The DOIs to look up.
+
+        Return:
+            dict of the unexpired responses keyed by lower-cased DOI, the
+            value is the metadata or None if the DOI wasn't found on CrossRef.
+        """
+        unique_dois = list(dict.fromkeys(doi.lower() for doi in dois))
+        min_fetched_at = time.time() - self.ttl_seconds
+
+        cached = {}
+        for i in range(0, len(unique_dois), SQLITE_MAX_PARAMS):
+            doi_chunk = unique_dois[i : i + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(doi_chunk))
+            for doi, message in self.connection.execute(
+                f"SELECT doi, message FROM responses WHERE doi IN ({placeholders}) AND fetched_at >= ?",
+                doi_chunk + [min_fetched_at],
+            ):
+                cached[doi] = json.loads(message) if message is not None else None
+
+        self.hits += len(cached)
+        self.misses += len(unique_dois) - len(cached)
+
+        return cached
+
+    def put_many(self, responses):
+        """Stores the responses of many DOIs.
+
+        Args:
+            responses (dict): The metadata keyed by DOI, None if the DOI wasn't found on CrossRef.
+        """
+        fetched_at = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO responses (doi, message, fetched_at) VALUES (?, ?, ?)",
+            [
+                (doi.lower(), json.dumps(message) if message is not None else None, fetched_at)
+                for doi, message in responses.items()
+            ],
+        )
+        self.connection.commit()
+
+    def log_stats(self):
+        """Logs the hit and miss counts since the cache was opened."""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total > 0 else 0.0
+        logger.info(
+            f"CrossRef cache hits: {self.hits}, misses: {self.misses}, hit rate: {hit_rate:.1%}"
+        )
+
+    def close(self):
+        """Closes the database connection."""
+        self.connection.close()
@@ -0,0 +1,274 @@
+# Author Kelly Wu
+# 2023-06-29
+
+# Append-only store of article sentence embeddings keyed by lower-cased DOI
+# and the fixed size list parquet column the embeddings are exported in
+
+import os
+import sys
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Locate src module
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+EMBEDDINGS_FILE_NAME = "embeddings.f32"
+INDEX_FILE_NAME = "doi_index.txt"
+METADATA_FILE_NAME = "metadata.json"
+
+# parquet column holding each article's embedding as a fixed_size_list<float32>
+EMBEDDING_COLUMN = "embedding"
+
+
+class EmbeddingStore:
+    """Append-only store of article embeddings keyed by lower-cased DOI.
+
+    The embeddings are the rows of a raw float32 file read through a memory
+    map, the DOIs are one per line of an index file in the same order. Rows
+    are only ever appended so a single process should write to a store at a
+    time.
+
+    Args:
+        store_path (str): Directory of the store, created if it doesn't exist.
+        model_name (str): Name of the model the embeddings are made with.
+        dim (int): Dimension of the embeddings.
+    """
+
+    def __init__(self, store_path, model_name, dim = 768):
+        self.store_path = store_path
+        self.model_name = model_name
+        self.dim = dim
+        self.embeddings_path = os.path.join(store_path, EMBEDDINGS_FILE_NAME)
+        self.index_path = os.path.join(store_path, INDEX_FILE_NAME)
+        self.embeddings = None
+
+        os.makedirs(store_path, exist_ok=True)
+
+        metadata_path = os.path.join(store_path, METADATA_FILE_NAME)
+        metadata = {"model_name": model_name, "dim": dim}
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                stored_metadata = json.load(f)
+            if stored_metadata != metadata:
+                raise ValueError(
+                    f"Embedding store {store_path} holds {stored_metadata}, not {metadata}."
+                )
+        else:
+            with open(metadata_path, "w") as f:
+                json.dump(metadata, f)
+
+        dois = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                dois = f.read().splitlines()
+        n_embeddings = 0
+        if os.path.exists(self.embeddings_path):
+            n_embeddings = os.path.getsize(self.embeddings_path) // (4 * dim)
+
+        # drop any rows half written by an interrupted append
+        self.n_rows = min(len(dois), n_embeddings)
+        if self.n_rows != len(dois) or (
+            os.path.exists(self.embeddings_path)
+            and os.path.getsize(self.embeddings_path) != self.n_rows * 4 * dim
+        ):
+            logger.warning(f"Embedding store {store_path} was not fully written, keeping {self.n_rows} rows.")
+            with open(self.embeddings_path, "ab") as f:
+                f.truncate(self.n_rows * 4 * dim)
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                f.writelines(f"{doi}\n" for doi in dois[: self.n_rows])
+
+        self.doi_rows = {doi: row for row, doi in enumerate(dois[: self.n_rows])}
+
+    def __len__(self):
+        return self.n_rows
+
+    def get_rows(self, dois):
+        """Gets the row of each DOI in the store.
+
+        Args:
+            dois (list): The DOIs to look up.
+
+        Return:
+            np.ndarray of the row of each DOI, -1 where it isn't stored.
+        """
+        return np.array(
+            [self.doi_rows.get(str(doi).lower(), -1) for doi in dois], dtype=np.int64
+        )
+
+    def get_embeddings(self, rows):
+        """Reads the embeddings of many rows.
+
+        Args:
+            rows (np.ndarray): The rows to read, all must be stored.
+
+        Return:
+            np.ndarray float32 matrix with an embedding per row.
+        """
+        if len(rows) == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        if self.embeddings is None:
+            self.embeddings = np.memmap(
+                self.embeddings_path, dtype=np.float32, mode="r", shape=(self.n_rows, self.dim)
+            )
+
+        return np.asarray(self.embeddings[rows])
+
+    def add_many(self, dois, embeddings):
+        """Appends the embeddings of DOIs that aren't stored yet.
+
+        Args:
+            dois (list): The DOIs of the embeddings.
+            embeddings (np.ndarray): Matrix with an embedding per DOI.
+        """
+        new_rows = {}
+        for i, doi in enumerate(dois):
+            doi = str(doi).lower()
+            if doi not in self.doi_rows and doi not in new_rows:
+                new_rows[doi] = i
+
+        if not new_rows:
+            return
+
+        new_embeddings = np.asarray(embeddings, dtype=np.float32)[list(new_rows.values())]
+        if new_embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got {new_embeddings.shape[1]}.")
+
+        # embeddings go first so an interrupted append never indexes missing rows
+        with open(self.embeddings_path, "ab") as f:
+            f.write(new_embeddings.tobytes())
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.writelines(f"{doi}\n" for doi in new_rows)
+
+        for doi in new_rows:
+            self.doi_rows[doi] = self.n_rows
+            self.n_rows += 1
+        self.embeddings = None
+
+        logger.info(f"Added {len(new_rows)} embeddings to the embedding store, {self.n_rows} stored.")
+
+
+def add_store_embeddings(input_df, store, doi_col = 'DOI'):
+    """Gets the stored embedding of each article as a matrix beside the frame.
+
+    Args:
+        input_df (pd DataFrame): Input data frame.
+        store (EmbeddingStore): The embedding store.
+        doi_col (str): Column with the articles' DOI.
+
+    Return:
+        pd DataFrame input data frame, and np.ndarray float32 matrix with an
+        embedding per row of it, NaN where the DOI isn't stored.
+    """
+    rows = store.get_rows(input_df[doi_col].tolist())
+    found = rows >= 0
+
+    embeddings = np.full((input_df.shape[0], store.dim), np.nan, dtype=np.float32)
+    embeddings[found] = store.get_embeddings(rows[found])
+
+    if not found.all():
+        logger.warning(f"{(~found).sum()} articles have no embedding in the embedding store.")
+
+    return input_df, embeddings
+
+
+def add_embedding_columns(input_df, embeddings):
+    """Adds an embedding matrix as the '0'..'767' feature columns the relevance
+    model's sklearn pipeline takes. The matrix is copied into the frame, so
+    this is only done where the pipeline needs the columns.
+
+    Args:
+        input_df (pd DataFrame): Input data frame.
+        embeddings (np.ndarray): Matrix with an embedding per row of input_df.
+
+    Return:
+        pd DataFrame with the embedding columns added.
+    """
+    # the embedding columns share a single float32 block
+    embeddings_df = pd.DataFrame(embeddings,
+                                 index = input_df.index,
+                                 columns = [str(i) for i in range(embeddings.shape[1])])
+
+    return pd.concat([input_df, embeddings_df], axis = 1)
+
+
+def embeddings_to_arrow(embeddings):
+    """Converts an embedding matrix to a fixed size list array sharing its memory.
+
+    Rows without an embedding are kept as NaN rather than null, parquet files
+    with null fixed size lists can't be read back by pyarrow 12.
+
+    Args:
+        embeddings (np.ndarray): Matrix with an embedding per row.
+
+    Return:
+        pa.FixedSizeListArray of float32 lists.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n_rows, dim = embeddings.shape
+
+    return pa.Array.from_buffers(
+        pa.list_(pa.float32(), dim),
+        n_rows,
+        [None],
+        children=[pa.array(embeddings.reshape(-1))],
+    )
+
+
+def arrow_to_embeddings(column):
+    """Converts a fixed size list column to an embedding matrix.
+
+    The matrix is a read-only view of the column's memory unless the column
+    has several chunks or null rows, which are set to NaN.
+
+    Args:
+        column (pa.ChunkedArray or pa.FixedSizeListArray): The embedding column.
+
+    Return:
+        np.ndarray float32 matrix with an embedding per row.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks() if column.num_chunks != 1 else column.chunk(0)
+
+    dim = column.type.list_size
+    values = column.values.slice(column.offset * dim, len(column) * dim)
+    if values.null_count > 0:
+        values = values.fill_null(np.nan)
+    embeddings = values.to_numpy(zero_copy_only=True).reshape(len(column), dim)
+
+    if column.null_count > 0:
+        embeddings = embeddings.copy()
+        embeddings[column.is_null().to_numpy(zero_copy_only=False)] = np.nan
+
+    return embeddings
+
+
+def read_embedding_parquet(file_path):
+    """Reads a relevance prediction parquet file and its embedding column.
+
+    Args:
+        file_path (str): Path to the parquet file.
+
+    Return:
+        pd DataFrame of the file without the embedding column, and np.ndarray
+        float32 matrix with an embedding per row of it, None if the file has no
+        embedding column.
+    """
+    table = pq.read_table(file_path)
+
+    if EMBEDDING_COLUMN not in table.column_names:
+        return table.to_pandas(), None
+
+    embeddings = arrow_to_embeddings(table[EMBEDDING_COLUMN])
+
+    return table.drop([EMBEDDING_COLUMN]).to_pandas(), embeddings
@@ -0,0 +1,104 @@
+# Author Kelly Wu
+# 2023-07-07
+
+"""This script flattens a fitted relevance model into the .npz linear scorer
+relevance prediction loads without sklearn, and checks the scorer gives the
+model's predict_proba on the model's training data file.
+
+Usage: export_relevance_scorer.py --model_path=<model_path> [--output_path=<output_path>] [--check_data_path=<check_data_path>]
+
+Options:
+    --model_path=<model_path>               The path to the .joblib model object.
+    --output_path=<output_path>             The path to where the .npz scorer will be saved. By default next to the model object.
+    --check_data_path=<check_data_path>     The path to a CSV file of articles with the model's features to check the scorer against the model.
+"""
+
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from docopt import docopt
+
+# Locate src module
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from logs import get_logger
+from article_relevance.relevance_scorer import (LinearRelevanceScorer, NUMERIC_FEATURE,
+                                                BINARY_FEATURE, TEXT_FEATURE)
+
+logger = get_logger(__name__)
+
+EMBEDDING_COL = [str(i) for i in range(768)]
+
+
+def export_relevance_scorer(model_path, output_path = None):
+    """
+    Export the linear scorer of a fitted relevance model to a .npz file.
+
+    Args:
+        model_path (str): Path to the .joblib model object.
+        output_path (str): Path to the .npz file, by default the model path with a .npz extension.
+
+    Returns:
+        Path to the .npz file.
+    """
+    if output_path is None:
+        output_path = os.path.splitext(model_path)[0] + ".npz"
+
+    model = joblib.load(model_path)
+    LinearRelevanceScorer.from_pipeline(model).save_npz(output_path)
+
+    logger.info(f"Relevance scorer of {model_path} saved to {output_path} ({os.path.getsize(output_path)} bytes).")
+
+    return output_path
+
+
+def check_relevance_scorer(model_path, scorer_path, check_data_path):
+    """
+    Check the .npz scorer gives the model's predict_proba.
+
+    Args:
+        model_path (str): Path to the .joblib model object.
+        scorer_path (str): Path to the .npz scorer.
+        check_data_path (str): Path to a CSV file of articles with the model's features.
+
+    Returns:
+        float largest absolute difference of the predicted probabilities.
+    """
+    start_time = time.perf_counter()
+    scorer = LinearRelevanceScorer.from_npz(scorer_path)
+    logger.info(f"Scorer loaded in {(time.perf_counter() - start_time) * 1000:.1f}ms.")
+
+    check_df = pd.read_csv(check_data_path, usecols = [NUMERIC_FEATURE, BINARY_FEATURE, TEXT_FEATURE] + EMBEDDING_COL)
+    check_df = check_df.dropna()
+    check_df[TEXT_FEATURE] = check_df[TEXT_FEATURE].astype(str)
+
+    predict_proba = scorer.predict_proba(check_df.loc[:, EMBEDDING_COL].to_numpy(),
+                                         check_df[BINARY_FEATURE].to_numpy(),
+                                         check_df[TEXT_FEATURE].to_numpy(),
+                                         check_df[NUMERIC_FEATURE].to_numpy())
+    model = joblib.load(model_path)
+    expected = model.predict_proba(check_df.loc[:, model.feature_names_in_])[:, 1]
+
+    max_diff = float(np.abs(predict_proba - expected).max(initial = 0))
+    logger.info(f"{check_df.shape[0]} articles checked, largest predict_proba difference: {max_diff:.3g}.")
+
+    return max_diff
+
+
+def main():
+    opt = docopt(__doc__)
+
+    scorer_path = export_relevance_scorer(opt['--model_path'], opt['--output_path'])
+
+    if opt['--check_data_path'] is not None:
+        check_relevance_scorer(opt['--model_path'], scorer_path, opt['--check_data_path'])
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,8 @@ Options:
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import os
 import numpy as np
@@ -39,9 +41,146 @@ src_dir = os.path.dirname(current_dir)
 sys.path.append(src_dir)
 
 from logs import get_logger
+from article_relevance.gddid_index import GddidIndex
 
 logger = get_logger(__name__) # this gets the object with the current modules name
 
+GDD_USER_AGENT = "Neotoma-Article-Relevance-Tool (mailto:goring@wisc.edu)"
+GDD_MAX_RETRIES = int(os.getenv("GDD_MAX_RETRIES", "5"))
+# an unreachable API fails after these connection retries instead of all of them
+GDD_CONNECT_RETRIES = int(os.getenv("GDD_CONNECT_RETRIES", "2"))
+GDD_BACKOFF_FACTOR = 1
+# longest wait in seconds between two retries
+GDD_BACKOFF_MAX = float(os.getenv("GDD_BACKOFF_MAX", "30"))
+GDD_TIMEOUT = 120
+
+# intermediate files of an interrupted query, removed once it completes
+GDD_PAGES_FILE_NAME = "gdd_api_pages.jsonl"
+GDD_CURSOR_FILE_NAME = "gdd_api_cursor.json"
+
+
+def get_gdd_session(max_retries = GDD_MAX_RETRIES,
+                    backoff_factor = GDD_BACKOFF_FACTOR,
+                    connect_retries = GDD_CONNECT_RETRIES,
+                    backoff_max = GDD_BACKOFF_MAX):
+    """Creates a session that retries failed xDD requests with exponential
+    backoff, honouring any Retry-After header.
+
+    Args:
+        max_retries (int): Number of times a request is retried.
+        backoff_factor (float): Base of the exponential backoff in seconds.
+        connect_retries (int): Number of times a request that can't connect is retried.
+        backoff_max (float): Longest wait in seconds between two retries.
+
+    Return:
+        requests.Session to query xDD with.
+    """
+    retry_settings = dict(
+        total=max_retries,
+        connect=min(connect_retries, max_retries),
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        retry = Retry(backoff_max=backoff_max, **retry_settings)
+    except TypeError:
+        # urllib3 < 2 only reads the backoff cap from the class
+        retry = type("GddRetry", (Retry,), {"DEFAULT_BACKOFF_MAX": backoff_max})(**retry_settings)
+
+    session = requests.Session()
+    session.headers.update({"User-Agent": GDD_USER_AGENT})
+    session.mount("http://", HTTPAdapter(max_retries=retry))
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+
+    return session
+
+
+def stream_gdd_pages(api_call, output_path, session = None):
+    """
+    Query every page of an xDD API call, appending the articles of each page
+    to a JSONL file and checkpointing the next_page cursor after each page.
+    A query interrupted part way through resumes from the last checkpoint
+    when run again with the same api_call.
+
+    Args:
+        api_call (str)          URL of the first page of the query.
+        output_path (str)       The path to the folder the JSONL and cursor files are saved to.
+        session (requests.Session) Session to query xDD with.
+
+    Return:
+        Path to the JSONL file with an article per line.
+    """
+    if session is None:
+        session = get_gdd_session()
+
+    os.makedirs(output_path, exist_ok=True)
+    pages_path = os.path.join(output_path, GDD_PAGES_FILE_NAME)
+    cursor_path = os.path.join(output_path, GDD_CURSOR_FILE_NAME)
+
+    cursor = {"api_call": api_call, "next_page": api_call, "n_pages": 0, "n_articles": 0, "pages_size": 0}
+    if os.path.exists(cursor_path):
+        with open(cursor_path) as f:
+            saved_cursor = json.load(f)
+        if saved_cursor["api_call"] == api_call:
+            cursor = saved_cursor
+            logger.info(f'Resuming GeoDeepDive query after page {cursor["n_pages"]} ({cursor["n_articles"]} articles).')
+
+    # drop any articles of a page written after the last checkpoint
+    with open(pages_path, "ab") as f:
+        f.truncate(cursor["pages_size"])
+
+    while cursor["next_page"] != "":
+        response = session.get(cursor["next_page"], timeout=GDD_TIMEOUT)
+        # raises once the retries are used up, the query resumes from this page
+        response.raise_for_status()
+
+        response_dict = response.json()["success"]
+        data = response_dict["data"]
+
+        with open(pages_path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(article) + "\n" for article in data)
+
+        cursor["n_pages"] += 1
+        cursor["n_articles"] += len(data)
+        cursor["pages_size"] = os.path.getsize(pages_path)
+        cursor["next_page"] = response_dict.get("next_page", "")
+
+        # replace the checkpoint in one step so it is never half written
+        with open(cursor_path + ".tmp", "w") as f:
+            json.dump(cursor, f)
+        os.replace(cursor_path + ".tmp", cursor_path)
+
+        logger.info(f'{len(data)} articles queried from GeoDeepDive (page {cursor["n_pages"]}).')
+
+    return pages_path
+
+
+def gdd_article_record(article):
+    """
+    Get the gddid, DOI and url of an article returned by the xDD API.
+
+    Args:
+        article (dict)          Article metadata from the xDD API.
+
+    Return:
+        dict of the article's gddid, DOI, url and status.
+    """
+    if article['identifier'] == []:
+        doi = 'Non-DOI Article ID type'
+    elif article['identifier'][0]['type'] == 'doi':
+        doi = article['identifier'][0]['id']
+    else:
+        doi = 'Non-DOI Article ID type'
+
+    return {'gddid': article['_gddid'],
+            'DOI': doi,
+            'url': article['link'][0]['url'],
+            'status': 'queried'}
+
+
 def get_new_gdd_articles(output_path,
                          parquet_path,
                          n_recent_articles = None,
@@ -136,68 +275,15 @@ def get_new_gdd_articles(output_path,
 
     # =========== Query xDD API to get data ==========
     logger.info(f'{api_call}')
-    session = requests.Session()
-    response = session.get(api_call)
-
-    n_refresh = 0
-    while response.status_code != 200 and n_refresh < 10:
-        response = requests.get(api_call, headers={"User-Agent":"Neotoma-Article-Relevance-Tool (mailto:goring@wisc.edu)"})
-        n_refresh += 1
-
-    response_dict = response.json()
-    data = response_dict['success']['data']
-
-    i = 1
-    logger.info(f'{len(data)} articles queried from GeoDeepDive (page {i}).')
-
-    if 'next_page' in response_dict['success'].keys():
-
-        next_page = response_dict['success']['next_page']
-        n_refresh = 0
-
-        while (next_page != '') :
-            i += 1
-            logger.info(f"going to the next page: page{i}")
-
-            next_response = session.get(next_page)
-            while next_response.status_code != 200:
-                next_response = session.get(next_page)
-
-            next_response_dict = next_response.json()
-            new_data = next_response_dict['success']['data']
-            logger.info(f'{len(new_data)} articles queried from GeoDeepDive (page {i}).')
-            data.extend(new_data)
-
-            next_page = next_response_dict['success']['next_page']
-            n_refresh += 1
-
+    pages_path = stream_gdd_pages(api_call, output_path)
     logger.info(f'GeoDeepDive query completed.')
 
 
     # ========= Convert gdd data to dataframe =========
-    # initialize the resulting dataframe
-    gdd_df = pd.DataFrame()
-
-    counter = 0
-    for article in data:
-        counter +=1
-        one_article_dict = {}
-        one_article_dict['gddid'] = [article['_gddid']]
-
-        if article['identifier'] == []:
-             one_article_dict['DOI'] = ['Non-DOI Article ID type']
-        elif article['identifier'][0]['type'] == 'doi':
-            one_article_dict['DOI'] = [article['identifier'][0]['id']]
-        else:
-            one_article_dict['DOI'] = ['Non-DOI Article ID type']
-
-        one_article_dict['url'] = [article['link'][0]['url']]
-        one_article_dict['status'] = 'queried'
-
-        one_article = pd.DataFrame(one_article_dict)
-        gdd_df = pd.concat([gdd_df, one_article])
+    with open(pages_path, encoding="utf-8") as f:
+        gdd_df = pd.DataFrame([gdd_article_record(json.loads(line)) for line in f],
+                              columns=['gddid', 'DOI', 'url', 'status'])
 
-    gdd_df = gdd_df.reset_index(drop=True)
     logger.info(f'{gdd_df.shape[0]} articles returned from GeoDeepDive.')
 
 
@@ -206,24 +292,21 @@ def get_new_gdd_articles(output_path,
         # Get the list of existing IDs from the Parquet files
         logger.info(f'auto_check_dup is True. Removing duplicates.')
 
-        file_list = os.listdir(parquet_path)
-        if len(file_list) == 0:
+        gddid_index = GddidIndex(parquet_path)
+        if gddid_index.n_files() == 0:
             logger.warning(f'auto_check_dup is True, but no existing parquet file found. All queried articles will be returned.')
             result_df = gdd_df.copy()
 
         else:
-            existing_ids = set()
-            for file_name in os.listdir(parquet_path):
-                file_path = os.path.join(parquet_path, file_name)
-                if file_name.endswith(".parquet") and os.path.isfile(file_path):
-                    # Read only the ID column from the Parquet file
-                    gdd_one_file = pq.read_table(file_path, columns=["gddid"]).to_pandas()
-                    existing_ids.update(gdd_one_file["gddid"])
+            # only the queried gddids are looked up in the index
+            existing_ids = gddid_index.find_existing(gdd_df["gddid"].tolist())
 
             # remove the duplicates
             result_df = gdd_df[~gdd_df["gddid"].isin(existing_ids)]
             logger.info(f'{result_df.shape[0]} articles are new addition for relevance prediction.')
 
+        gddid_index.close()
+
     else:
          result_df = gdd_df.copy()
 
@@ -253,6 +336,10 @@ def get_new_gdd_articles(output_path,
     with open(output_path + '/gdd_api_return.json', "w") as file:
         json.dump(result_dict, file)
 
+    # the query is complete, the next one starts afresh
+    os.remove(os.path.join(output_path, GDD_CURSOR_FILE_NAME))
+    os.remove(pages_path)
+
 
 def find_max_date_from_parquet(parquet_path):
     """
@@ -265,20 +352,12 @@ def find_max_date_from_parquet(parquet_path):
     Return:
         Date as a string.
     """
-    # initialize the date with an very old date
-    min_date = datetime.strptime('1800-01-01', "%Y-%m-%d").date()
-    for file_name in os.listdir(parquet_path):
-        file_path = os.path.join(parquet_path, file_name)
-        if file_name.endswith(".parquet") and file_name.startswith('article-relevance-prediction_') and os.path.isfile(file_path):
-            # Extract date from the file_name
-            curr_date_str = file_name.split('_')[1][0:10]
-            curr_date = datetime.strptime(curr_date_str, "%Y-%m-%d").date()
-
-            # Compare with result and update if the date is newer
-            if curr_date > min_date:
-                 min_date = curr_date
+    gddid_index = GddidIndex(parquet_path)
+    max_run_date = gddid_index.max_run_date()
+    gddid_index.close()
 
-    min_date_str = min_date.strftime("%Y-%m-%d")
+    # fall back to an very old date
+    min_date_str = max_run_date if max_run_date is not None else '1800-01-01'
 
     return min_date_str
 
@@ -300,8 +379,10 @@ def main():
     param_auto_min_date = opt['--auto_min_date']
 
     if param_auto_min_date.lower() == 'true':
-        file_list = os.listdir(parquet_file_path)
-        if len(file_list) == 0:
+        gddid_index = GddidIndex(parquet_file_path)
+        n_files = gddid_index.n_files()
+        gddid_index.close()
+        if n_files == 0:
              logger.warning(f'auto_min_date is True, but no existing parquet file found. All queried articles up to max_date will be returned.')
         else:
              param_min_date = find_max_date_from_parquet(parquet_file_path)
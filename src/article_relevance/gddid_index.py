@@ -0,0 +1,168 @@
+# Author Kelly Wu
+# 2023-07-03
+
+# Index of the gddids in the prediction parquet files of a folder
+
+import os
+import sys
+import sqlite3
+from datetime import datetime
+
+import pyarrow.parquet as pq
+
+# Locate src module
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_FILE_NAME = "gddid_index.sqlite"
+PREDICTION_FILE_PREFIX = "article-relevance-prediction_"
+
+# sqlite limits the number of bound parameters per statement
+SQLITE_MAX_PARAMS = 500
+
+
+def get_run_date(file_name):
+    """Gets the run date of a prediction parquet file from its name.
+
+    Args:
+        file_name (str): Name of the parquet file.
+
+    Return:
+        Date as a string in yyyy-mm-dd format, None for files not named by prediction_export.
+    """
+    if not file_name.startswith(PREDICTION_FILE_PREFIX):
+        return None
+
+    # article-relevance-prediction_yyyy-mm-ddTHH-MM-SS.parquet
+    run_date = file_name.split('_')[1][0:10]
+    try:
+        datetime.strptime(run_date, "%Y-%m-%d")
+    except ValueError:
+        return None
+
+    return run_date
+
+
+class GddidIndex:
+    """SQLite index of the gddids in each parquet file of a folder.
+
+    prediction_export adds the files it writes, any other parquet files
+    added to or removed from the folder are picked up when the index is
+    opened, so only files new to the index are ever read.
+
+    Args:
+        parquet_path (str): The folder with the parquet files, the index is saved in it.
+    """
+
+    def __init__(self, parquet_path):
+        self.parquet_path = parquet_path
+
+        os.makedirs(parquet_path, exist_ok=True)
+
+        self.connection = sqlite3.connect(os.path.join(parquet_path, INDEX_FILE_NAME), timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                file_name TEXT PRIMARY KEY,
+                run_date TEXT
+            )"""
+        )
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS gddids (
+                gddid TEXT NOT NULL,
+                file_name TEXT NOT NULL
+            )"""
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS gddids_gddid ON gddids (gddid)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS gddids_file_name ON gddids (file_name)")
+        self.connection.commit()
+
+        self.sync()
+
+    def sync(self):
+        """Indexes the parquet files new to the index and drops the removed ones."""
+        parquet_files = {
+            file_name
+            for file_name in os.listdir(self.parquet_path)
+            if file_name.endswith(".parquet") and os.path.isfile(os.path.join(self.parquet_path, file_name))
+        }
+        indexed_files = {file_name for (file_name,) in self.connection.execute("SELECT file_name FROM files")}
+
+        for file_name in indexed_files - parquet_files:
+            self.connection.execute("DELETE FROM gddids WHERE file_name = ?", (file_name,))
+            self.connection.execute("DELETE FROM files WHERE file_name = ?", (file_name,))
+        self.connection.commit()
+
+        for file_name in sorted(parquet_files - indexed_files):
+            # Read only the ID column from the Parquet file
+            gddids = pq.read_table(os.path.join(self.parquet_path, file_name), columns=["gddid"])["gddid"]
+            self.add_file(file_name, gddids.to_pylist())
+
+        if parquet_files != indexed_files:
+            logger.info(
+                f"gddid index updated, {len(parquet_files - indexed_files)} files added, "
+                f"{len(indexed_files - parquet_files)} removed."
+            )
+
+    def add_file(self, file_name, gddids):
+        """Indexes the gddids of a parquet file in the folder.
+
+        Args:
+            file_name (str): Name of the parquet file.
+            gddids (list): The gddids in the file.
+        """
+        self.connection.execute("DELETE FROM gddids WHERE file_name = ?", (file_name,))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (file_name, run_date) VALUES (?, ?)",
+            (file_name, get_run_date(file_name)),
+        )
+        self.connection.executemany(
+            "INSERT INTO gddids (gddid, file_name) VALUES (?, ?)",
+            [(str(gddid), file_name) for gddid in gddids],
+        )
+        self.connection.commit()
+
+    def n_files(self):
+        """Gets the number of indexed parquet files."""
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def find_existing(self, gddids):
+        """Finds which gddids are in an indexed parquet file.
+
+        Args:
+            gddids (list): The gddids to look up.
+
+        Return:
+            set of the gddids already processed.
+        """
+        unique_gddids = list(dict.fromkeys(str(gddid) for gddid in gddids))
+
+        existing = set()
+        for i in range(0, len(unique_gddids), SQLITE_MAX_PARAMS):
+            gddid_chunk = unique_gddids[i : i + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(gddid_chunk))
+            existing.update(
+                gddid
+                for (gddid,) in self.connection.execute(
+                    f"SELECT DISTINCT gddid FROM gddids WHERE gddid IN ({placeholders})", gddid_chunk
+                )
+            )
+
+        return existing
+
+    def max_run_date(self):
+        """Gets the date of the last pipeline run.
+
+        Return:
+            Date as a string in yyyy-mm-dd format, None if no prediction file is indexed.
+        """
+        return self.connection.execute("SELECT MAX(run_date) FROM files").fetchone()[0]
+
+    def close(self):
+        """Closes the database connection."""
+        self.connection.close()
@@ -0,0 +1,377 @@
+# Author Kelly Wu
+# 2023-07-04
+
+# Batched language detection of article text with a result cache
+
+import os
+import sys
+import re
+import hashlib
+import sqlite3
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langdetect import DetectorFactory, detect
+from langdetect.detector import Detector
+from langdetect.detector_factory import init_factory
+from langdetect.utils.ngram import NGram
+
+# Locate src module
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# name of the language detector used, a key of LANGUAGE_DETECTORS
+LANGUAGE_DETECTOR = os.getenv("LANGUAGE_DETECTOR", "ngram")
+LANGUAGE_DETECTION_WORKERS = int(os.getenv("LANGUAGE_DETECTION_WORKERS", "1"))
+
+# detected languages are kept in a sqlite table at this path between runs,
+# by default in the CrossRef cache database
+LANGUAGE_CACHE_PATH = os.getenv("LANGUAGE_CACHE_PATH", os.getenv("CROSSREF_CACHE_PATH"))
+# number of detected languages kept in memory, the least recently used are dropped first
+LANGUAGE_CACHE_SIZE = int(os.getenv("LANGUAGE_CACHE_SIZE", "100000"))
+
+# language caches keyed by database path, None for memory only
+LANGUAGE_CACHES = {}
+LANGUAGE_DETECTOR_CACHE = {}
+
+# sqlite limits the number of bound parameters per statement
+SQLITE_MAX_PARAMS = 500
+
+# language returned when no language can be detected
+ERROR_LANGUAGE = "error"
+
+# langdetect only reads the start of long texts
+MAX_TEXT_LENGTH = 10000
+
+# langdetect means to count Latin Extended Additional as latin but compares
+# the block id to a string, so it is counted as non latin here too
+NON_LATIN_PATTERN = re.compile("[\u0300-\U0010ffff]")
+LATIN_PATTERN = re.compile("[A-z]")
+SPACES_PATTERN = re.compile(" {2,}")
+
+
+class LangdetectLanguageDetector:
+    """Detects languages with langdetect, seeded so results are repeatable."""
+
+    def __init__(self):
+        DetectorFactory.seed = 0
+
+    def detect(self, text):
+        """Detects the language of a text.
+
+        Args:
+            text (str): The text.
+
+        Return:
+            str language code, 'error' if it can't be detected.
+        """
+        try:
+            return detect(text)
+        except Exception:
+            logger.info(f"This text throws an error: {text}")
+            return ERROR_LANGUAGE
+
+
+class NgramLanguageDetector:
+    """Naive Bayes character n-gram language detector using the language
+    profiles shipped with langdetect.
+
+    langdetect estimates the language from several random samples of the
+    text's n-grams. This detector scores every n-gram once instead, so the
+    result doesn't depend on a seed and a text is scored with a single sum
+    over a log probability matrix. The summed scores of each distinct word
+    are cached as most words repeat across articles.
+    """
+
+    def __init__(self):
+        init_factory()
+        from langdetect.detector_factory import _factory
+
+        self.factory = _factory
+        self.langlist = _factory.langlist
+
+        ngrams = list(_factory.word_lang_prob_map)
+        self.ngram_rows = {ngram: row for row, ngram in enumerate(ngrams)}
+        # same smoothing as langdetect with its default alpha
+        self.log_probs = np.log(
+            np.array([_factory.word_lang_prob_map[ngram] for ngram in ngrams], dtype=np.float64)
+            + Detector.ALPHA_DEFAULT / Detector.BASE_FREQ
+        )
+
+        self.char_cache = {}
+        self.word_cache = {}
+
+    def clean_text(self, text):
+        """Cleans and normalizes a text as langdetect does before extracting n-grams.
+
+        Args:
+            text (str): The text.
+
+        Return:
+            str normalized text.
+        """
+        text = Detector.URL_RE.sub(" ", text)
+        text = Detector.MAIL_RE.sub(" ", text)
+        text = NGram.normalize_vi(text)
+        text = SPACES_PATTERN.sub(" ", text[:MAX_TEXT_LENGTH])
+
+        # drop latin characters from text mostly written in another alphabet
+        n_latin = len(LATIN_PATTERN.findall(text))
+        if n_latin * 3 < len(text) and n_latin * 2 < len(NON_LATIN_PATTERN.findall(text)):
+            text = LATIN_PATTERN.sub("", text)
+
+        chars = set(text)
+        for char in chars:
+            if char not in self.char_cache:
+                self.char_cache[char] = NGram.normalize(char)
+
+        return text.translate(str.maketrans({char: self.char_cache[char] for char in chars}))
+
+    def get_word_scores(self, word, is_last):
+        """Gets the log probability of the n-grams of a word in each language.
+
+        Args:
+            word (str): A normalized word without spaces.
+            is_last (bool): Whether the word ends the text, so isn't followed by a space.
+
+        Return:
+            tuple of the number of the word's n-grams found in the profiles
+            and np.ndarray of their summed log probability in each language.
+        """
+        key = (word, is_last)
+        if key in self.word_cache:
+            return self.word_cache[key]
+
+        padded = " " + word if is_last else " " + word + " "
+        rows = []
+        previous_upper = False
+        for i in range(1, len(padded)):
+            char = padded[i]
+            # words in capitals are skipped after their first letter, as in langdetect
+            is_upper = char.isupper()
+            capital_word = is_upper and previous_upper
+            previous_upper = is_upper
+            if capital_word:
+                continue
+            grams = padded[max(0, i - 2) : i + 1]
+            for n in range(1, len(grams) + 1):
+                gram = grams[-n:]
+                if gram != " " and gram in self.ngram_rows:
+                    rows.append(self.ngram_rows[gram])
+
+        self.word_cache[key] = (len(rows), self.log_probs[rows].sum(axis=0))
+
+        return self.word_cache[key]
+
+    def detect(self, text):
+        """Detects the language of a text.
+
+        Args:
+            text (str): The text.
+
+        Return:
+            str language code, 'error' if it can't be detected.
+        """
+        words = self.clean_text(text).split(" ")
+        # the last word isn't followed by a space so has different n-grams
+        last_word = words.pop()
+        word_counts = Counter(words)
+        word_counts.pop("", None)
+
+        counts = np.fromiter(word_counts.values(), dtype=np.float64, count=len(word_counts))
+        word_scores = [self.get_word_scores(word, False) for word in word_counts]
+        if last_word:
+            counts = np.append(counts, 1)
+            word_scores.append(self.get_word_scores(last_word, True))
+
+        if not any(n_ngrams for n_ngrams, _ in word_scores):
+            logger.info(f"This text throws an error: {text}")
+            return ERROR_LANGUAGE
+
+        scores = counts @ np.array([scores for _, scores in word_scores])
+
+        return self.langlist[int(scores.argmax())]
+
+
+class LanguageCache:
+    """Least recently used cache of detected languages keyed by detector and
+    text hash, optionally backed by a sqlite table so later runs reuse it.
+
+    Args:
+        cache_path (str): Path to the sqlite database file, None to only cache in memory.
+        max_entries (int): Number of languages kept in memory.
+    """
+
+    def __init__(self, cache_path = None, max_entries = LANGUAGE_CACHE_SIZE):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.languages = OrderedDict()
+        self.connection = None
+
+        if cache_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            self.connection = sqlite3.connect(cache_path, timeout=60)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS languages (
+                    detector TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    PRIMARY KEY (detector, text_hash)
+                )"""
+            )
+            self.connection.commit()
+
+    def __len__(self):
+        return len(self.languages)
+
+    def remember(self, key, language):
+        """Keeps a language in memory, dropping the least recently used.
+
+        Args:
+            key (tuple): The detector name and text hash.
+            language (str): The detected language.
+        """
+        self.languages[key] = language
+        self.languages.move_to_end(key)
+        while len(self.languages) > self.max_entries:
+            self.languages.popitem(last=False)
+
+    def get_many(self, keys):
+        """Looks up the detected languages of many texts.
+
+        Args:
+            keys (list): The detector name and text hash of each text.
+
+        Return:
+            dict of the cached languages keyed by detector name and text hash.
+        """
+        cached = {}
+        missing = {}
+        for key in keys:
+            if key in self.languages:
+                self.languages.move_to_end(key)
+                cached[key] = self.languages[key]
+            else:
+                missing.setdefault(key[0], []).append(key[1])
+
+        if self.connection is not None:
+            for detector, text_hashes in missing.items():
+                text_hashes = list(dict.fromkeys(text_hashes))
+                for i in range(0, len(text_hashes), SQLITE_MAX_PARAMS):
+                    hash_chunk = text_hashes[i : i + SQLITE_MAX_PARAMS]
+                    placeholders = ",".join("?" * len(hash_chunk))
+                    for text_hash, language in self.connection.execute(
+                        f"SELECT text_hash, language FROM languages WHERE detector = ? AND text_hash IN ({placeholders})",
+                        [detector] + hash_chunk,
+                    ):
+                        cached[(detector, text_hash)] = language
+                        self.remember((detector, text_hash), language)
+
+        return cached
+
+    def put_many(self, languages):
+        """Stores the detected languages of many texts.
+
+        Args:
+            languages (dict): The languages keyed by detector name and text hash.
+        """
+        for key, language in languages.items():
+            self.remember(key, language)
+
+        if self.connection is not None:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO languages (detector, text_hash, language) VALUES (?, ?, ?)",
+                [(detector, text_hash, language) for (detector, text_hash), language in languages.items()],
+            )
+            self.connection.commit()
+
+    def clear(self):
+        """Empties the in-memory cache."""
+        self.languages.clear()
+
+
+def get_language_cache(cache_path = LANGUAGE_CACHE_PATH):
+    """Gets the language cache of a database, opening it on first use.
+
+    Args:
+        cache_path (str): Path to the sqlite database file, None to only cache in memory.
+
+    Return:
+        LanguageCache of the database.
+    """
+    if cache_path not in LANGUAGE_CACHES:
+        LANGUAGE_CACHES[cache_path] = LanguageCache(cache_path)
+
+    return LANGUAGE_CACHES[cache_path]
+
+
+LANGUAGE_DETECTORS = {
+    "ngram": NgramLanguageDetector,
+    "langdetect": LangdetectLanguageDetector,
+}
+
+
+def get_language_detector(detector = LANGUAGE_DETECTOR):
+    """Gets a language detector, creating it on first use.
+
+    Args:
+        detector (str): Name of the detector, a key of LANGUAGE_DETECTORS.
+
+    Return:
+        The language detector.
+    """
+    if detector not in LANGUAGE_DETECTORS:
+        raise ValueError(f"Unknown language detector {detector}, use one of {list(LANGUAGE_DETECTORS)}.")
+
+    if detector not in LANGUAGE_DETECTOR_CACHE:
+        logger.info(f"Loading {detector} language detector.")
+        LANGUAGE_DETECTOR_CACHE[detector] = LANGUAGE_DETECTORS[detector]()
+
+    return LANGUAGE_DETECTOR_CACHE[detector]
+
+
+def detect_languages(texts,
+                     detector = LANGUAGE_DETECTOR,
+                     max_workers = LANGUAGE_DETECTION_WORKERS,
+                     cache_path = LANGUAGE_CACHE_PATH):
+    """Detects the language of many texts, each distinct text only once.
+
+    Args:
+        texts (list): The texts.
+        detector (str): Name of the detector, a key of LANGUAGE_DETECTORS.
+        max_workers (int): Number of threads detecting languages.
+        cache_path (str): Path to the sqlite database the languages are cached in, None to only cache in memory.
+
+    Return:
+        list of the language code of each text, 'error' where it can't be detected.
+    """
+    language_detector = get_language_detector(detector)
+    language_cache = get_language_cache(cache_path)
+
+    keys = [(detector, hashlib.sha1(text.encode("utf-8")).hexdigest()) for text in texts]
+    cached = language_cache.get_many(keys)
+    new_texts = {}
+    for key, text in zip(keys, texts):
+        if key not in cached:
+            new_texts[key] = text
+
+    logger.info(f"Detecting the language of {len(new_texts)} texts, {len(texts) - len(new_texts)} cached.")
+
+    if max_workers > 1 and len(new_texts) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            languages = list(executor.map(language_detector.detect, new_texts.values()))
+    else:
+        languages = [language_detector.detect(text) for text in new_texts.values()]
+
+    detected = dict(zip(new_texts.keys(), languages))
+    language_cache.put_many(detected)
+    cached.update(detected)
+
+    return [cached[key] for key in keys]
@@ -3,7 +3,7 @@
 
 # Using corrected article relevance data to retrain the logistic regressio model
 # Input: directory with the JSON files of new relevant articles & the parquet file with article info of the batch
-# Output: Model object to be used for running the prediction pipeline
+# Output: Model object to be used for running the prediction pipeline, and its .npz linear scorer
 
 # Process Overview:
 # - Gather the list of new data for training
@@ -16,20 +16,22 @@
 # Assumption:
 # - All parquet files generated by the article relevance pipeline is stored in one folder
 # - All new articles's reviewed data outputted from data review tool are stored in one folder, with subfolders for each batch.
-# - Each parquet file contains doi, metadata, sentence embeddings, i.e. all info required for retraining
+# - Each parquet file contains doi, metadata, sentence embeddings, i.e. all info required for retraining.
+#   When the sentence embeddings are not in the files they are loaded from the embedding store by DOI.
 # - Parquet column "status" indicate review status, where "Non-relevant" articles are negative examples, "Completed" articles are positive examples.
 
 """
 This script takes in original or newly reviewed article data and train the logistic regression model.
 
-Usage: relevance_prediction_model_retrain.py --use_reviewed_data=<use_reviewed_data> --train_data_path=<train_data_path> --model_folder=<model_folder> --result_dir=<result_dir> [--reviewed_folder_path=<reviewed_folder_path>]
+Usage: relevance_prediction_model_retrain.py --use_reviewed_data=<use_reviewed_data> --train_data_path=<train_data_path> --model_folder=<model_folder> --result_dir=<result_dir> [--reviewed_folder_path=<reviewed_folder_path>] [--embedding_store_path=<embedding_store_path>]
 
 Options:
     --use_reviewed_data=<use_reviewed_data>         Whether reviewed data is used in the retraining. By default is True. If False, original model will be reproduced.
     --train_data_path=<train_data_path>             The path to the CSV file where the original model's training data are stored.
-    --model_folder=<model_folder>                   The path to where the retrained model will be saved.
+    --model_folder=<model_folder>                   The path to where the retrained model and its .npz scorer will be saved.
     --result_dir=<result_dir>                       The path to where the retrained model's evaluation files will be saved. 
     --reviewed_folder_path=<reviewed_folder_path>   The path to where data reviewed tool save the reviewed parquet file.
+    --embedding_store_path=<embedding_store_path>   The path to the embedding store, used for articles whose embeddings are not in the data files.
 """
 
 import os
@@ -58,15 +60,49 @@ src_dir = os.path.dirname(current_dir)
 sys.path.append(src_dir)
 
 from logs import get_logger
+from article_relevance.embedding_store import (EmbeddingStore, add_store_embeddings, add_embedding_columns,
+                                              read_embedding_parquet)
+from article_relevance.relevance_scorer import LinearRelevanceScorer
 logger = get_logger(__name__) # this gets the object with the current modules name
 
-def train_data_load_split(train_raw_csv_path):
+EMBEDDING_COL = [str(i) for i in range(0,768)]
+
+
+def load_missing_embeddings(input_df, embedding_store_path, model_name = 'allenai/specter2'):
+    '''
+    Load the sentence embeddings from the embedding store when the data doesn't include them.
+    Articles without a stored embedding are dropped.
+
+    Args:
+        input_df (pd Dataframe)  Article data with a DOI column.
+        embedding_store_path (str)  The path to the embedding store, None to leave the data unchanged.
+        model_name (str)  Name of the model the embeddings were made with.
+
+    Return:
+        pandas Data frame with the embedding columns.
+    '''
+    if embedding_store_path is None or set(EMBEDDING_COL).issubset(input_df.columns):
+        return input_df
+
+    store = EmbeddingStore(embedding_store_path, model_name = model_name)
+    input_df = input_df.drop(columns = [col for col in EMBEDDING_COL if col in input_df.columns])
+    input_df, embeddings = add_store_embeddings(input_df, store)
+
+    missing = np.isnan(embeddings).any(axis = 1)
+    if missing.any():
+        logger.warning(f'Data Loading - Dropping {missing.sum()} articles without embeddings.')
+
+    # the model pipeline takes the embeddings as the '0'..'767' columns
+    return add_embedding_columns(input_df.loc[~missing], embeddings[~missing])
+
+def train_data_load_split(train_raw_csv_path, embedding_store_path = None):
     '''
     Load the old sample used in the original model training.
     Return the train, validation, and test split as three dataframes.
 
     Args:
         train_raw_csv_path (str)    The path to the original training data file metadata_processed.csv.
+        embedding_store_path (str)  The path to the embedding store, used when the file has no embeddings.
 
     Return:
         Three pandas Data frames: train_df, valid_df, test_df
@@ -77,6 +113,7 @@ def train_data_load_split(train_raw_csv_path):
 
     # load original training sample
     metadata_df = pd.read_csv(train_raw_csv_path, index_col=0)
+    metadata_df = load_missing_embeddings(metadata_df, embedding_store_path)
     
     metadata_df['text_with_abstract'].fillna("", inplace=True)
     metadata_df['subject_clean'].fillna("", inplace=True)
@@ -101,7 +138,7 @@ def train_data_load_split(train_raw_csv_path):
     return train_df, valid_df, test_df
 
 
-def retrain_data_load_split(reviewed_parquet_folder_path):
+def retrain_data_load_split(reviewed_parquet_folder_path, embedding_store_path = None):
     '''
     Get a DOI list of reviewed articles (i.e. status is completed/irrelevant).
     Retrieve their metadata and split into train/valid/test sets.
@@ -109,6 +146,7 @@ def retrain_data_load_split(reviewed_parquet_folder_path):
 
     Args:
         reviewed_parquet_folder_path (str)  The path to the folder storing reviewed articles parquet files.
+        embedding_store_path (str)  The path to the embedding store, used when the files have no embeddings.
 
     Return:
         Three pandas Data frames: train_df, valid_df, test_df
@@ -124,17 +162,23 @@ def retrain_data_load_split(reviewed_parquet_folder_path):
             # Construct the file path
             file_path = os.path.join(reviewed_parquet_folder_path, file_name)
 
-            # Read the parquet file into a dataframe
-            onefile_df = pd.read_parquet(file_path)
+            # Read the parquet file into a dataframe and its embedding matrix
+            onefile_df, embeddings = read_embedding_parquet(file_path)
 
             # Filter rows based on the "status" column
-            filtered_df = onefile_df[onefile_df['status'].isin(['Non-relevant', 'Completed'])]
+            reviewed = onefile_df['status'].isin(['Non-relevant', 'Completed']).to_numpy()
+            filtered_df = onefile_df.loc[reviewed]
+
+            # the model pipeline takes the embeddings of the reviewed articles as the '0'..'767' columns
+            if embeddings is not None:
+                filtered_df = add_embedding_columns(filtered_df, embeddings[reviewed])
 
             # Append the filtered dataframe to the list
             result_df.append(filtered_df)
 
     # Concatenate all dataframes into a single dataframe
     return_df = pd.concat(result_df, ignore_index=True)
+    return_df = load_missing_embeddings(return_df, embedding_store_path)
     return_df = return_df.rename(columns={'subject': 'subject_clean',
                                     'title_with_abstract': 'text_with_abstract'})
     
@@ -210,7 +254,7 @@ def model_train(train_df, model_dir, model_c = 0.01563028103558011):
         raise ValueError(f"Column 'target' contains NaN values.")
     
     # ======= only keep feature columns ==========
-    keep_col = ['target', 'has_abstract', 'subject_clean', 'is-referenced-by-count'] + [str(i) for i in range(0,768)]
+    keep_col = ['target', 'has_abstract', 'subject_clean', 'is-referenced-by-count'] + EMBEDDING_COL
     columns_to_drop = set(train_df.columns) - set(keep_col)
     train_df = train_df.drop(columns=columns_to_drop)
 
@@ -257,6 +301,8 @@ def model_train(train_df, model_dir, model_c = 0.01563028103558011):
 
     model_file_name = os.path.join(model_dir, f"retrained_model_{formatted_datetime}.joblib")
     joblib.dump(logreg_model, model_file_name)
+    # the flattened scorer loads without sklearn for prediction
+    LinearRelevanceScorer.from_pipeline(logreg_model).save_npz(model_file_name.replace(".joblib", ".npz"))
 
     logger.info(f'Training - Training completed.')
 
@@ -285,7 +331,7 @@ def model_eval(model, valid_df, test_df, report_dir):
         os.makedirs(report_dir)
 
     # ======= Only keep feature columns ==========
-    keep_col = ['target', 'has_abstract', 'subject_clean', 'is-referenced-by-count'] + [str(i) for i in range(0,768)]
+    keep_col = ['target', 'has_abstract', 'subject_clean', 'is-referenced-by-count'] + EMBEDDING_COL
     columns_to_drop = set(valid_df.columns) - set(keep_col)
     valid_df = valid_df.drop(columns=columns_to_drop)
     test_df = test_df.drop(columns=columns_to_drop)
@@ -375,9 +421,11 @@ def main():
     reviewed_folder_path = opt["--reviewed_folder_path"]
     model_folder = opt["--model_folder"]
     result_dir = opt["--result_dir"]
+    embedding_store_path = opt["--embedding_store_path"] or None
 
     # Load original training data
-    train_df_old, valid_df_old, test_df_old = train_data_load_split(train_raw_csv_path = train_data_path)
+    train_df_old, valid_df_old, test_df_old = train_data_load_split(train_raw_csv_path = train_data_path,
+                                                                      embedding_store_path = embedding_store_path)
     
     # If use_reviewed_data = True, load reviewed data and merge
     if use_reviewed_data == '' or use_reviewed_data is None or use_reviewed_data.lower() == "false":
@@ -387,7 +435,7 @@ def main():
         test_df_merged = test_df_old
     else:
         # load new data and merge
-        train_df_new, valid_df_new, test_df_new = retrain_data_load_split(reviewed_folder_path)
+        train_df_new, valid_df_new, test_df_new = retrain_data_load_split(reviewed_folder_path, embedding_store_path)
         train_df_merged, valid_df_merged, test_df_merged = retrain_data_merge(train_df_old, train_df_new, valid_df_old, valid_df_new, test_df_old, test_df_new)
 
     retrained_model = model_train(train_df_merged, model_folder, model_c = 0.01563028103558011)
@@ -11,7 +11,7 @@ Usage: relevance_prediction_parquet.py --doi_file_path=<doi_path> --model_path=<
 
 Options:
     --doi_file_path=<doi_file_path>         The path to where the list of DOI is.
-    --model_path=<model_path>               The path to where the model object is stored.
+    --model_path=<model_path>               The path to where the model object, or the .npz scorer exported from it, is stored.
     --output_path=<output_path>             The path to where the output files will be saved.
     --send_xdd=<send_xdd>                   When True, relevant articles will be sent to xDD through API query. Default is False.
 """
@@ -21,14 +21,19 @@ import datetime
 import json
 import requests
 import sys
-from langdetect import detect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sentence_transformers import SentenceTransformer
-import joblib
 from docopt import docopt
 import pyarrow as pa
 import pyarrow.parquet as pq
+import pyarrow.compute as pc
 import pandas as pd
 import numpy as np
+import torch
 
 # Locate src module
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -36,19 +41,188 @@ src_dir = os.path.dirname(current_dir)
 sys.path.append(src_dir)
 
 from logs import get_logger
+from article_relevance.crossref_cache import CrossRefCache
+from article_relevance.embedding_store import (EmbeddingStore, EMBEDDING_COLUMN, embeddings_to_arrow,
+                                              add_embedding_columns)
+from article_relevance.gddid_index import GddidIndex
+from article_relevance.language_detection import detect_languages
+from article_relevance.relevance_scorer import load_relevance_scorer, SCORING_CHUNK_SIZE
 
 logger = get_logger(__name__) # this gets the object with the current modules name
 
+CROSSREF_API_URL = os.getenv("CROSSREF_API_URL", "https://api.crossref.org/works")
+CROSSREF_USER_AGENT = "Neotoma-Article-Relevance-Tool (mailto:goring@wisc.edu)"
 
-def crossref_extract(doi_path):
+# CrossRef's polite pool allows a few concurrent requests at ~10 requests/s
+CROSSREF_MAX_WORKERS = int(os.getenv("CROSSREF_MAX_WORKERS", "3"))
+CROSSREF_RATE_LIMIT = float(os.getenv("CROSSREF_RATE_LIMIT", "10"))
+CROSSREF_MAX_RETRIES = int(os.getenv("CROSSREF_MAX_RETRIES", "5"))
+CROSSREF_BACKOFF_FACTOR = 1
+
+# responses are cached on disk when a cache path is set
+CROSSREF_CACHE_PATH = os.getenv("CROSSREF_CACHE_PATH")
+CROSSREF_CACHE_TTL_DAYS = float(os.getenv("CROSSREF_CACHE_TTL_DAYS", "30"))
+# serve metadata from the cache only, without querying CrossRef
+CROSSREF_OFFLINE = os.getenv("CROSSREF_OFFLINE", "False") == "True"
+
+# number of texts embedded per forward pass
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+# sentence embedding models loaded in this process keyed by model name
+EMBEDDING_MODEL_CACHE = {}
+
+# embeddings are kept in a store keyed by DOI instead of the output parquet
+# files when a store path is set
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH")
+
+EMBEDDING_COL = [str(i) for i in range(0,768)]
+
+# jats tags removed from the abstracts, in this order
+JATS_TAG_PATTERN = '<(jats|/jats):(p|sec|title|italic|sup|sub)>'
+JATS_BLOCK_PATTERN = '<(jats|/jats):(list|inline-graphic|related-article).*>'
+
+# compression codec of the prediction parquet files
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+# also export the predictions as CSV, with the embeddings as 768 columns
+EXPORT_CSV = os.getenv("EXPORT_CSV", "False") == "True"
+CROSSREF_TIMEOUT = 60
+
+
+class RateLimiter:
+    """Spaces out requests shared across threads to stay under a rate limit.
+
+    Args:
+        rate (float): Maximum number of requests per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the next request is allowed to be sent."""
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(self.next_time, now) + self.interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def update_from_headers(self, headers):
+        """Slows down to the rate limit CrossRef reports in its response headers.
+
+        Args:
+            headers (dict): The response headers.
+        """
+        try:
+            limit = int(headers["X-Rate-Limit-Limit"])
+            interval = float(headers["X-Rate-Limit-Interval"].rstrip("s"))
+        except (KeyError, ValueError):
+            return
+
+        if limit > 0 and interval / limit > self.interval:
+            with self.lock:
+                self.interval = interval / limit
+            logger.info(f"CrossRef rate limit lowered to {limit} requests per {interval}s.")
+
+
+def get_crossref_session(max_workers = CROSSREF_MAX_WORKERS,
+                         max_retries = CROSSREF_MAX_RETRIES,
+                         backoff_factor = CROSSREF_BACKOFF_FACTOR):
+    """Creates a pooled session that retries failed CrossRef requests with
+    exponential backoff, honouring any Retry-After header.
+
+    Args:
+        max_workers (int): Number of threads sharing the session's connections.
+        max_retries (int): Number of times a request is retried.
+        backoff_factor (float): Base of the exponential backoff in seconds.
+
+    Return:
+        requests.Session to query CrossRef with.
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry
+    )
+
+    session = requests.Session()
+    session.headers.update({"User-Agent": CROSSREF_USER_AGENT})
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def fetch_crossref_response(doi, session, rate_limiter, base_url = CROSSREF_API_URL):
+    """Fetches the CrossRef metadata of a single DOI.
+
+    Args:
+        doi (str): The DOI to query.
+        session (requests.Session): Session from get_crossref_session.
+        rate_limiter (RateLimiter): Rate limiter shared by all threads.
+        base_url (str): The CrossRef works endpoint.
+
+    Return:
+        tuple of the response status code, None if the request failed, and
+        the article's metadata, None if it could not be retrieved.
+    """
+    rate_limiter.wait()
+
+    try:
+        cross_ref_response = session.get(f"{base_url}/{doi}", timeout = CROSSREF_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"CrossRef request failed for DOI {doi}: {e}")
+        return None, None
+
+    rate_limiter.update_from_headers(cross_ref_response.headers)
+
+    if cross_ref_response.status_code != 200:
+        logger.info(f"DOI {doi} not found on CrossRef, status code {cross_ref_response.status_code}.")
+        return cross_ref_response.status_code, None
+
+    try:
+        message = cross_ref_response.json()['message']
+    except (ValueError, KeyError, TypeError) as e:
+        # a malformed body isn't a definitive answer, so it's treated as failed and not cached
+        logger.warning(f"CrossRef returned a malformed response for DOI {doi}: {e}")
+        return None, None
+
+    return cross_ref_response.status_code, message
+
+
+def crossref_extract(doi_path,
+                     base_url = CROSSREF_API_URL,
+                     max_workers = CROSSREF_MAX_WORKERS,
+                     rate_limit = CROSSREF_RATE_LIMIT,
+                     cache_path = CROSSREF_CACHE_PATH,
+                     cache_ttl_days = CROSSREF_CACHE_TTL_DAYS,
+                     offline = CROSSREF_OFFLINE):
     """Extract metadata from the Crossref API for article's in the doi csv file.
     Extracted data are returned in a pandas dataframe.
 
     If certain DOI is not found on CrossRef, the DOI will be logged in the prediction_pipeline.log file. 
     
+    DOIs are queried concurrently over a shared pooled session, rate limited
+    to stay within CrossRef's polite pool. When a cache path is set, DOIs
+    fetched within the cache's time to live are not queried again.
+
     Args:
         doi_path (str): Path to the doi list JSON file.
-        doi_col (str): Column name of DOI.
+        base_url (str): The CrossRef works endpoint.
+        max_workers (int): Number of concurrent requests.
+        rate_limit (float): Maximum number of requests per second.
+        cache_path (str): Path to the CrossRef cache database, None to disable caching.
+        cache_ttl_days (float): Number of days a cached response is used.
+        offline (bool): When True only cached metadata is used, CrossRef is not queried.
     
     Return:
         pandas Dataframe containing CrossRef metadata.
@@ -71,33 +245,59 @@ def crossref_extract(doi_path):
     # a list of doi
     input_doi = df[doi_col].unique().tolist()
 
-    # Initialize
-    crossref = pd.DataFrame()
-
-    logger.info("Querying CrossRef API for article metadata.")
-
-    # Loop through all doi, concatenate metadata into dataframe
+    # metadata keyed by lower-cased doi, None for doi not found on CrossRef
+    messages = {}
+    cache = None
+    if cache_path is not None:
+        cache = CrossRefCache(cache_path, ttl_days = cache_ttl_days)
+        messages = cache.get_many(input_doi)
+        cache.log_stats()
+    elif offline:
+        logger.warning("CrossRef offline mode is set without a cache, no metadata is available.")
+
+    fetch_doi = [doi for doi in input_doi if doi.lower() not in messages]
+
+    if offline:
+        logger.info(f"Offline mode, skipping CrossRef query for {len(fetch_doi)} uncached articles.")
+        fetch_doi = []
+
+    if fetch_doi:
+        logger.info(f"Querying CrossRef API for {len(fetch_doi)} articles' metadata.")
+
+        session = get_crossref_session(max_workers = max_workers)
+        rate_limiter = RateLimiter(rate_limit)
+
+        # Query the doi concurrently, keeping only definitive answers for the cache
+        fetched = {}
+        with session, ThreadPoolExecutor(max_workers = max_workers) as executor:
+            responses = executor.map(
+                lambda doi: fetch_crossref_response(doi, session, rate_limiter, base_url),
+                fetch_doi,
+            )
+            for doi, (status_code, message) in zip(fetch_doi, responses):
+                if status_code in (200, 404):
+                    fetched[doi.lower()] = message
+
+        if cache is not None:
+            cache.put_many(fetched)
+        messages.update(fetched)
+
+    if cache is not None:
+        cache.close()
+
+    # Collect the metadata rows in input order
+    ref_rows = []
     for doi in input_doi:
-        cross_ref_url = f"https://api.crossref.org/works/{doi}"
-
-         # make a request to the API
-        cross_ref_response = requests.get(cross_ref_url,
-            headers={"User-Agent":"Neotoma-Article-Relevance-Tool (mailto:goring@wisc.edu)"},
-            timeout = 600)
-
-        if cross_ref_response.status_code == 200:
-
-            ref_json = pd.DataFrame(cross_ref_response.json())
-            ref_df = pd.DataFrame(ref_json.loc[:, 'message']).T.reset_index()
-            ref_df['valid_for_prediction'] = 1
-            if 'abstract' not in ref_df.columns:
-                ref_df['abstract'] = ''
-            crossref = pd.concat([crossref, ref_df])
-
-        else: 
-            pass
+        ref_row = messages.get(doi.lower())
+        if ref_row is None:
+            continue
+        ref_row['valid_for_prediction'] = 1
+        if 'abstract' not in ref_row:
+            ref_row['abstract'] = ''
+        ref_rows.append(ref_row)
+    crossref = pd.DataFrame(ref_rows)
     
-    logger.info(f'CrossRef API query completed for {len(input_doi)} articles.')
+    logger.info(f'CrossRef metadata retrieved for {crossref.shape[0]} of {len(input_doi)} articles.')
 
     
     # Clean up columns and return the resulting pandas data frame
@@ -115,7 +315,7 @@ def crossref_extract(doi_path):
         'title'
         ]
     
-    crossref = crossref.loc[:, crossref_keep_col].reset_index(drop = True)
+    crossref = crossref.reindex(columns = crossref_keep_col).reset_index(drop = True)
 
 
     # join gddid to the metadata df
@@ -136,18 +336,69 @@ def crossref_extract(doi_path):
     return result_df
 
 
-def en_only_helper(value):
-    ''' Helper function for en_only. 
-    Apply row-wise to impute missing language data.'''
-     
+def join_text(column, sep = ''):
+    """
+    Join each article's list of text in a CrossRef metadata column into an
+    arrow string array, empty where the metadata is missing.
+
+    Args:
+        column (pd Series): Column with a list of text or the text of each article.
+        sep (str): Separator between the joined text.
+
+    Returns:
+        pyarrow StringArray of the joined text.
+    """
     try:
-        detect_lang = detect(value)
-    except:
-        detect_lang = "error"
-        logger.info("This text throws an error:", value)
-     
-    return detect_lang
-     
+        text = pa.array(column, from_pandas = True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        text = None
+
+    if text is not None and text.null_count == len(text):
+        return pa.array([''] * len(column), pa.string())
+    if text is not None and pa.types.is_list(text.type) and pa.types.is_null(text.type.value_type):
+        # only empty lists
+        text = text.cast(pa.list_(pa.string()))
+    if text is not None and pa.types.is_list(text.type) and pa.types.is_string(text.type.value_type):
+        return pc.fill_null(pc.binary_join(text, sep), '')
+    if text is not None and pa.types.is_string(text.type) and sep == '':
+        return pc.fill_null(text, '')
+
+    # mixed lists and text are joined row by row
+    return pa.array(column.fillna(value='').apply(lambda x: sep.join(x)), pa.string())
+
+
+def clean_text(metadata_df):
+    """
+    Clean up title, subtitle, journal, abstract and subject with arrow compute
+    kernels and concatenate the descriptive text of each article.
+
+    Args:
+        metadata_df (pd DataFrame): CrossRef metadata.
+
+    Returns:
+        dict of the cleaned pd Series keyed by column name.
+    """
+    title = join_text(metadata_df['title'])
+    subtitle = join_text(metadata_df['subtitle'])
+
+    # Remove tags from abstract
+    abstract = join_text(metadata_df['abstract'])
+    abstract = pc.replace_substring_regex(abstract, pattern = JATS_TAG_PATTERN, replacement = ' ')
+    abstract = pc.replace_substring_regex(abstract, pattern = JATS_BLOCK_PATTERN, replacement = ' ')
+
+    cleaned = {
+        'subject_clean': join_text(metadata_df['subject'], sep = ' '),
+        'title_clean': title,
+        'subtitle_clean': subtitle,
+        'journal': join_text(metadata_df['journal']),
+        'abstract_clean': abstract,
+        # Concatenate descriptive text
+        'text_with_abstract': pc.binary_join_element_wise(title, subtitle, abstract, ' '),
+    }
+
+    return {name: pd.Series(text.to_pandas(), index = metadata_df.index, dtype = object)
+            for name, text in cleaned.items()}
+
 
 def data_preprocessing(metadata_df):
     """
@@ -167,25 +418,13 @@ def data_preprocessing(metadata_df):
 
     metadata_df = metadata_df.reset_index(drop = True)
 
-    # Clean text in Subject
-    metadata_df['subject_clean'] = metadata_df['subject'].fillna(value='').apply(lambda x: ' '.join(x))
-
-    # Clean text in title, subtitle, abstract
-    metadata_df['title_clean'] = metadata_df['title'].fillna(value='').apply(lambda x: ''.join(x))
-    metadata_df['subtitle_clean'] = metadata_df['subtitle'].fillna(value='').apply(lambda x: ''.join(x))
-    metadata_df['journal'] = metadata_df['journal'].fillna(value='').apply(lambda x: ''.join(x))
-
     # Add has_abstract indicator for valid articles
     valid_condition = (metadata_df['valid_for_prediction'] == 1)
     metadata_df.loc[valid_condition, 'has_abstract'] = metadata_df.loc[valid_condition, "abstract"].isnull()
 
-    # Remove tags from abstract
-    metadata_df['abstract_clean'] = metadata_df['abstract'].fillna(value='').apply(lambda x: ''.join(x))
-    metadata_df['abstract_clean'] = metadata_df['abstract_clean'].str.replace(pat = '<(jats|/jats):(p|sec|title|italic|sup|sub)>', repl = ' ', regex=True)
-    metadata_df['abstract_clean'] = metadata_df['abstract_clean'].str.replace(pat = '<(jats|/jats):(list|inline-graphic|related-article).*>', repl = ' ', regex=True)
-
-    # Concatenate descriptive text
-    metadata_df['text_with_abstract'] =  metadata_df['title_clean'] + ' ' + metadata_df['subtitle_clean'] + ' ' + metadata_df['abstract_clean']
+    # Clean text in subject, title, subtitle, journal, abstract and concatenate descriptive text
+    for name, text in clean_text(metadata_df).items():
+        metadata_df[name] = text
 
     # Impute missing language
     logger.info("Running article language imputation.")
@@ -204,8 +443,8 @@ def data_preprocessing(metadata_df):
     n_cannot_impute = sum(cannot_impute_condition)
     logger.info(f'{n_cannot_impute} cannot be imputed due to too short text metadata(title, subtitle and abstract less than 5 character).')
 
-    # Apply imputation
-    metadata_df.loc[need_impute_condition,'language'] = metadata_df.loc[need_impute_condition, 'text_with_abstract'].apply(lambda x: en_only_helper(x))
+    # Apply imputation, detecting the language of all the articles in one batch
+    metadata_df.loc[need_impute_condition,'language'] = detect_languages(metadata_df.loc[need_impute_condition, 'text_with_abstract'].tolist())
 
     # Set valid_for_prediction col to 0 if cannot be imputed or detected language is not English
     metadata_df.loc[cannot_impute_condition, 'valid_for_prediction'] = 0
@@ -244,104 +483,150 @@ def data_preprocessing(metadata_df):
     return metadata_df
 
 
-def add_embeddings(input_df, text_col, model = 'allenai/specter2'):
+def get_embedding_model(model = 'allenai/specter2'):
     """
-    Add sentence embeddings to the dataframe using the specified model.
-    
+    Load a sentence embedding model once per process, on the GPU if available.
+
     Args:
-        input_df (pd DataFrame): Input data frame. 
-        text_col (str): Column with text feature.
         model(str): model name on hugging face model hub.
 
     Returns:
-        pd DataFrame with origianl features and sentence embedding features added.
+        SentenceTransformer model.
     """
-    logger.info("Sentence embedding start.")
+    if model not in EMBEDDING_MODEL_CACHE:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        logger.info(f"Loading sentence embedding model {model} on {device}.")
+        EMBEDDING_MODEL_CACHE[model] = SentenceTransformer(model, device = device)
 
-    embedding_model = SentenceTransformer(model)
+    return EMBEDDING_MODEL_CACHE[model]
 
-    valid_df = input_df.query("valid_for_prediction == 1")
-    invalid_df = input_df.query("valid_for_prediction != 1")
 
-    # add embeddings to valid_df
-    embeddings = valid_df[text_col].apply(embedding_model.encode)
-    embeddings_df = pd.DataFrame(embeddings.tolist())
-    embeddings_df.index = valid_df.index
+def add_embeddings(input_df, text_col, model = 'allenai/specter2', batch_size = EMBEDDING_BATCH_SIZE,
+                   embedding_store_path = EMBEDDING_STORE_PATH):
+    """
+    Get the sentence embeddings of the articles using the specified model.
+
+    The embeddings are kept as a single float32 matrix beside the dataframe,
+    row i of the matrix is the embedding of row i of the dataframe. When an
+    embedding store is used, articles already in it are not embedded again
+    and new embeddings are added to it.
+    
+    Args:
+        input_df (pd DataFrame): Input data frame. 
+        text_col (str): Column with text feature.
+        model(str): model name on hugging face model hub.
+        batch_size (int): Number of texts embedded per forward pass.
+        embedding_store_path (str): Directory of the embedding store, None to always embed.
 
-    df_with_embeddings = pd.concat([valid_df, embeddings_df], axis = 1)
-    df_with_embeddings.columns = df_with_embeddings.columns.astype(str)
+    Returns:
+        pd DataFrame input data frame, and np.ndarray float32 matrix of the 
+        sentence embeddings, NaN for articles not valid for prediction.
+    """
+    logger.info("Sentence embedding start.")
 
-    # concatenate invalid_df with valid_df
-    result = pd.concat([df_with_embeddings, invalid_df])
+    embedding_model = get_embedding_model(model)
+    dim = embedding_model.get_sentence_embedding_dimension()
+
+    valid = (input_df['valid_for_prediction'] == 1).to_numpy()
+    embeddings = np.full((input_df.shape[0], dim), np.nan, dtype = np.float32)
+
+    embed = valid.copy()
+    store = None
+    if embedding_store_path is not None:
+        store = EmbeddingStore(embedding_store_path, model_name = model, dim = dim)
+        embed &= store.get_rows(input_df['DOI']) < 0
+        embed[embed] = ~input_df.loc[embed, 'DOI'].str.lower().duplicated().to_numpy()
+        logger.info(f"{valid.sum() - embed.sum()} articles' embeddings found in the embedding store.")
+
+    # encode sorts the texts by length so each batch pads to similar lengths
+    if embed.any():
+        new_embeddings = embedding_model.encode(input_df.loc[embed, text_col].tolist(),
+                                                batch_size = batch_size,
+                                                convert_to_numpy = True).astype(np.float32)
+    else:
+        new_embeddings = np.empty((0, dim), dtype = np.float32)
+
+    if store is not None:
+        store.add_many(input_df.loc[embed, 'DOI'].tolist(), new_embeddings)
+        embeddings[valid] = store.get_embeddings(store.get_rows(input_df.loc[valid, 'DOI']))
+    else:
+        embeddings[embed] = new_embeddings
 
     logger.info("Sentence embedding completed.")
 
-    return result
+    return input_df, embeddings
 
 
-def relevance_prediction(input_df, model_path, predict_thld = 0.5):
+def relevance_prediction(input_df, embeddings, model_path, predict_thld = 0.5, chunk_size = SCORING_CHUNK_SIZE):
     """
     Make prediction on article relevancy. 
     Add prediction and predict_proba to the resulting dataframe.
     Save resulting dataframe with all information in output_path directory.
     Return the resulting dataframe.
 
+    The features are passed to the model's linear scorer as NumPy arrays and
+    scored in chunks, rather than building the model's wide feature frame.
+    The embeddings are not copied, the articles not valid for prediction are
+    left out a chunk at a time.
+
     Args:
         input_df (pd DataFrame): Input data frame. 
-        model_path (str): Directory to trained model object.
+        embeddings (np.ndarray): Matrix with the sentence embedding of each row of input_df.
+        model_path (str): Directory to trained model object, or its exported .npz scorer.
+        predict_thld (float): Probability threshold of a relevant article.
+        chunk_size (int): Number of articles scored at a time.
 
     Returns:
-        pd DataFrame with prediction and predict_proba added.
+        pd DataFrame with prediction and predict_proba added, in the order of input_df.
     """
     logger.info(f'Prediction start.')
     
     try:
-        # load model
-        model_object = joblib.load(model_path)
+        # load model, a .npz scorer exported from it loads without sklearn
+        scorer = load_relevance_scorer(model_path)
     except OSError:
         logger.error("Model for article relevance not found.")
         raise(FileNotFoundError)
 
     # split by valid_for_prediction
-    valid_df = input_df.query('valid_for_prediction == 1')
-    invalid_df = input_df.query('valid_for_prediction != 1')
+    valid = (input_df['valid_for_prediction'] == 1).to_numpy()
+
+    logger.info(f"Running prediction for {valid.sum()} articles.")
+
+    # the features as arrays
+    has_abstract = input_df['has_abstract'].to_numpy()
+    subjects = input_df['subject_clean'].to_numpy()
+    citations = input_df['is-referenced-by-count'].to_numpy(dtype = np.float64, na_value = np.nan)
 
-    logger.info(f"Running prediction for {valid_df.shape[0]} articles.")
+    # Use the loaded model for prediction on a new dataset, articles with a
+    # NaN embedding or citation count get a NaN predict_proba
+    predict_proba = scorer.predict_proba(embeddings, has_abstract, subjects, citations,
+                                         chunk_size = chunk_size,
+                                         mask = valid & ~pd.isnull(has_abstract) & ~pd.isnull(subjects))
 
     # filter out rows with NaN value
-    feature_col = ['has_abstract', 'subject_clean', 'is-referenced-by-count'] + [str(i) for i in range(0,768)]
-    nan_exists = valid_df.loc[:, feature_col].isnull().any(axis = 1)
-    df_nan_exist = valid_df.loc[nan_exists, :]
-    valid_df.loc[nan_exists, 'valid_for_prediction'] = 0
-    logger.info(f"{df_nan_exist.shape[0]} articles's input feature contains NaN value.")
+    nan_exists = valid & np.isnan(predict_proba)
+    logger.info(f"{nan_exists.sum()} articles's input feature contains NaN value.")
 
-    # Use the loaded model for prediction on a new dataset
-    valid_df.loc[:, 'predict_proba'] = model_object.predict_proba(valid_df)[:, 1]
-    valid_df['prediction'] = valid_df.loc[:,'predict_proba'].apply(lambda x: 1 if x >= predict_thld else 0)
+    prediction = (predict_proba >= predict_thld).astype(int)
+    if not valid.all():
+        prediction = np.where(valid, prediction, np.nan)
 
     # Filter results, store key information that could possibly be useful downstream
-    keyinfo_col = (['DOI', 'URL', 'gddid', 'valid_for_prediction',
-                    'prediction', 'predict_proba'] + 
-                    feature_col + 
-                    ['title', 'subtitle', 'abstract', 'journal', 
-                     'author', 'text_with_abstract', 'language', 'published', 'publisher',
-                     'queryinfo_min_date',
-                     'queryinfo_max_date',
-                     'queryinfo_term',
-                     'queryinfo_n_recent'])
-    invalid_col = ['DOI', 'URL', 'gddid', 'valid_for_prediction',
-                 'title', 'subtitle', 'abstract',
-                'subject_clean', 'journal', 'author', 'text_with_abstract',
-                'is-referenced-by-count', 'has_abstract', 'language', 'published', 'publisher',
-                'queryinfo_min_date',
-                'queryinfo_max_date',
-                'queryinfo_term',
-                'queryinfo_n_recent']
+    keyinfo_col = ['DOI', 'URL', 'gddid', 'valid_for_prediction',
+                   'prediction', 'predict_proba',
+                   'has_abstract', 'subject_clean', 'is-referenced-by-count',
+                   'title', 'subtitle', 'abstract', 'journal', 
+                   'author', 'text_with_abstract', 'language', 'published', 'publisher',
+                   'queryinfo_min_date',
+                   'queryinfo_max_date',
+                   'queryinfo_term',
+                   'queryinfo_n_recent']
     
-    keyinfo_df = valid_df.loc[:, keyinfo_col]
-
-    # Join it with invalid df to get back to the full dataframe
-    result = pd.concat([keyinfo_df, invalid_df.loc[:, invalid_col]])
+    result = input_df.loc[:, [col for col in keyinfo_col if col not in ['prediction', 'predict_proba']]]
+    result.loc[nan_exists, 'valid_for_prediction'] = 0
+    result.insert(keyinfo_col.index('prediction'), 'prediction', prediction)
+    result.insert(keyinfo_col.index('predict_proba'), 'predict_proba', predict_proba)
 
     # Change col name on the final result to make it more readable
     result = result.rename(columns={'subject_clean': 'subject',
@@ -381,19 +666,40 @@ def xdd_put_request(row):
             return "failed"
 
 
-def prediction_export(input_df, output_path):
+def to_prediction_table(input_df, embeddings = None):
     """
-    Make prediction on article relevancy. 
-    Add prediction and predict_proba to the resulting dataframe.
-    Save resulting dataframe with all information in output_path directory.
-    Return the resulting dataframe.
+    Convert the prediction results to an arrow table, with the embeddings in
+    a single fixed size list column.
 
     Args:
-        input_df (pd DataFrame): Input data frame. 
-        model_path (str): Directory to trained model object.
+        input_df (pd DataFrame): Prediction results.
+        embeddings (np.ndarray): Matrix with the embedding of each row of input_df, None to leave them out.
 
     Returns:
-        pd DataFrame with prediction and predict_proba added.
+        pyarrow Table of the prediction results.
+    """
+    table = pa.Table.from_pandas(input_df)
+
+    if embeddings is None:
+        return table
+
+    # invalid articles keep their NaN embedding
+    return table.append_column(
+        pa.field(EMBEDDING_COLUMN, pa.list_(pa.float32(), embeddings.shape[1])),
+        embeddings_to_arrow(embeddings),
+    )
+
+
+def prediction_export(input_df, output_path, embeddings = None, export_csv = EXPORT_CSV):
+    """
+    Save the prediction results to a parquet file in the output_path directory,
+    with the embeddings in a single fixed size list column.
+
+    Args:
+        input_df (pd DataFrame): Prediction results.
+        output_path (str): Directory to save the results to.
+        embeddings (np.ndarray): Matrix with the embedding of each row of input_df, None to leave them out.
+        export_csv (bool): When True the results are also saved as CSV.
     """
 
     # ==== Save result to output_path directory =====
@@ -411,8 +717,16 @@ def prediction_export(input_df, output_path):
         parquet_file_name = os.path.join(parquet_folder, f"article-relevance-prediction_{formatted_datetime}.parquet")
 
     # Write the Parquet file
-    input_df.to_parquet(parquet_file_name)
-    input_df.to_csv(os.path.join(parquet_folder, f"article-relevance-prediction_{formatted_datetime}.csv"))
+    # keep the gddid index of the parquet folder up to date for the duplicate check,
+    # opened first so the new file isn't read back to index it
+    gddid_index = GddidIndex(parquet_folder)
+    pq.write_table(to_prediction_table(input_df, embeddings), parquet_file_name, compression = PARQUET_COMPRESSION)
+    gddid_index.add_file(os.path.basename(parquet_file_name), input_df['gddid'].tolist())
+    gddid_index.close()
+    if export_csv:
+        # the CSV keeps the embeddings as the '0'..'767' columns
+        csv_df = input_df if embeddings is None else add_embedding_columns(input_df, embeddings)
+        csv_df.to_csv(os.path.join(parquet_folder, f"article-relevance-prediction_{formatted_datetime}.csv"))
 
     # ===== log important information ======
     logger.info(f'Total number of DOI processed: {input_df.shape[0]}')
@@ -443,15 +757,19 @@ def main():
 
     preprocessed = data_preprocessing(metadata_df)
     
-    embedded = add_embeddings(preprocessed, 'text_with_abstract', model = 'allenai/specter2')
+    preprocessed, embeddings = add_embeddings(preprocessed, 'text_with_abstract', model = 'allenai/specter2')
     
-    predicted = relevance_prediction(embedded, model_path, predict_thld = 0.5)
+    predicted = relevance_prediction(preprocessed, embeddings, model_path, predict_thld = 0.5)
 
     if send_xdd =="True":
         # run xdd_put_request function, add the xddquery_status column to the parquet
         predicted.loc[:, 'xdd_querystatus'] = predicted.apply(xdd_put_request, axis=1)
     
-    prediction_export(predicted, output_path)
+    # the embeddings are already kept in the store
+    if EMBEDDING_STORE_PATH is not None:
+        embeddings = None
+
+    prediction_export(predicted, output_path, embeddings)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,392 @@
+# Author Kelly Wu
+# 2023-07-06
+
+# Linear relevance scorer applying the fitted relevance model's feature
+# preprocessing and logistic regression coefficients to NumPy arrays, and the
+# .npz file it's exported to so scoring doesn't need sklearn
+
+import os
+import sys
+import re
+from collections import Counter
+
+import numpy as np
+
+# Locate src module
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+sys.path.append(src_dir)
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# number of articles scored at a time
+SCORING_CHUNK_SIZE = int(os.getenv("SCORING_CHUNK_SIZE", "10000"))
+
+NUMERIC_FEATURE = 'is-referenced-by-count'
+BINARY_FEATURE = 'has_abstract'
+TEXT_FEATURE = 'subject_clean'
+
+# layout of the .npz files the scorer is saved to
+NPZ_FORMAT_VERSION = 1
+NPZ_ARRAYS = ['classes', 'numeric_coef', 'vocabulary', 'text_coef', 'stop_words', 'ngram_range',
+              'embedding_cols', 'embedding_coef']
+NPZ_SCALARS = ['intercept', 'numeric_offset', 'token_pattern', 'lowercase', 'binary_counts']
+
+
+class LinearRelevanceScorer:
+    """Scores articles with the relevance model without building its wide
+    feature frame.
+
+    The relevance model is a pipeline of a ColumnTransformer, scaling the
+    citation count, one hot encoding has_abstract, counting subject words and
+    passing the embeddings through, and a logistic regression. As the model is
+    linear its decision function is the sum of each feature's contribution, so
+    every feature is transformed and multiplied by its coefficients on its own,
+    a chunk of articles at a time.
+
+    The scorer only holds the coefficients as NumPy arrays, the subject words
+    and the settings of the count vectorizer's word analyzer. It's saved to a
+    small .npz file with save_npz, and loaded back with from_npz without
+    importing sklearn or unpickling the model. Use from_pipeline to create it
+    from the fitted relevance model.
+
+    Args:
+        intercept (float): The logistic regression intercept.
+        classes (np.ndarray): The logistic regression classes.
+        numeric_coef (np.ndarray): Coefficient of the unscaled citation count.
+        numeric_offset (float): Contribution of the citation count's scaling.
+        binary_weights (dict): Contribution of each has_abstract value.
+        vocabulary (np.ndarray): The subject words in count vectorizer column order.
+        text_coef (np.ndarray): Coefficient of each subject word.
+        token_pattern (str): Regular expression of a subject word.
+        lowercase (bool): Whether subjects are lower-cased before finding the words.
+        stop_words (np.ndarray): Words left out of the subject words.
+        ngram_range (tuple): Smallest and largest number of words in a subject n-gram.
+        binary_counts (bool): Whether subject words are counted at most once.
+        embedding_cols (np.ndarray): Embedding column of each embedding coefficient.
+        embedding_coef (np.ndarray): Coefficient of each embedding column.
+    """
+
+    def __init__(self, intercept, classes,
+                 numeric_coef = None, numeric_offset = 0.0,
+                 binary_weights = None,
+                 vocabulary = None, text_coef = None,
+                 token_pattern = r"(?u)\b\w\w+\b", lowercase = True, stop_words = (),
+                 ngram_range = (1, 1), binary_counts = False,
+                 embedding_cols = None, embedding_coef = None):
+        self.intercept = float(intercept)
+        self.classes = np.asarray(classes)
+
+        self.numeric_coef = numeric_coef
+        self.numeric_offset = float(numeric_offset)
+        self.binary_weights = binary_weights
+
+        self.vocabulary = vocabulary
+        self.text_coef = text_coef
+        self.token_pattern = re.compile(token_pattern)
+        if self.token_pattern.groups > 1:
+            raise ValueError("The subject word pattern can capture at most one group.")
+        self.lowercase = bool(lowercase)
+        self.stop_words = frozenset(str(word) for word in stop_words)
+        self.ngram_range = tuple(int(n) for n in ngram_range)
+        self.binary_counts = bool(binary_counts)
+        if vocabulary is not None:
+            self.word_columns = {str(word): column for column, word in enumerate(vocabulary)}
+            self.word_coef = np.asarray(text_coef, dtype=np.float64).tolist()
+
+        self.embedding_cols = embedding_cols
+        self.embedding_coef = embedding_coef
+
+    @classmethod
+    def from_pipeline(cls, model):
+        """Creates the scorer of a fitted relevance model.
+
+        Args:
+            model (sklearn Pipeline): The fitted relevance model.
+
+        Return:
+            LinearRelevanceScorer of the model.
+        """
+        preprocessor, classifier = model.steps[0][1], model.steps[-1][1]
+
+        if classifier.coef_.shape[0] != 1:
+            raise ValueError("Only binary logistic regression models can be scored.")
+        coef = classifier.coef_[0]
+        params = {'intercept': classifier.intercept_[0], 'classes': classifier.classes_}
+
+        for name, transformer, columns in preprocessor.transformers_:
+            feature_coef = coef[preprocessor.output_indices_[name]]
+            if len(feature_coef) == 0:
+                continue
+
+            if name == 'remainder':
+                # passthrough columns are the embeddings '0'..'767'
+                columns = [preprocessor.feature_names_in_[col] if isinstance(col, (int, np.integer)) else col
+                           for col in columns]
+                params['embedding_cols'] = np.array([int(col) for col in columns])
+                params['embedding_coef'] = feature_coef
+            elif columns == [NUMERIC_FEATURE] or columns == NUMERIC_FEATURE:
+                mean = transformer.mean_ if transformer.with_mean else np.zeros(1)
+                scale = transformer.scale_ if transformer.scale_ is not None else np.ones(1)
+                params['numeric_coef'] = feature_coef / scale
+                params['numeric_offset'] = -float(np.dot(mean, params['numeric_coef']))
+            elif columns == [BINARY_FEATURE] or columns == BINARY_FEATURE:
+                categories = transformer.categories_[0]
+                kept = np.ones(len(categories), dtype=bool)
+                if transformer.drop_idx_ is not None and transformer.drop_idx_[0] is not None:
+                    kept[transformer.drop_idx_[0]] = False
+                weights = np.zeros(len(categories))
+                weights[kept] = feature_coef
+                params['binary_weights'] = dict(zip(categories.tolist(), weights.tolist()))
+            elif columns == TEXT_FEATURE:
+                if (transformer.analyzer != 'word' or transformer.tokenizer is not None
+                        or transformer.preprocessor is not None or transformer.strip_accents is not None
+                        or transformer.input != 'content'):
+                    raise ValueError("Only count vectorizers with the default word analyzer can be scored.")
+                vocabulary = transformer.vocabulary_
+                params['vocabulary'] = np.array(sorted(vocabulary, key=vocabulary.get), dtype=str)
+                params['text_coef'] = feature_coef
+                params['token_pattern'] = transformer.token_pattern
+                params['lowercase'] = transformer.lowercase
+                params['stop_words'] = sorted(transformer.get_stop_words() or [])
+                params['ngram_range'] = transformer.ngram_range
+                params['binary_counts'] = transformer.binary
+            else:
+                raise ValueError(f"Unexpected relevance model feature {name}: {columns}.")
+
+        return cls(**params)
+
+    @classmethod
+    def from_npz(cls, file_path):
+        """Loads a scorer saved with save_npz.
+
+        Args:
+            file_path (str): Path to the .npz file.
+
+        Return:
+            LinearRelevanceScorer saved in the file.
+        """
+        with np.load(file_path, allow_pickle=False) as scorer_file:
+            arrays = dict(scorer_file)
+
+        if int(arrays.pop('format_version')) != NPZ_FORMAT_VERSION:
+            raise ValueError(f"{file_path} isn't a version {NPZ_FORMAT_VERSION} relevance scorer file.")
+
+        params = {name: arrays[name] for name in NPZ_ARRAYS if name in arrays}
+        for name in NPZ_SCALARS:
+            if name in arrays:
+                params[name] = arrays[name].item()
+        if 'binary_categories' in arrays:
+            params['binary_weights'] = dict(zip(arrays['binary_categories'].tolist(),
+                                                arrays['binary_weights'].tolist()))
+
+        return cls(**params)
+
+    def save_npz(self, file_path):
+        """Saves the scorer to a .npz file, loaded back with from_npz.
+
+        Args:
+            file_path (str): Path to the .npz file.
+        """
+        arrays = {'format_version': NPZ_FORMAT_VERSION,
+                  'intercept': self.intercept,
+                  'classes': self.classes}
+
+        if self.numeric_coef is not None:
+            arrays['numeric_coef'] = self.numeric_coef
+            arrays['numeric_offset'] = self.numeric_offset
+
+        if self.binary_weights is not None:
+            arrays['binary_categories'] = np.array(list(self.binary_weights))
+            arrays['binary_weights'] = np.array(list(self.binary_weights.values()))
+            if arrays['binary_categories'].dtype == object:
+                raise ValueError(f"The {BINARY_FEATURE} values can't be saved without pickling.")
+
+        if self.vocabulary is not None:
+            arrays['vocabulary'] = np.asarray(self.vocabulary, dtype=str)
+            arrays['text_coef'] = self.text_coef
+            arrays['token_pattern'] = self.token_pattern.pattern
+            arrays['lowercase'] = self.lowercase
+            arrays['stop_words'] = np.array(sorted(self.stop_words), dtype=str)
+            arrays['ngram_range'] = np.array(self.ngram_range)
+            arrays['binary_counts'] = self.binary_counts
+
+        if self.embedding_coef is not None:
+            arrays['embedding_cols'] = self.embedding_cols
+            arrays['embedding_coef'] = self.embedding_coef
+
+        with open(file_path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def subject_words(self, subject):
+        """Splits a subject into its words and n-grams as the count vectorizer does.
+
+        Args:
+            subject (str): The cleaned subject of an article.
+
+        Return:
+            list of the subject's words and n-grams.
+        """
+        if self.lowercase:
+            subject = subject.lower()
+        words = [word for word in self.token_pattern.findall(subject) if word not in self.stop_words]
+
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return words
+
+        ngrams = list(words) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(words)) + 1):
+            ngrams.extend(" ".join(words[i : i + n]) for i in range(len(words) - n + 1))
+
+        return ngrams
+
+    def subject_score(self, subject):
+        """Gets the contribution of a subject's words to the decision function.
+
+        Args:
+            subject (str): The cleaned subject of an article.
+
+        Return:
+            float contribution of the subject.
+        """
+        counts = Counter(self.word_columns[word] for word in self.subject_words(subject)
+                         if word in self.word_columns)
+
+        # summed in column order, as the sparse word counts are multiplied
+        score = 0.0
+        for column in sorted(counts):
+            score += (1 if self.binary_counts else counts[column]) * self.word_coef[column]
+
+        return score
+
+    def text_scores(self, subjects):
+        """Gets the contribution of the subject words to the decision function.
+
+        Args:
+            subjects (np.ndarray): The cleaned subject of each article.
+
+        Return:
+            np.ndarray of the contribution of each article's subject.
+        """
+        # articles of a journal share its subjects so each is counted once
+        unique_subjects, inverse = np.unique(np.asarray(subjects, dtype=str), return_inverse=True)
+        scores = np.array([self.subject_score(subject) for subject in unique_subjects.tolist()], dtype=np.float64)
+
+        return scores[inverse.reshape(-1)]
+
+    def binary_scores(self, has_abstract):
+        """Gets the contribution of has_abstract to the decision function.
+
+        Args:
+            has_abstract (np.ndarray): Whether each article has an abstract.
+
+        Return:
+            np.ndarray of the contribution of each article's has_abstract.
+        """
+        scores = np.zeros(len(has_abstract))
+        known = np.zeros(len(has_abstract), dtype=bool)
+        for category, weight in self.binary_weights.items():
+            is_category = np.asarray(has_abstract == category, dtype=bool)
+            scores[is_category] = weight
+            known |= is_category
+
+        if not known.all():
+            raise ValueError(f"Found unknown {BINARY_FEATURE} value {has_abstract[~known][0]} during scoring.")
+
+        return scores
+
+    def decision_function(self, embeddings, has_abstract, subjects, citations, chunk_size = SCORING_CHUNK_SIZE,
+                          mask = None):
+        """Computes the logistic regression decision function of many articles.
+
+        The mask is applied a chunk at a time, so only a chunk of the
+        embeddings is ever copied.
+
+        Args:
+            embeddings (np.ndarray): Matrix with the embedding of each article.
+            has_abstract (np.ndarray): Whether each article has an abstract.
+            subjects (np.ndarray): The cleaned subject of each article.
+            citations (np.ndarray): The number of times each article is cited.
+            chunk_size (int): Number of articles scored at a time.
+            mask (np.ndarray): Whether each article is scored, by default all are.
+
+        Return:
+            np.ndarray of the decision function of each article, NaN for the
+            articles not scored or with a NaN embedding or citation count.
+        """
+        n_articles = len(has_abstract)
+        scores = np.full(n_articles, np.nan)
+
+        for start in range(0, n_articles, chunk_size):
+            end = min(start + chunk_size, n_articles)
+            if mask is None:
+                rows = slice(start, end)
+                n_rows = end - start
+            else:
+                rows = start + np.flatnonzero(mask[start:end])
+                n_rows = len(rows)
+            if n_rows == 0:
+                continue
+            chunk_scores = np.full(n_rows, self.intercept)
+
+            if self.numeric_coef is not None:
+                chunk_scores += np.asarray(citations[rows], dtype=np.float64) * self.numeric_coef[0] + self.numeric_offset
+
+            if self.binary_weights is not None:
+                chunk_scores += self.binary_scores(has_abstract[rows])
+
+            if self.vocabulary is not None:
+                chunk_scores += self.text_scores(subjects[rows])
+
+            if self.embedding_coef is not None:
+                chunk_embeddings = embeddings[rows]
+                if not np.array_equal(self.embedding_cols, np.arange(chunk_embeddings.shape[1])):
+                    chunk_embeddings = chunk_embeddings[:, self.embedding_cols]
+                chunk_scores += chunk_embeddings.astype(np.float64) @ self.embedding_coef
+
+            scores[rows] = chunk_scores
+
+        return scores
+
+    def predict_proba(self, embeddings, has_abstract, subjects, citations, chunk_size = SCORING_CHUNK_SIZE,
+                      mask = None):
+        """Computes the probability each article is relevant.
+
+        Args:
+            embeddings (np.ndarray): Matrix with the embedding of each article.
+            has_abstract (np.ndarray): Whether each article has an abstract.
+            subjects (np.ndarray): The cleaned subject of each article.
+            citations (np.ndarray): The number of times each article is cited.
+            chunk_size (int): Number of articles scored at a time.
+            mask (np.ndarray): Whether each article is scored, by default all are.
+
+        Return:
+            np.ndarray of the probability of the positive class of each article,
+            NaN for the articles not scored or with a NaN embedding or citation count.
+        """
+        scores = self.decision_function(embeddings, has_abstract, subjects, citations, chunk_size, mask)
+
+        return 1 / (1 + np.exp(-scores))
+
+
+def load_relevance_scorer(model_path):
+    """Loads the scorer of a relevance model.
+
+    A .npz file saved by LinearRelevanceScorer.save_npz is loaded without
+    sklearn, any other file is unpickled with joblib as the fitted model.
+
+    Args:
+        model_path (str): Path to the .npz scorer or the .joblib model.
+
+    Return:
+        LinearRelevanceScorer of the relevance model.
+    """
+    if model_path.endswith('.npz'):
+        return LinearRelevanceScorer.from_npz(model_path)
+
+    import joblib
+
+    return LinearRelevanceScorer.from_pipeline(joblib.load(model_path))
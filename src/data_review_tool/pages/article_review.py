@@ -5,6 +5,9 @@ import sys
 import json
 import sys
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import copy
 import numpy as np
 from collections import defaultdict
@@ -26,6 +29,7 @@ from src.logs import get_logger
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 
 from src.data_review_tool.pages.config import *
+from src.pipeline.entity_dataset import read_article_entities
 
 dash.register_page(__name__, path_template="/article/<gddid>")
 
@@ -1260,7 +1264,14 @@ def load_data(file_path):
     dict: entities and metadata for an article
 
     """
-    entities = json.load(open(file_path, "r"))
+    if os.path.exists(file_path):
+        entities = json.load(open(file_path, "r"))
+    else:
+        # fall back to the parquet entity dataset in the same directory
+        entities = read_article_entities(
+            os.path.dirname(file_path),
+            os.path.splitext(os.path.basename(file_path))[0],
+        )
     logger.info(f"Entities extracted from file: {file_path}")
 
     metadata, corrected_entities = get_article_metadata(entities["gddid"])
@@ -1286,27 +1297,23 @@ def get_article_metadata(gddid):
     dict: dictionary containing the current article's metadata
     str: dictionary of updated entities in string format
     """
-    # Read the Parquet file with pushdown predicate
+    # Read the Parquet file with pushdown predicate, skipping the embeddings
     article_metadata = pd.read_parquet(
-        os.path.join("/MetaExtractor", "inputs", os.environ["ARTICLE_RELEVANCE_BATCH"])
-    )
-    filtered_metadata = (
-        article_metadata[article_metadata["gddid"] == gddid][
-            [
-                "DOI",
-                "gddid",
-                "predict_proba",
-                "title",
-                "subtitle",
-                "journal",
-                "status",
-                "last_updated",
-                "corrected_entities",
-            ]
-        ]
-        .set_index("gddid")
-        .to_dict(orient="index")
+        os.path.join("/MetaExtractor", "inputs", os.environ["ARTICLE_RELEVANCE_BATCH"]),
+        columns=[
+            "DOI",
+            "gddid",
+            "predict_proba",
+            "title",
+            "subtitle",
+            "journal",
+            "status",
+            "last_updated",
+            "corrected_entities",
+        ],
+        filters=[("gddid", "==", gddid)],
     )
+    filtered_metadata = article_metadata.set_index("gddid").to_dict(orient="index")
 
     if gddid in filtered_metadata:
         corrected_entities = filtered_metadata[gddid].get("corrected_entities", "None")
@@ -1336,19 +1343,23 @@ def update_output(**args):
             Status of the reviewing process
     """
 
-    article_metadata = pd.read_parquet(
-        os.path.join("/MetaExtractor", "inputs", os.environ["ARTICLE_RELEVANCE_BATCH"])
-    )
-    article_metadata.loc[article_metadata["gddid"] == args["gddid"], "status"] = args[
-        "status"
-    ]
-    article_metadata.loc[
-        article_metadata["gddid"] == args["gddid"], "last_updated"
-    ] = args["last_updated"]
-    article_metadata.loc[
-        article_metadata["gddid"] == args["gddid"], "corrected_entities"
-    ] = args["corrected_entities"]
-
-    article_metadata.to_parquet(
-        os.path.join("/MetaExtractor", "inputs", os.environ["ARTICLE_RELEVANCE_BATCH"])
+    article_relevance_data_path = os.path.join(
+        "/MetaExtractor", "inputs", os.environ["ARTICLE_RELEVANCE_BATCH"]
     )
+
+    # update the arrow table in place of a round trip through pandas so the
+    # other columns, e.g. the embeddings, are written back unchanged
+    article_metadata = pq.read_table(article_relevance_data_path)
+    is_article = pc.equal(article_metadata["gddid"], args["gddid"])
+    for column in ["status", "last_updated", "corrected_entities"]:
+        article_metadata = article_metadata.set_column(
+            article_metadata.schema.get_field_index(column),
+            column,
+            pc.if_else(
+                is_article,
+                pa.scalar(args[column], pa.string()),
+                article_metadata[column].cast(pa.string()),
+            ),
+        )
+
+    pq.write_table(article_metadata, article_relevance_data_path, compression="zstd")
@@ -17,6 +17,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 
 from src.data_review_tool.pages.config import *
 from src.logs import get_logger
+from src.pipeline.entity_dataset import has_entity_dataset, list_entity_articles
 
 logger = get_logger(__name__)
 
@@ -246,8 +247,13 @@ def read_entities(directory):
             if file not in dfs:
                 dfs[file.split(".")[0]] = df
         
+        # Read the articles exported in the parquet entity dataset format
+        if has_entity_dataset(directory):
+            dfs["entity_dataset"] = list_entity_articles(directory)
+
         # Combine all dataframes into a single dataframe
         df = pd.concat(list(dfs.values()), ignore_index=True)
+        df = df.drop_duplicates("gddid", ignore_index=True)
         df = df[['gddid', 'date_processed',]].rename(
             columns={"date_processed": "Date Added"}
         )
@@ -276,24 +282,32 @@ def add_article_metadata(df):
     """
     gddid = df['gddid'].tolist()
     
-    schema = pq.read_schema(article_relevance_data_path)
-    # Read the Parquet file with pushdown predicate
-    results = pd.read_parquet(article_relevance_data_path)
-
-    if "status" not in results.columns:
-        results["status"] = "False"
-        schema = schema.append(pa.field('status', pa.string())) # False, In Progress, Non-relevant, Completed
-    # TODO: improve the following 2 datatypes for the future
-    if "last_updated" not in results.columns:
-        results["last_updated"] = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-        schema = schema.append(pa.field('last_updated', pa.string())) # Date in string format
-    if "corrected_entities" not in results.columns:
-        results["corrected_entities"] = "None"
-        schema = schema.append(pa.field('corrected_entities', pa.string())) # JSON in string format
-
-    results.to_parquet(article_relevance_data_path, schema=schema)
-    
-    filtered_df = results[results['gddid'].isin(gddid)].rename(
+    results = pq.read_table(article_relevance_data_path)
+
+    # review columns added to the file the first time it is opened
+    review_columns = {
+        "status": "False", # False, In Progress, Non-relevant, Completed
+        # TODO: improve the following 2 datatypes for the future
+        "last_updated": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"), # Date in string format
+        "corrected_entities": "None", # JSON in string format
+    }
+    missing_columns = [column for column in review_columns if column not in results.column_names]
+    for column in missing_columns:
+        results = results.append_column(
+            pa.field(column, pa.string()),
+            pa.array([review_columns[column]] * results.num_rows, pa.string()),
+        )
+
+    # the other columns, e.g. the embeddings, are written back unchanged
+    if missing_columns:
+        pq.write_table(results, article_relevance_data_path, compression="zstd")
+
+    # only the metadata shown in the UI is converted to pandas
+    results = results.select(
+        [column for column in ["gddid", "title", "DOI", "status", "last_updated"] if column in results.column_names]
+    ).filter(pc.is_in(results["gddid"], value_set=pa.array(gddid, pa.string()))).to_pandas()
+
+    filtered_df = results.rename(
         columns={
             "status": "Status",
             "title": "Article", 
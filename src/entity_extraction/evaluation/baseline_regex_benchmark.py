@@ -0,0 +1,109 @@
+# Author: Ty Andrews
+# Date: 2023-06-23
+"""This script benchmarks the single pass regex scanner of the baseline entity
+extraction against running the age, altitude, email and geographic coordinate
+extractors separately, checking both give the same labels.
+
+Usage: baseline_regex_benchmark.py [--article_text_path=<article_text_path>] [--repeats=<repeats>]
+
+Options:
+    --article_text_path=<article_text_path>     The path to the article text data file. [default: tests/pipeline/test_entity_extraction_pipeline/test_gdd_text]
+    --repeats=<repeats>                         The number of times to extract labels from the corpus. [default: 100]
+"""
+
+import os, sys
+
+import time
+from docopt import docopt
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+from src.entity_extraction.prediction.baseline_entity_extraction import (
+    extract_age,
+    extract_altitude,
+    extract_email,
+    extract_geographic_coordinates,
+    scan_regex_labels,
+)
+from src.pipeline.entity_extraction_pipeline import load_article_text_data
+from src.logs import get_logger
+
+logger = get_logger(__name__)
+
+
+def extract_regex_labels_separately(text: str) -> dict:
+    """
+    Extracts the regex labels by scanning the text once per extractor.
+
+    Parameters
+    ----------
+    text : str
+        The text to extract the labels from.
+
+    Returns
+    -------
+    dict
+        The labels of each label type, as returned by scan_regex_labels.
+    """
+
+    return {
+        "AGE": extract_age(text),
+        "ALTI": extract_altitude(text),
+        "EMAIL": extract_email(text),
+        "GEOG": extract_geographic_coordinates(text),
+    }
+
+
+def time_extraction(extract_fn, texts: list, repeats: int) -> float:
+    """
+    Times extracting the labels from every text.
+
+    Parameters
+    ----------
+    extract_fn : function
+        The function extracting the labels from a text.
+    texts : list
+        The texts to extract the labels from.
+    repeats : int
+        The number of times to extract labels from all the texts.
+
+    Returns
+    -------
+    float
+        The average seconds taken to extract the labels from all the texts.
+    """
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for text in texts:
+            extract_fn(text)
+
+    return (time.perf_counter() - start_time) / repeats
+
+
+def main():
+    opt = docopt(__doc__)
+
+    texts = load_article_text_data(opt["--article_text_path"])["text"].tolist()
+    repeats = int(opt["--repeats"])
+
+    mismatches = sum(
+        extract_regex_labels_separately(text) != scan_regex_labels(text)
+        for text in texts
+    )
+    if mismatches:
+        logger.warning(f"{mismatches} texts have different labels between extractors.")
+
+    separate_time = time_extraction(extract_regex_labels_separately, texts, repeats)
+    scan_time = time_extraction(scan_regex_labels, texts, repeats)
+
+    logger.info(
+        f"{len(texts)} texts ({sum(map(len, texts))} characters), "
+        f"separate extractors: {separate_time * 1000:.3f}ms, "
+        f"single pass scanner: {scan_time * 1000:.3f}ms, "
+        f"speedup: {separate_time / scan_time:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
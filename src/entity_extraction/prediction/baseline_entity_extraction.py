@@ -14,6 +14,89 @@ import spacy
 # ensure that the parent directory is on the path for relative imports
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
 
+from src.entity_extraction.prediction.taxa_matcher import load_taxa_matcher
+from src.entity_extraction.prediction.spacy_entity_extraction import (
+    get_ner_pipe_names,
+)
+
+# process-wide cache of loaded spacy models keyed by model name
+SPACY_MODEL_CACHE = {}
+
+# matches any standalone date with BP at the end, can have decimal places
+AGE_PATTERN = re.compile(r"(\d+(?:[.]\d+)*) (([a-zA-Z]| |14C)*BP)")
+
+# detects date ranges where its two numbers separated by a dash or to, they can
+# have decimal places then followed by any word to indicate units then BP
+AGE_RANGE_PATTERN = re.compile(
+    r"(\d+(?:[.]\d+)*) ((?:-{1,2})|(?:to)) (\d+(?:[.]\d+)*) (([a-zA-Z]| |14C)*BP)"
+)
+
+ALTITUDE_PATTERN = re.compile(
+    r"(\d+(?:[.]\d+)*) ?m ?(?:above sea level|a.s.l.|asl|elevation)"
+)
+
+# regex inspiration from: https://stackoverflow.com/questions/201323/how-can-i-validate-an-email-address-using-a-regular-expression
+EMAIL_PATTERN = re.compile(
+    r"(?:[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*|(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])*)@(?:(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?|\[(?:(?:(2(5[0-5]|[0-4][0-9])|1[0-9][0-9]|[1-9]?[0-9]))\.){3}(?:(2(5[0-5]|[0-4][0-9])|1[0-9][0-9]|[1-9]?[0-9])|[a-z0-9-]*[a-z0-9]:(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21-\x5a\x53-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])+)\])"
+)
+
+GEOG_PATTERN = re.compile(
+    r"""[-]?[NESW\d]+\s?[NESWd.:°o◦'"″]\s?[NESW]?\d{1,7}\s?[NESWd.:°o◦′'`"″]?\s?\d{1,6}[NESWd.:°o◦′'`"″]?\s?\d{0,3}[NESW]?"""
+)
+
+# the patterns scanned for in a single pass, in the order they are tried
+REGEX_LABEL_PATTERNS = {
+    "AGE_RANGE": AGE_RANGE_PATTERN,
+    "AGE": AGE_PATTERN,
+    "ALTI": ALTITUDE_PATTERN,
+    "EMAIL": EMAIL_PATTERN,
+    "GEOG": GEOG_PATTERN,
+}
+
+# every pattern but the email one starts with a digit, a minus or a direction,
+# checking that first lets the scan skip most positions without backtracking
+COMBINED_REGEX_PATTERN = re.compile(
+    r"(?=[-NESW\d])(?:"
+    + "|".join(
+        f"(?P<{name}>{pattern.pattern})"
+        for name, pattern in REGEX_LABEL_PATTERNS.items()
+        if name != "EMAIL"
+    )
+    + ")"
+)
+
+# emails always contain an @ so are only scanned for in texts that have one
+COMBINED_EMAIL_REGEX_PATTERN = re.compile(
+    "|".join(
+        f"(?P<{name}>{pattern.pattern})"
+        for name, pattern in REGEX_LABEL_PATTERNS.items()
+    )
+)
+
+
+def load_spacy_ner_model(spacy_model: str = "en_core_web_lg"):
+    """
+    Loads a spacy model once per process with only the components needed
+    for named entity recognition enabled.
+
+    Parameters
+    ----------
+    spacy_model: str
+        The name or path of the spacy model. Default is 'en_core_web_lg'.
+
+    Returns
+    -------
+    spacy.language.Language
+        The loaded spacy model.
+    """
+
+    if spacy_model not in SPACY_MODEL_CACHE:
+        nlp = spacy.load(spacy_model)
+        nlp.select_pipes(enable=get_ner_pipe_names(nlp))
+        SPACY_MODEL_CACHE[spacy_model] = nlp
+
+    return SPACY_MODEL_CACHE[spacy_model]
+
 
 def load_taxa_data(
     file_path=os.path.join(os.pardir, "data", "entity-extraction", "raw", "taxa.csv")
@@ -77,38 +160,61 @@ def extract_geographic_coordinates(text: str) -> list:
         The list of geographic coordinates as dictionaries with the keys
         'start', 'end', and a list containing the label 'GEOG'.
     """
+    return get_geographic_coordinate_labels(
+        text, [match.span() for match in GEOG_PATTERN.finditer(text)]
+    )
+
+
+def check_groups(text: str) -> bool:
+    """
+    Checks a coordinate candidate contains both a direction and a degree,
+    minute or second marker.
+
+    Parameters
+    ----------
+    text : str
+        The matched coordinate candidate.
+
+    Returns
+    -------
+    bool
+        True if the candidate looks like a geographic coordinate.
+    """
     group_1 = ["N", "E", "S", "W"]
     group_2 = ["°", "o", "◦", "'", "`", '"', "″", ":"]
 
-    def check_groups(text):
-        check_1 = False
-        check_2 = False
-        for i in group_1:
-            if i in text:
-                check_1 = True
-                break
-        for i in group_2:
-            if i in text:
-                check_2 = True
-                break
-        return check_1 and check_2
-
-    pattern = r"""[-]?[NESW\d]+\s?[NESWd.:°o◦'"″]\s?[NESW]?\d{1,7}\s?[NESWd.:°o◦′'`"″]?\s?\d{1,6}[NESWd.:°o◦′'`"″]?\s?\d{0,3}[NESW]?"""
+    return any(i in text for i in group_1) and any(i in text for i in group_2)
 
-    labels = []
 
-    matches = re.finditer(pattern, text)
-    if matches:
-        for match in matches:
-            if check_groups(match.group()):
-                labels.append(
-                    {
-                        "start": match.start(),
-                        "end": match.end(),
-                        "labels": ["GEOG"],
-                        "text": text[match.start() : match.end()],
-                    }
-                )
+def get_geographic_coordinate_labels(text: str, spans: list) -> list:
+    """
+    Gets the geographic coordinate labels from the coordinate pattern matches.
+
+    Parameters
+    ----------
+    text : str
+        The text the matches were found in.
+    spans : list
+        The (start, end) of each match in order.
+
+    Returns
+    -------
+    list
+        The list of geographic coordinates as dictionaries with the keys
+        'start', 'end', and a list containing the label 'GEOG'.
+    """
+
+    labels = []
+    for start, end in spans:
+        if check_groups(text[start:end]):
+            labels.append(
+                {
+                    "start": start,
+                    "end": end,
+                    "labels": ["GEOG"],
+                    "text": text[start:end],
+                }
+            )
 
     return labels
 
@@ -130,9 +236,25 @@ def extract_region_names(text: str, spacy_model: str = "en_core_web_lg") -> list
         The list of region names as dictionaries with the keys
         'start', 'end', and a list containing the label 'REGION'.
     """
-    nlp = spacy.load(spacy_model)
+    return get_region_labels(load_spacy_ner_model(spacy_model)(text))
+
+
+def get_region_labels(doc) -> list:
+    """
+    Gets the region names from the entities of a spacy doc.
+
+    Parameters
+    ----------
+    doc : spacy.tokens.Doc
+        The processed text.
+
+    Returns
+    -------
+    list
+        The list of region names as dictionaries with the keys
+        'start', 'end', and a list containing the label 'REGION'.
+    """
 
-    doc = nlp(text)
     labels = []
     for ent in doc.ents:
         if ent.label_ == "LOC":
@@ -160,6 +282,8 @@ def extract_taxa(
     ----------
     text : str
         The text to extract the taxa from.
+    filepath : str
+        The path to the taxa CSV file.
 
     Returns
     -------
@@ -168,64 +292,8 @@ def extract_taxa(
         'start', 'end', and a list containing the label 'TAXA'.
     """
 
-    def get_label(start_index, end_index, text):
-        """Returns a single label object"""
-        return {
-            "start": start_index,
-            "end": end_index,
-            "labels": ["TAXA"],
-            "text": text,
-        }
-
-    labels = []
-    cur_len = 0
-
-    taxa, all_taxa_words = load_taxa_data(filepath)
-
-    # Split them into sentences to capture multiple instances of the same taxa
-    for sentence in text.split(". "):
-        for taxa_word in all_taxa_words:
-            if taxa_word in sentence:
-                possible_taxas = taxa[
-                    taxa["first_word"].apply(lambda x: taxa_word == x)
-                ]
-                possible_taxas = possible_taxas.sort_values(
-                    by="taxonname", key=lambda x: x.str.len(), ascending=False
-                )
-                for pt in possible_taxas.iterrows():
-                    name = pt[1]["taxonname"]
-                    if name in sentence:
-                        taxa_index = pt[0]
-                        taxa.loc[taxa_index, "counts"] += 1
-                        index = sentence.index(name)
-
-                        # If atleast 1 character is capital (i.e. start of the name of the fossil)
-                        if name != name.lower():
-                            try:
-                                if sentence[index - 1] == " ":
-                                    labels.append(
-                                        get_label(
-                                            cur_len + index,
-                                            cur_len + index + len(name),
-                                            sentence[index : index + len(name)],
-                                        )
-                                    )
-                                else:
-                                    continue
-                            except:
-                                labels.append(
-                                    get_label(
-                                        cur_len + index,
-                                        cur_len + index + len(name),
-                                        sentence[index : index + len(name)],
-                                    )
-                                )
-                        break
-        cur_len += len(sentence) + 2
-
-    labels = sorted(labels, key=lambda label: label["start"])
-
-    return labels
+    # the matcher is built once per taxa file and reused across calls
+    return load_taxa_matcher(filepath).extract(text)
 
 
 def extract_age(text: str) -> list:
@@ -244,49 +312,59 @@ def extract_age(text: str) -> list:
         'start', 'end', and a list containing the label 'AGE'.
     """
 
-    # matches any standalone date with BP at the end, can have decimal places
-    is_date = re.compile(r"(\d+(?:[.]\d+)*) (([a-zA-Z]| |14C)*BP)")
-
-    # detects date ranges where its two numbers separated by a dash or to, they can
-    # have decimal places then followed by any word to indicate units then BP
-    is_date_range = re.compile(
-        r"(\d+(?:[.]\d+)*) ((?:-{1,2})|(?:to)) (\d+(?:[.]\d+)*) (([a-zA-Z]| |14C)*BP)"
+    return get_age_labels(
+        text,
+        [match.span() for match in AGE_RANGE_PATTERN.finditer(text)],
+        [match.span() for match in AGE_PATTERN.finditer(text)],
     )
 
-    # accumalate the labels
-    labels = []
 
-    # first check if its a date range and get start/end and set label to AGE
-    for match in is_date_range.finditer(text):
-        labels.append(
-            {
-                "start": match.start(),
-                "end": match.end(),
-                "labels": ["AGE"],
-                "text": match.group(),
-            }
-        )
+def get_age_labels(text: str, range_spans: list, date_spans: list) -> list:
+    """
+    Gets the age labels from the date range and date pattern matches, dropping
+    dates that are part of a date range.
+
+    Parameters
+    ----------
+    text : str
+        The text the matches were found in.
+    range_spans : list
+        The (start, end) of each date range match in order.
+    date_spans : list
+        The (start, end) of each date match in order.
 
-    # next check if its a date and get start/end and set label to AGE
-    # ensure that the date is not part of a date range
-    for match in is_date.finditer(text):
-        if not any(
-            match.start() >= label["start"] and match.end() <= label["end"]
-            for label in labels
+    Returns
+    -------
+    list
+        The list of age as dictionaries with the keys
+        'start', 'end', and a list containing the label 'AGE'.
+    """
+
+    # the date ranges don't overlap so the only one that can contain a date
+    # is the last one starting at or before it
+    kept_spans = list(range_spans)
+    range_index = -1
+    for start, end in date_spans:
+        while (
+            range_index + 1 < len(range_spans)
+            and range_spans[range_index + 1][0] <= start
         ):
-            labels.append(
-                {
-                    "start": match.start(),
-                    "end": match.end(),
-                    "labels": ["AGE"],
-                    "text": match.group(),
-                }
-            )
+            range_index += 1
+        if range_index < 0 or end > range_spans[range_index][1]:
+            kept_spans.append((start, end))
 
     # reoirder the labels by start index
-    labels = sorted(labels, key=lambda label: label["start"])
-
-    return labels
+    kept_spans = sorted(kept_spans, key=lambda span: span[0])
+
+    return [
+        {
+            "start": start,
+            "end": end,
+            "labels": ["AGE"],
+            "text": text[start:end],
+        }
+        for start, end in kept_spans
+    ]
 
 
 def extract_altitude(text: str) -> list:
@@ -305,13 +383,9 @@ def extract_altitude(text: str) -> list:
         'start', 'end', and a list containing the label 'ALTI'.
     """
 
-    is_altitude = re.compile(
-        r"(\d+(?:[.]\d+)*) ?m ?(?:above sea level|a.s.l.|asl|elevation)"
-    )
-
     # accumalate the labels
     labels = []
-    for match in is_altitude.finditer(text):
+    for match in ALTITUDE_PATTERN.finditer(text):
         labels.append(
             {
                 "start": match.start(),
@@ -340,14 +414,9 @@ def extract_email(text: str) -> list:
         'start', 'end', and a list containing the label 'EMAIL'.
     """
 
-    # regex inspiration from: https://stackoverflow.com/questions/201323/how-can-i-validate-an-email-address-using-a-regular-expression
-    is_email = re.compile(
-        r"(?:[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*|(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])*)@(?:(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?|\[(?:(?:(2(5[0-5]|[0-4][0-9])|1[0-9][0-9]|[1-9]?[0-9]))\.){3}(?:(2(5[0-5]|[0-4][0-9])|1[0-9][0-9]|[1-9]?[0-9])|[a-z0-9-]*[a-z0-9]:(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21-\x5a\x53-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])+)\])"
-    )
-
     # accumalate the labels
     labels = []
-    for match in is_email.finditer(text):
+    for match in EMAIL_PATTERN.finditer(text):
         labels.append(
             {
                 "start": match.start(),
@@ -360,6 +429,80 @@ def extract_email(text: str) -> list:
     return labels
 
 
+def scan_regex_labels(text: str) -> dict:
+    """
+    Extracts the age, altitude, email and geographic coordinate labels with a
+    single pass of one combined regex, giving the same labels as running
+    extract_age, extract_altitude, extract_email and
+    extract_geographic_coordinates separately.
+
+    Each pattern finds non-overlapping matches on its own while the combined
+    regex only returns one match per span. Positions the combined match skips
+    over are retried with the individual patterns, so every pattern's matches
+    are swept in order of their start as its own finditer would find them.
+
+    Parameters
+    ----------
+    text : str
+        The text to extract the labels from.
+
+    Returns
+    -------
+    dict
+        The list of labels of 'AGE', 'ALTI', 'EMAIL' and 'GEOG' as
+        dictionaries with the keys 'start', 'end', and a list containing the
+        label.
+    """
+
+    if "@" in text:
+        combined_pattern = COMBINED_EMAIL_REGEX_PATTERN
+        names = list(REGEX_LABEL_PATTERNS)
+    else:
+        combined_pattern = COMBINED_REGEX_PATTERN
+        names = [name for name in REGEX_LABEL_PATTERNS if name != "EMAIL"]
+
+    spans = {name: [] for name in REGEX_LABEL_PATTERNS}
+    # end of the last kept match of each pattern so its matches don't overlap
+    last_ends = dict.fromkeys(REGEX_LABEL_PATTERNS, 0)
+
+    def match_at(name, position):
+        if position < last_ends[name]:
+            return
+        match = REGEX_LABEL_PATTERNS[name].match(text, position)
+        if match is not None:
+            spans[name].append(match.span())
+            last_ends[name] = match.end()
+
+    for match in combined_pattern.finditer(text):
+        start, end = match.span()
+        name = match.lastgroup
+
+        if start >= last_ends[name]:
+            spans[name].append((start, end))
+            last_ends[name] = end
+
+        # the patterns after the matched one weren't tried at its start and
+        # none were tried inside it, all patterns failed everywhere else
+        for other_name in names[names.index(name) + 1 :]:
+            match_at(other_name, start)
+        for position in range(start + 1, end):
+            for other_name in names:
+                match_at(other_name, position)
+
+    return {
+        "AGE": get_age_labels(text, spans["AGE_RANGE"], spans["AGE"]),
+        "ALTI": [
+            {"start": start, "end": end, "labels": ["ALTI"], "text": text[start:end]}
+            for start, end in spans["ALTI"]
+        ],
+        "EMAIL": [
+            {"start": start, "end": end, "labels": ["EMAIL"], "text": text[start:end]}
+            for start, end in spans["EMAIL"]
+        ],
+        "GEOG": get_geographic_coordinate_labels(text, spans["GEOG"]),
+    }
+
+
 # define baseline method to extract all the labels
 def baseline_extract_all(text: str, spacy_model: str = "en_core_web_lg") -> list:
     """Runs all baseline extractors on the text.
@@ -380,18 +523,60 @@ def baseline_extract_all(text: str, spacy_model: str = "en_core_web_lg") -> list
         'start', 'end', and a list containing the label.
     """
 
-    # accumalate the labels
-    labels = []
+    return baseline_extract_many([text], spacy_model=spacy_model)[0]
 
-    # extract the labels from the text
-    labels.extend(extract_age(text))
-    labels.extend(extract_altitude(text))
-    labels.extend(extract_email(text))
-    labels.extend(extract_taxa(text))
-    labels.extend(extract_region_names(text))
-    labels.extend(extract_geographic_coordinates(text))
 
-    # reorder the labels by start index
-    labels = sorted(labels, key=lambda label: label["start"])
+def baseline_extract_many(
+    texts: list,
+    spacy_model: str = "en_core_web_lg",
+    batch_size: int = 64,
+    n_process: int = 1,
+) -> list:
+    """Runs all baseline extractors on many texts, streaming them through the
+    spacy model in batches.
 
-    return labels
+    Parameters
+    ----------
+    texts : list
+        The texts to extract the labels from.
+    spacy_model: str
+        Which spacy pretrained language model for named entity recognition.
+        Default is 'en_core_web_lg'.
+    batch_size : int
+        The number of texts spacy processes at once.
+    n_process : int
+        The number of processes spacy uses.
+
+    Returns
+    -------
+    list
+        The list of labels for each text as dictionaries with the keys
+        'start', 'end', and a list containing the label.
+    """
+
+    nlp = load_spacy_ner_model(spacy_model)
+
+    all_labels = []
+    for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process):
+        # spacy docs keep the original text so it doesn't need to be zipped in
+        text = doc.text
+
+        regex_labels = scan_regex_labels(text)
+
+        # accumalate the labels
+        labels = []
+
+        # extract the labels from the text
+        labels.extend(regex_labels["AGE"])
+        labels.extend(regex_labels["ALTI"])
+        labels.extend(regex_labels["EMAIL"])
+        labels.extend(extract_taxa(text))
+        labels.extend(get_region_labels(doc))
+        labels.extend(regex_labels["GEOG"])
+
+        # reorder the labels by start index
+        labels = sorted(labels, key=lambda label: label["start"])
+
+        all_labels.append(labels)
+
+    return all_labels
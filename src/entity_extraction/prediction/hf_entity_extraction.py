@@ -12,6 +12,10 @@ from src.logs import get_logger
 
 logger = get_logger(__name__)
 
+# default number of padded tokens per forward pass when batching by token budget
+CPU_MAX_BATCH_TOKENS = 4096
+GPU_MAX_BATCH_TOKENS = 16384
+
 
 def load_ner_model_pipeline(model_path: str):
     """
@@ -25,11 +29,8 @@ def load_ner_model_pipeline(model_path: str):
     Returns
     -------
     ner_pipe : transformers.pipelines.Pipeline
-        The ner model pipeline.
-    model : transformers.modeling_outputs.TokenClassifierOutput
-        The loaded model.
-    tokenizer : transformers.tokenization_bert.BertTokenizer
-        The loaded tokenizer.
+        The ner model pipeline. Its fixed batch size applies to direct calls,
+        use predict_with_token_budget to batch by token length instead.
     """
 
     device_str = "cuda:0" if torch.cuda.is_available() else "cpu"
@@ -57,6 +58,102 @@ def load_ner_model_pipeline(model_path: str):
     return ner_pipe
 
 
+def get_token_budget_batches(
+    token_lengths: list, max_batch_tokens: int, max_batch_size: int = None
+) -> list:
+    """
+    Groups inputs of similar token length into batches whose padded size
+    stays within a token budget.
+
+    Inputs are sorted by token length so each batch is padded to a length
+    close to that of its members, then batches are filled while the number
+    of inputs times the longest input fits the budget. An input longer than
+    the budget gets a batch of its own.
+
+    Parameters
+    ----------
+    token_lengths : list
+        The number of tokens in each input.
+    max_batch_tokens : int
+        The maximum number of padded tokens in a batch.
+    max_batch_size : int, optional
+        The maximum number of inputs in a batch, by default no limit.
+
+    Returns
+    -------
+    batches : list
+        Lists of input indices, one per batch.
+    """
+
+    batches = []
+    batch = []
+    for i in sorted(range(len(token_lengths)), key=lambda i: token_lengths[i]):
+        # inputs are sorted so the current input is the longest in the batch
+        if len(batch) > 0 and (
+            (len(batch) + 1) * token_lengths[i] > max_batch_tokens
+            or (max_batch_size is not None and len(batch) >= max_batch_size)
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+
+    if len(batch) > 0:
+        batches.append(batch)
+
+    return batches
+
+
+def predict_with_token_budget(
+    ner_pipe, texts: list, max_batch_tokens: int = None, max_batch_size: int = None
+) -> list:
+    """
+    Runs the ner pipeline over length bucketed batches sized by a token
+    budget and returns the predictions in the original order of the texts.
+
+    Parameters
+    ----------
+    ner_pipe : transformers.pipelines.Pipeline
+        The ner model pipeline.
+    texts : list
+        The texts to extract entities from.
+    max_batch_tokens : int, optional
+        The maximum number of padded tokens in a batch, by default 4096 on
+        CPU and 16384 on GPU.
+    max_batch_size : int, optional
+        The maximum number of texts in a batch, by default no limit.
+
+    Returns
+    -------
+    predicted_labels : list
+        The entities predicted for each text.
+    """
+
+    if len(texts) == 0:
+        return []
+
+    if max_batch_tokens is None:
+        max_batch_tokens = (
+            GPU_MAX_BATCH_TOKENS
+            if ner_pipe.device.type == "cuda"
+            else CPU_MAX_BATCH_TOKENS
+        )
+
+    token_lengths = [
+        min(len(input_ids), ner_pipe.tokenizer.model_max_length)
+        for input_ids in ner_pipe.tokenizer(list(texts))["input_ids"]
+    ]
+
+    predicted_labels = [None] * len(texts)
+    for batch in get_token_budget_batches(
+        token_lengths, max_batch_tokens, max_batch_size
+    ):
+        batch_labels = ner_pipe([texts[i] for i in batch], batch_size=len(batch))
+        for i, labels in zip(batch, batch_labels):
+            predicted_labels[i] = labels
+
+    return predicted_labels
+
+
 def get_hf_token_labels(labelled_entities, raw_text):
     """
     Returns a list of labels per token in the raw text from hugging face generated labels.
@@ -128,7 +225,7 @@ def get_predicted_labels(df, ner_pipe):
 
     # get the predicted labels
     start_time = pd.Timestamp.now()
-    predicted_labels = ner_pipe(df["text"].tolist())
+    predicted_labels = predict_with_token_budget(ner_pipe, df["text"].tolist())
     logger.info(
         f"Finished entity extraction in {pd.Timestamp.now() - start_time} to process {len(df)} batches."
     )
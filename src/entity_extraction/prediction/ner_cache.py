@@ -0,0 +1,202 @@
+# Author: Ty Andrews
+# Date: 2023-06-20
+
+import os
+import sys
+import json
+import sqlite3
+import time
+
+# ensure that the parent directory is on the path for relative imports
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+from src.entity_extraction.preprocessing.labelling_preprocessing import get_hash
+from src.logs import get_logger
+
+logger = get_logger(__name__)
+
+# sqlite limits the number of bound parameters per statement
+SQLITE_MAX_PARAMS = 500
+
+
+def get_model_fingerprint(model_type: str, model_path: str) -> str:
+    """
+    Generates a fingerprint of a NER model so cached predictions are
+    invalidated when the model changes.
+
+    Local model directories are fingerprinted from the name, size and
+    modification time of every file, anything else (e.g. an installed spacy
+    package or hub repository name) from its name alone.
+
+    Parameters
+    ----------
+    model_type : str
+        Either "huggingface" or "spacy".
+    model_path : str
+        The path or name of the model.
+
+    Returns
+    -------
+    str
+        The model fingerprint.
+    """
+
+    fingerprint = [model_type, model_path]
+
+    if os.path.exists(model_path):
+        for root, dirs, files in os.walk(model_path):
+            dirs.sort()
+            for file in sorted(files):
+                stat = os.stat(os.path.join(root, file))
+                fingerprint.append(
+                    f"{os.path.relpath(os.path.join(root, file), model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+                )
+
+    return get_hash("\n".join(fingerprint))
+
+
+class NERPredictionCache:
+    """
+    Disk backed least recently used cache of NER predictions keyed by the
+    model fingerprint and the hash of the text window.
+
+    Parameters
+    ----------
+    cache_path : str
+        The path to the sqlite database file, created if it doesn't exist.
+    model_fingerprint : str
+        The fingerprint of the model the predictions are made with.
+    max_entries : int, optional
+        The maximum number of predictions kept across all models, the least
+        recently used are evicted first, by default 1000000.
+    """
+
+    def __init__(
+        self, cache_path: str, model_fingerprint: str, max_entries: int = 1000000
+    ):
+        self.cache_path = cache_path
+        self.model_fingerprint = model_fingerprint
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+
+        # several worker processes may share the cache file
+        self.connection = sqlite3.connect(cache_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS predictions (
+                key TEXT PRIMARY KEY,
+                labels TEXT NOT NULL,
+                last_used INTEGER NOT NULL
+            )"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)"
+        )
+        self.connection.commit()
+
+    def get_key(self, text: str) -> str:
+        """Returns the cache key of a text window for this model."""
+        return f"{self.model_fingerprint}:{get_hash(text)}"
+
+    def get_many(self, texts: list) -> list:
+        """
+        Looks up the cached predictions of many text windows.
+
+        Parameters
+        ----------
+        texts : list
+            The text windows to look up.
+
+        Returns
+        -------
+        list
+            The cached entities for each text, None where there is no entry.
+        """
+
+        keys = [self.get_key(text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+
+        cached = {}
+        for i in range(0, len(unique_keys), SQLITE_MAX_PARAMS):
+            key_chunk = unique_keys[i : i + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(key_chunk))
+            cached.update(
+                self.connection.execute(
+                    f"SELECT key, labels FROM predictions WHERE key IN ({placeholders})",
+                    key_chunk,
+                ).fetchall()
+            )
+
+        # refresh the recency of every hit so it survives eviction
+        hit_keys = list(cached)
+        last_used = time.time_ns()
+        for i in range(0, len(hit_keys), SQLITE_MAX_PARAMS):
+            key_chunk = hit_keys[i : i + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(key_chunk))
+            self.connection.execute(
+                f"UPDATE predictions SET last_used = ? WHERE key IN ({placeholders})",
+                [last_used] + key_chunk,
+            )
+        self.connection.commit()
+
+        # decode per text so duplicate windows never share entity dicts
+        results = [
+            json.loads(cached[key]) if key in cached else None for key in keys
+        ]
+
+        n_hits = sum(result is not None for result in results)
+        self.hits += n_hits
+        self.misses += len(results) - n_hits
+
+        return results
+
+    def put_many(self, texts: list, labels: list) -> None:
+        """
+        Stores the predictions of many text windows and evicts the least
+        recently used entries beyond the size limit.
+
+        Parameters
+        ----------
+        texts : list
+            The text windows.
+        labels : list
+            The predicted entities for each text window.
+        """
+
+        last_used = time.time_ns()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO predictions (key, labels, last_used) VALUES (?, ?, ?)",
+            [
+                # numpy scores from the huggingface pipeline are stored as floats
+                (self.get_key(text), json.dumps(text_labels, default=float), last_used)
+                for text, text_labels in zip(texts, labels)
+            ],
+        )
+
+        n_entries = self.connection.execute(
+            "SELECT COUNT(*) FROM predictions"
+        ).fetchone()[0]
+        if n_entries > self.max_entries:
+            self.connection.execute(
+                """DELETE FROM predictions WHERE key IN (
+                    SELECT key FROM predictions ORDER BY last_used LIMIT ?
+                )""",
+                (n_entries - self.max_entries,),
+            )
+            logger.info(
+                f"Evicted {n_entries - self.max_entries} least recently used NER predictions from cache."
+            )
+
+        self.connection.commit()
+
+    def log_stats(self) -> None:
+        """Logs the hit and miss counts since the cache was opened."""
+
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total > 0 else 0.0
+        logger.info(
+            f"NER prediction cache hits: {self.hits}, misses: {self.misses}, hit rate: {hit_rate:.1%}"
+        )
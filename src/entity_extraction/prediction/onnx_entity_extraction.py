@@ -0,0 +1,287 @@
+# Author: Ty Andrews
+# Date: 2023-06-21
+"""This script exports a fine tuned hugging face NER model to ONNX with dynamic
+int8 quantization and checks its accuracy against the original model's results.
+
+Usage: onnx_entity_extraction.py --model_path=<model_path> --output_path=<output_path> --data_path=<data_path> --reference_results_path=<reference_results_path> [--tolerance=<tolerance>] [--max_samples=<max_samples>]
+
+Options:
+    --model_path=<model_path>                           The path to the fine tuned hugging face model.
+    --output_path=<output_path>                         The directory to export the ONNX model to.
+    --data_path=<data_path>                             The path to the labelled evaluation data in json format.
+    --reference_results_path=<reference_results_path>   The classification results json of the original model on the same data.
+    --tolerance=<tolerance>                             The largest allowed drop in token and entity f1. [default: 0.01]
+    --max_samples=<max_samples>                         The maximum number of samples to evaluate. [default: None]
+"""
+
+import os
+import sys
+import json
+
+from docopt import docopt
+
+# ensure that the parent directory is on the path for relative imports
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+from src.logs import get_logger
+
+logger = get_logger(__name__)
+
+ONNX_FILE_NAME = "model.onnx"
+ONNX_QUANTIZED_FILE_NAME = "model_quantized.onnx"
+PARITY_CHECK_FILE_NAME = "onnx_parity_check.json"
+
+
+def export_onnx_model(model_path: str, output_path: str, quantize: bool = True) -> str:
+    """
+    Exports a hugging face token classification model to ONNX and optionally
+    applies dynamic int8 quantization to its weights.
+
+    Parameters
+    ----------
+    model_path : str
+        The path to the fine tuned hugging face model.
+    output_path : str
+        The directory to export the ONNX model and tokenizer to.
+    quantize : bool, optional
+        Whether to also export a dynamically quantized model, by default True.
+
+    Returns
+    -------
+    str
+        The directory the model was exported to.
+    """
+
+    # optimum is only needed to export and run ONNX models
+    from optimum.onnxruntime import ORTModelForTokenClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    logger.info(f"Exporting {model_path} to ONNX in {output_path}")
+    ort_model = ORTModelForTokenClassification.from_pretrained(model_path, export=True)
+    ort_model.save_pretrained(output_path)
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(output_path)
+
+    if quantize:
+        logger.info("Applying dynamic int8 quantization to the ONNX model")
+        quantizer = ORTQuantizer.from_pretrained(output_path, file_name=ONNX_FILE_NAME)
+        quantization_config = AutoQuantizationConfig.avx2(
+            is_static=False, per_channel=False
+        )
+        quantizer.quantize(save_dir=output_path, quantization_config=quantization_config)
+
+    return output_path
+
+
+def compare_with_reference_results(
+    classification_results: dict, reference_results: dict, tolerance: float = 0.01
+) -> dict:
+    """
+    Compares the token and entity f1 of the ONNX model with the original
+    model's classification results.
+
+    Parameters
+    ----------
+    classification_results : dict
+        The classification results of the ONNX model.
+    reference_results : dict
+        The classification results of the original model.
+    tolerance : float, optional
+        The largest allowed drop in f1 score, by default 0.01.
+
+    Returns
+    -------
+    dict
+        The f1 scores of both models and whether the ONNX model passed.
+    """
+
+    parity_check = {"tolerance": tolerance, "passed": True}
+
+    for method in ["token", "entity"]:
+        onnx_f1 = classification_results[method]["f1"]
+        reference_f1 = reference_results[method]["f1"]
+        parity_check[method] = {"onnx_f1": onnx_f1, "reference_f1": reference_f1}
+
+        if onnx_f1 < reference_f1 - tolerance:
+            logger.warning(
+                f"ONNX model {method} f1 of {onnx_f1:.4f} is more than {tolerance} below the reference f1 of {reference_f1:.4f}"
+            )
+            parity_check["passed"] = False
+
+    return parity_check
+
+
+def is_parity_check_passed(model_path: str) -> bool:
+    """
+    Checks whether an exported ONNX model passed its accuracy parity check.
+
+    Parameters
+    ----------
+    model_path : str
+        The directory of the exported ONNX model.
+
+    Returns
+    -------
+    bool
+        True if the parity check was run and passed.
+    """
+
+    parity_check_path = os.path.join(model_path, PARITY_CHECK_FILE_NAME)
+
+    if not os.path.exists(parity_check_path):
+        return False
+
+    with open(parity_check_path) as f:
+        return json.load(f)["passed"]
+
+
+def load_onnx_ner_pipeline(model_path: str, require_parity_check: bool = True):
+    """
+    Loads an exported ONNX named entity recognition model into a hugging face
+    pipeline returning the same aggregated entities as the original model.
+
+    The quantized model is used if it was exported. Loading fails unless the
+    model passed its accuracy parity check.
+
+    Parameters
+    ----------
+    model_path : str
+        The directory of the exported ONNX model.
+    require_parity_check : bool, optional
+        Whether to refuse models that haven't passed the parity check, by
+        default True.
+
+    Returns
+    -------
+    ner_pipe : transformers.pipelines.Pipeline
+        The ner model pipeline.
+    """
+
+    if require_parity_check and not is_parity_check_passed(model_path):
+        raise ValueError(
+            f"ONNX model in {model_path} has not passed the accuracy parity check, run onnx_entity_extraction.py to export and check it."
+        )
+
+    # optimum is only needed to export and run ONNX models
+    import onnxruntime
+    import torch
+    from optimum.onnxruntime import ORTModelForTokenClassification
+    from transformers import AutoTokenizer, pipeline
+
+    file_name = (
+        ONNX_QUANTIZED_FILE_NAME
+        if os.path.exists(os.path.join(model_path, ONNX_QUANTIZED_FILE_NAME))
+        else ONNX_FILE_NAME
+    )
+    logger.info(f"Using ONNX model {file_name} for CPU predictions")
+
+    # match the intra-op threads torch is allowed so workers don't oversubscribe
+    session_options = onnxruntime.SessionOptions()
+    session_options.intra_op_num_threads = torch.get_num_threads()
+
+    model = ORTModelForTokenClassification.from_pretrained(
+        model_path, file_name=file_name, session_options=session_options
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model_path, model_max_length=512)
+
+    ner_pipe = pipeline(
+        "ner",
+        model=model,
+        tokenizer=tokenizer,
+        aggregation_strategy="simple",
+    )
+
+    return ner_pipe
+
+
+def run_parity_check(
+    model_path: str,
+    data_path: str,
+    reference_results_path: str,
+    tolerance: float = 0.01,
+    max_samples: int = None,
+) -> dict:
+    """
+    Evaluates an exported ONNX model on labelled data, compares it with the
+    original model's results and records the outcome next to the model.
+
+    Parameters
+    ----------
+    model_path : str
+        The directory of the exported ONNX model.
+    data_path : str
+        The path to the labelled evaluation data in json format.
+    reference_results_path : str
+        The classification results json of the original model on the same data.
+    tolerance : float, optional
+        The largest allowed drop in f1 score, by default 0.01.
+    max_samples : int, optional
+        The maximum number of samples to evaluate, by default all.
+
+    Returns
+    -------
+    dict
+        The parity check results.
+    """
+
+    from src.entity_extraction.evaluation.hf_evaluate import (
+        load_evaluation_data,
+        get_predicted_labels,
+    )
+    from src.entity_extraction.evaluation.entity_extraction_evaluation import (
+        generate_classification_results,
+    )
+
+    # remove any previous result so the pipeline can't load the model mid check
+    parity_check_path = os.path.join(model_path, PARITY_CHECK_FILE_NAME)
+    if os.path.exists(parity_check_path):
+        os.remove(parity_check_path)
+
+    ner_pipe = load_onnx_ner_pipeline(model_path, require_parity_check=False)
+
+    df = load_evaluation_data(data_path)
+    if max_samples is not None:
+        df = df.sample(max_samples, random_state=42).reset_index(drop=True)
+
+    df = get_predicted_labels(ner_pipe, df)
+    classification_results = generate_classification_results(
+        df.ner_tags.tolist(), df.predicted_tokens.tolist()
+    )
+
+    with open(reference_results_path) as f:
+        reference_results = json.load(f)
+
+    parity_check = compare_with_reference_results(
+        classification_results, reference_results, tolerance
+    )
+    parity_check["reference_results_path"] = reference_results_path
+    parity_check["data_path"] = data_path
+
+    with open(parity_check_path, "w") as f:
+        json.dump(parity_check, f, indent=4)
+
+    logger.info(
+        f"ONNX parity check {'passed' if parity_check['passed'] else 'failed'}: {parity_check}"
+    )
+
+    return parity_check
+
+
+def main():
+    opt = docopt(__doc__)
+
+    export_onnx_model(opt["--model_path"], opt["--output_path"])
+
+    run_parity_check(
+        opt["--output_path"],
+        opt["--data_path"],
+        opt["--reference_results_path"],
+        tolerance=float(opt["--tolerance"]),
+        max_samples=int(opt["--max_samples"])
+        if opt["--max_samples"] != "None"
+        else None,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,37 @@ from src.logs import get_logger
 # logger = logging.getLogger(__name__)
 logger = get_logger(__name__)
 
+def get_ner_pipe_names(nlp) -> list:
+    """
+    Gets the names of the components needed to set the entities of a spacy
+    model, the components assigning doc.ents and any they listen to.
+
+    Parameters
+    ----------
+    nlp : spacy.language.Language
+        The spacy model.
+
+    Returns
+    -------
+    pipe_names : list
+        The names of the components to keep enabled.
+    """
+
+    ner_names = [
+        name for name in nlp.pipe_names if "doc.ents" in nlp.get_pipe_meta(name).assigns
+    ]
+
+    # shared tok2vec/transformer components must run for their listeners
+    return [
+        name
+        for name, pipe in nlp.pipeline
+        if name in ner_names
+        or any(
+            listener in ner_names
+            for listener in getattr(pipe, "listening_components", [])
+        )
+    ]
+
 def spacy_extract_all(  
     text: str,
     ner_model=None):
@@ -32,6 +63,9 @@ def spacy_extract_all(
     """
 
     if ner_model == None:
+        logger.warning(
+            "No spacy model passed, falling back to loading en_metaextractor_spacy."
+        )
         try:
             import en_metaextractor_spacy
             ner_model = en_metaextractor_spacy.load()
@@ -40,9 +74,65 @@ def spacy_extract_all(
             logger.info("Empty model passed, return 0 labels.")
             return []
 
-    entities = []
-    doc = ner_model(text)
+    return get_doc_entities(ner_model(text))
 
+def spacy_extract_batch(
+    texts: list,
+    nlp,
+    batch_size: int = 256,
+    n_process: int = 1):
+    """
+    Extracts entities from many texts by streaming them through a spacy model
+    in batches with only the named entity recognition components running.
+
+    Parameters
+    ----------
+    texts : list
+        The texts to extract entities from
+    nlp : spacy model
+        The spacy model to use for entity extraction
+    batch_size : int
+        The number of texts spacy processes at once
+    n_process : int
+        The number of processes spacy uses, -1 for one per CPU
+
+    Returns
+    -------
+    entities : list
+        A list of entities and their metadata for each text
+    """
+
+    ner_pipe_names = get_ner_pipe_names(nlp)
+    disabled_pipe_names = [
+        name for name in nlp.pipe_names if name not in ner_pipe_names
+    ]
+
+    return [
+        get_doc_entities(doc)
+        for doc in nlp.pipe(
+            texts,
+            batch_size=batch_size,
+            n_process=n_process,
+            disable=disabled_pipe_names,
+        )
+    ]
+
+def get_doc_entities(doc):
+    """
+    Gets the entities of a processed spacy doc
+
+    Parameters
+    ----------
+    doc : spacy.tokens.Doc
+        The processed text
+
+    Returns
+    -------
+    entities : list
+        A list of entities and their metadata
+    """
+
+    entities = []
     for ent in doc.ents:
         entities.append({
             "start": ent.start_char,
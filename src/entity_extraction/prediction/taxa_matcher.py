@@ -0,0 +1,276 @@
+# Author: Ty Andrews
+# Date: 2023-06-23
+
+import os
+import sys
+import pickle
+
+# ensure that the parent directory is on the path for relative imports
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+from src.logs import get_logger
+
+logger = get_logger(__name__)
+
+# in-process cache of built matchers keyed by the taxa file path
+TAXA_MATCHER_CACHE = {}
+
+
+class TaxaMatcher:
+    """
+    Aho-Corasick automaton over the taxon names that finds every taxon name
+    in a sentence in a single pass.
+
+    Names are grouped by their first word, the (common fossil) word extract_taxa
+    searches for. Within each group names are tried longest first and a
+    match only counts when preceded by a space, as in the original extraction.
+
+    Parameters
+    ----------
+    names_by_word : dict
+        The candidate taxon names of each first word, longest first.
+    source_stat : tuple, optional
+        The size and modification time of the taxa file the matcher was
+        built from, used to invalidate saved matchers.
+    """
+
+    def __init__(self, names_by_word: dict, source_stat: tuple = None):
+        self.source_stat = source_stat
+
+        self.names = []
+        name_ids = {}
+        # candidate name ids of each first word in the order they are tried
+        self.word_candidates = []
+        self.word_lengths = []
+        # first word index of each name
+        self.name_words = []
+
+        for word, names in names_by_word.items():
+            word_id = len(self.word_candidates)
+            candidates = []
+            for name in names:
+                if name not in name_ids:
+                    name_ids[name] = len(self.names)
+                    self.names.append(name)
+                    self.name_words.append(word_id)
+                candidates.append(name_ids[name])
+            self.word_candidates.append(candidates)
+            self.word_lengths.append(len(word))
+
+        self.build_automaton()
+
+    def build_automaton(self):
+        """Builds the goto, failure and output functions of the automaton."""
+
+        # transitions stored as (node, character) -> node in one flat dict,
+        # far smaller than a dict per node for tens of thousands of names
+        self.goto = {}
+        self.fail = [0]
+        outputs = [()]
+
+        for name_id, name in enumerate(self.names):
+            node = 0
+            for character in name:
+                next_node = self.goto.get((node, character))
+                if next_node is None:
+                    next_node = len(self.fail)
+                    self.goto[(node, character)] = next_node
+                    self.fail.append(0)
+                    outputs.append(())
+                node = next_node
+            outputs[node] = outputs[node] + (name_id,)
+
+        children = [[] for _ in self.fail]
+        for (node, character), next_node in self.goto.items():
+            children[node].append((character, next_node))
+
+        # breadth first so failure links always point to shallower nodes
+        queue = [next_node for _, next_node in children[0]]
+        for node in queue:
+            for character, next_node in children[node]:
+                fail_node = self.fail[node]
+                while fail_node and (fail_node, character) not in self.goto:
+                    fail_node = self.fail[fail_node]
+                self.fail[next_node] = self.goto.get((fail_node, character), 0)
+                outputs[next_node] = outputs[next_node] + outputs[self.fail[next_node]]
+                queue.append(next_node)
+
+        self.outputs = {node: output for node, output in enumerate(outputs) if output}
+
+    def find_first_occurrences(self, text: str) -> dict:
+        """
+        Finds the start index of the first occurrence of every taxon name.
+
+        Parameters
+        ----------
+        text : str
+            The text to search.
+
+        Returns
+        -------
+        dict
+            The start index keyed by name id.
+        """
+
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        names = self.names
+
+        first_occurrences = {}
+        node = 0
+        for end, character in enumerate(text):
+            while node and (node, character) not in goto:
+                node = fail[node]
+            node = goto.get((node, character), 0)
+
+            if node in outputs:
+                for name_id in outputs[node]:
+                    # matches are found in order of their end so the first
+                    # match of a name is also its first occurrence
+                    if name_id not in first_occurrences:
+                        first_occurrences[name_id] = end - len(names[name_id]) + 1
+
+        return first_occurrences
+
+    def extract(self, text: str) -> list:
+        """
+        Extracts the taxa from the text.
+
+        Parameters
+        ----------
+        text : str
+            The text to extract the taxa from.
+
+        Returns
+        -------
+        list
+            The list of taxa as dictionaries with the keys
+            'start', 'end', and a list containing the label 'TAXA'.
+        """
+
+        labels = []
+        cur_len = 0
+
+        # Split them into sentences to capture multiple instances of the same taxa
+        for sentence in text.split(". "):
+            first_occurrences = self.find_first_occurrences(sentence)
+
+            for word_id in {self.name_words[name_id] for name_id in first_occurrences}:
+                for name_id in self.word_candidates[word_id]:
+                    if name_id not in first_occurrences:
+                        continue
+
+                    name = self.names[name_id]
+                    index = first_occurrences[name_id]
+
+                    # If atleast 1 character is capital (i.e. start of the name of the fossil)
+                    if name != name.lower():
+                        if sentence[index - 1] != " ":
+                            continue
+                        labels.append(
+                            (
+                                cur_len + index,
+                                -self.word_lengths[word_id],
+                                {
+                                    "start": cur_len + index,
+                                    "end": cur_len + index + len(name),
+                                    "labels": ["TAXA"],
+                                    "text": name,
+                                },
+                            )
+                        )
+                    break
+
+            cur_len += len(sentence) + 2
+
+        # order by start then longest first word as the original extraction did
+        labels.sort(key=lambda label: label[:2])
+
+        return [label for _, _, label in labels]
+
+
+def build_taxa_matcher(file_path: str) -> TaxaMatcher:
+    """
+    Builds the taxa matcher from the taxa CSV file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the taxa CSV file.
+
+    Returns
+    -------
+    TaxaMatcher
+        The taxa matcher.
+    """
+
+    from src.entity_extraction.prediction.baseline_entity_extraction import (
+        load_taxa_data,
+    )
+
+    taxa, all_taxa_words = load_taxa_data(file_path)
+
+    taxa_by_word = dict(list(taxa.groupby("first_word", sort=False)))
+
+    names_by_word = {}
+    for taxa_word in all_taxa_words:
+        # same sort as the original per word lookup so ties keep their order
+        names_by_word[taxa_word] = (
+            taxa_by_word[taxa_word]
+            .sort_values(by="taxonname", key=lambda x: x.str.len(), ascending=False)[
+                "taxonname"
+            ]
+            .tolist()
+        )
+
+    stat = os.stat(file_path)
+    return TaxaMatcher(names_by_word, source_stat=(stat.st_size, stat.st_mtime_ns))
+
+
+def load_taxa_matcher(file_path: str, cache_path: str = None) -> TaxaMatcher:
+    """
+    Loads the taxa matcher for a taxa CSV file, building it only if there is
+    no up to date matcher saved to disk and saving any newly built matcher.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the taxa CSV file.
+    cache_path : str, optional
+        The path to save the matcher to, by default next to the taxa file.
+
+    Returns
+    -------
+    TaxaMatcher
+        The taxa matcher.
+    """
+
+    cache_key = os.path.abspath(file_path)
+    if cache_key in TAXA_MATCHER_CACHE:
+        return TAXA_MATCHER_CACHE[cache_key]
+
+    if cache_path is None:
+        cache_path = os.path.splitext(file_path)[0] + "_matcher.pkl"
+
+    stat = os.stat(file_path)
+    matcher = None
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            matcher = pickle.load(f)
+        if matcher.source_stat != (stat.st_size, stat.st_mtime_ns):
+            logger.info(f"Taxa file {file_path} changed, rebuilding taxa matcher.")
+            matcher = None
+
+    if matcher is None:
+        logger.info(f"Building taxa matcher from {file_path}")
+        matcher = build_taxa_matcher(file_path)
+        try:
+            with open(cache_path, "wb") as f:
+                pickle.dump(matcher, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            logger.warning(f"Could not save taxa matcher to {cache_path}. Error: {e}")
+
+    TAXA_MATCHER_CACHE[cache_key] = matcher
+
+    return matcher
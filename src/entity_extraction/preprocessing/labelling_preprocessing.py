@@ -19,9 +19,12 @@ Options:
 
 import pandas as pd
 import os
+import io
 import logging
 import hashlib
 import json
+import sqlite3
+import tempfile
 import spacy
 from datetime import datetime
 from docopt import docopt
@@ -61,47 +64,41 @@ def clean_words(words: list):
     return clean_words
 
 
-def get_journal_articles(sentences_path):
+# number of runs of lines inserted into the spill index at a time
+SPILL_INDEX_BATCH_SIZE = 10000
+
+SENTENCES_NLP_COLUMNS = [
+    "gddid",
+    "sentid",
+    "wordidx",
+    "words",
+    "part_of_speech",
+    "special_class",
+    "lemmas",
+    "word_type",
+    "word_modified",
+]
+
+
+def clean_sentence_words(words: pd.Series) -> pd.Series:
     """
-    Loads and formats sentences_nlp352 json file and converts to a dataframe
+    Converts the postgres array formatted words of each sentence into text
 
     Parameters
     ----------
-    sentences_path : string
-        Path where the individual sentences are stored.
+    words : pd.Series
+        The words column of the sentences_nlp352 file
 
     Returns
     -------
-    journal_articles: pd.DataFrame
-        pd.DataFrame with cleaned individual sentences for all articles
+    pd.Series
+        The cleaned sentence text
     """
-    
-    assert (
-        os.path.exists(sentences_path) == True 
-    ), f"Sentences NLP file does not exist {sentences_path}"
-    
-    journal_articles = pd.read_csv(
-        sentences_path,
-        sep="\t",
-        names=[
-            "gddid",
-            "sentid",
-            "wordidx",
-            "words",
-            "part_of_speech",
-            "special_class",
-            "lemmas",
-            "word_type",
-            "word_modified",
-        ],
-        usecols=["gddid", "sentid", "words"],
-    )
-
-    journal_articles["words"] = (
-        journal_articles.words.str.replace('"', "", regex=True)
+    return (
+        words.str.replace('"', "", regex=True)
         .replace(",--,", "-", regex=True)
         .replace(".,/,", ". / ", regex=True)
-        .replace("\{", "", regex=True)
+        .replace(r"\{", "", regex=True)
         .replace("}", "", regex=True)
         .replace(r"\W{4,}", "", regex=True)
         .replace(",,,", "comma_sym", regex=True)
@@ -121,9 +118,253 @@ def get_journal_articles(sentences_path):
         .replace("-LCB-", "-", regex=True)
     )
 
+
+def get_journal_articles(sentences_path):
+    """
+    Loads and formats sentences_nlp352 json file and converts to a dataframe
+
+    Parameters
+    ----------
+    sentences_path : string
+        Path where the individual sentences are stored.
+
+    Returns
+    -------
+    journal_articles: pd.DataFrame
+        pd.DataFrame with cleaned individual sentences for all articles
+    """
+    
+    assert (
+        os.path.exists(sentences_path) == True 
+    ), f"Sentences NLP file does not exist {sentences_path}"
+    
+    journal_articles = pd.read_csv(
+        sentences_path,
+        sep="\t",
+        names=SENTENCES_NLP_COLUMNS,
+        usecols=["gddid", "sentid", "words"],
+    )
+
+    journal_articles["words"] = clean_sentence_words(journal_articles["words"])
+
     return journal_articles
 
 
+def build_gddid_spill_index(sentences_path, index_path):
+    """
+    Indexes the byte range of every run of an article's lines in a
+    sentences_nlp352 file in a sqlite database on disk, so the lines of an
+    article spread across the file can be read back without holding an
+    index of the whole file in memory.
+
+    Parameters
+    ----------
+    sentences_path : string
+        Path where the individual sentences are stored.
+    index_path : string
+        Path of the sqlite database to create.
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection to the index, with a runs table of the gddid, start and
+        end byte offset of each run of lines.
+    """
+    connection = sqlite3.connect(index_path)
+    connection.execute(
+        """CREATE TABLE runs (
+            gddid TEXT NOT NULL,
+            start_offset INTEGER NOT NULL,
+            end_offset INTEGER NOT NULL
+        )"""
+    )
+
+    runs = []
+    run_gddid = None
+    run_start = run_end = 0
+
+    with open(sentences_path, "rb") as f:
+        offset = 0
+        for line in f:
+            next_offset = offset + len(line)
+            # blank lines are skipped by pd.read_csv so they don't break a run
+            if line.strip():
+                gddid = line.split(b"\t", 1)[0].decode("utf-8")
+                if gddid != run_gddid:
+                    if run_gddid is not None:
+                        runs.append((run_gddid, run_start, run_end))
+                    run_gddid, run_start = gddid, offset
+                run_end = next_offset
+
+                if len(runs) >= SPILL_INDEX_BATCH_SIZE:
+                    connection.executemany("INSERT INTO runs VALUES (?, ?, ?)", runs)
+                    runs = []
+            offset = next_offset
+
+    if run_gddid is not None:
+        runs.append((run_gddid, run_start, run_end))
+    connection.executemany("INSERT INTO runs VALUES (?, ?, ?)", runs)
+    connection.execute("CREATE INDEX runs_gddid ON runs (gddid, start_offset)")
+    connection.commit()
+
+    return connection
+
+
+def iter_spilled_articles(sentences_path, yielded_gddids):
+    """
+    Reads the articles of a sentences_nlp352 file whose sentences are not
+    contiguous back from a spill index, one article at a time in the order
+    they first appear.
+
+    Parameters
+    ----------
+    sentences_path : string
+        Path where the individual sentences are stored.
+    yielded_gddids : set
+        The articles already yielded, they are only read again if they
+        reappear later in the file.
+
+    Yields
+    ------
+    pd.DataFrame
+        The cleaned individual sentences of a single article.
+    """
+    with tempfile.TemporaryDirectory() as index_dir:
+        connection = build_gddid_spill_index(
+            sentences_path, os.path.join(index_dir, "gddid_index.sqlite")
+        )
+
+        try:
+            with open(sentences_path, "rb") as f:
+                for gddid, n_runs in connection.execute(
+                    "SELECT gddid, COUNT(*) FROM runs GROUP BY gddid ORDER BY MIN(start_offset)"
+                ):
+                    if gddid in yielded_gddids and n_runs == 1:
+                        continue
+
+                    article_lines = []
+                    for start_offset, end_offset in connection.execute(
+                        "SELECT start_offset, end_offset FROM runs WHERE gddid = ? ORDER BY start_offset",
+                        (gddid,),
+                    ):
+                        f.seek(start_offset)
+                        article_lines.append(f.read(end_offset - start_offset).rstrip(b"\r\n"))
+
+                    yield read_journal_article_lines(b"\n".join(article_lines))
+        finally:
+            connection.close()
+
+
+def iter_journal_articles(sentences_path, chunksize=100000):
+    """
+    Streams a sentences_nlp352 file and yields one complete article at a time
+    so peak memory is bounded by the largest article instead of the whole file.
+
+    The file is read in chunks and each article is yielded as soon as the
+    next one starts. If an article reappears after another article started,
+    the sentences are not contiguous: the byte ranges of every article's
+    lines are spilled to an index on disk and the remaining articles are
+    read back from it. Articles already yielded that reappear are yielded
+    again with all of their sentences, to replace the partial article.
+
+    Parameters
+    ----------
+    sentences_path : string
+        Path where the individual sentences are stored.
+    chunksize : int
+        Number of rows read at a time.
+
+    Yields
+    ------
+    pd.DataFrame
+        The cleaned individual sentences of a single article.
+    """
+
+    assert (
+        os.path.exists(sentences_path) == True
+    ), f"Sentences NLP file does not exist {sentences_path}"
+
+    yielded_gddids = set()
+    article_parts = []
+    current_gddid = None
+
+    for chunk in pd.read_csv(
+        sentences_path,
+        sep="\t",
+        names=SENTENCES_NLP_COLUMNS,
+        usecols=["gddid", "sentid", "words"],
+        chunksize=chunksize,
+    ):
+        gddids = chunk["gddid"]
+        run_ids = (gddids != gddids.shift()).cumsum()
+
+        for _, article_run in chunk.groupby(run_ids, sort=False):
+            gddid = article_run["gddid"].iloc[0]
+
+            if gddid != current_gddid and gddid in yielded_gddids:
+                logger.warning(
+                    f"Article {gddid} reappears in {sentences_path}, articles are not contiguous, "
+                    "reading the remaining articles from a spill index."
+                )
+                yield from iter_spilled_articles(sentences_path, yielded_gddids)
+                return
+
+            if gddid != current_gddid and len(article_parts) > 0:
+                yield clean_journal_article(pd.concat(article_parts))
+                yielded_gddids.add(current_gddid)
+                article_parts = []
+
+            current_gddid = gddid
+            article_parts.append(article_run)
+
+    if len(article_parts) > 0:
+        yield clean_journal_article(pd.concat(article_parts))
+
+
+def read_journal_article_lines(article_lines):
+    """
+    Parses the raw sentences_nlp352 lines of a single article.
+
+    Parameters
+    ----------
+    article_lines : bytes
+        The newline separated lines of the article.
+
+    Returns
+    -------
+    pd.DataFrame
+        The cleaned individual sentences of the article.
+    """
+    journal_article = pd.read_csv(
+        io.BytesIO(article_lines),
+        sep="\t",
+        names=SENTENCES_NLP_COLUMNS,
+        usecols=["gddid", "sentid", "words"],
+    )
+
+    return clean_journal_article(journal_article)
+
+
+def clean_journal_article(journal_article):
+    """
+    Resets the index and cleans the words of a single article's sentences.
+
+    Parameters
+    ----------
+    journal_article : pd.DataFrame
+        The raw sentences of a single article.
+
+    Returns
+    -------
+    pd.DataFrame
+        The cleaned individual sentences of the article.
+    """
+    journal_article = journal_article.reset_index(drop=True)
+    journal_article["words"] = clean_sentence_words(journal_article["words"])
+
+    return journal_article
+
+
 def preprocessed_bibliography(path):
     """
     Loads and formats bibliography json file and converts to a dataframe
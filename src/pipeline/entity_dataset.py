@@ -0,0 +1,303 @@
+# Author: Ty Andrews
+# Date: 2023-06-22
+
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from src.logs import get_logger
+
+logger = get_logger(__name__)
+
+ENTITY_LABELS = ["TAXA", "GEOG", "ALTI", "EMAIL", "SITE", "REGION", "AGE"]
+
+SENTENCES_TABLE = "sentences"
+MENTIONS_TABLE = "entity_mentions"
+
+SENTENCES_SCHEMA = pa.schema(
+    [
+        ("gddid", pa.string()),
+        ("sentid", pa.int64()),
+        ("section_name", pa.string()),
+        ("text", pa.string()),
+        ("model_name", pa.string()),
+        ("date_processed", pa.string()),
+    ]
+)
+
+# mentions reference their sentence by (gddid, sentid) instead of repeating it
+MENTIONS_SCHEMA = pa.schema(
+    [
+        ("gddid", pa.string()),
+        ("sentid", pa.int64()),
+        ("label", pa.string()),
+        ("name", pa.string()),
+        ("text", pa.string()),
+        ("start", pa.int64()),
+        ("end", pa.int64()),
+    ]
+)
+
+BATCH_PARTITIONING = ds.partitioning(pa.schema([("batch", pa.string())]), flavor="hive")
+
+
+def get_entity_name(entity_text: str) -> str:
+    """
+    Removes leading/trailing whitespace and punctuation from an extracted
+    entity's text to get the name entities are grouped by.
+
+    Parameters
+    ----------
+    entity_text : str
+        The extracted entity text.
+
+    Returns
+    -------
+    str
+        The entity name.
+    """
+
+    return entity_text.strip().strip(".,!?;:'\"")
+
+
+def write_entity_batch(
+    articles: list, output_path: str, batch_id: str = None
+) -> str:
+    """
+    Writes the post-processed entities of a batch of articles as one
+    partition of the sentences and entity mentions datasets.
+
+    Parameters
+    ----------
+    articles : list
+        The post-processed entities of each article as DataFrames.
+    output_path : str
+        The directory containing the datasets.
+    batch_id : str, optional
+        The partition name, by default a timestamp so later batches sort last.
+
+    Returns
+    -------
+    str
+        The partition name the batch was written to.
+    """
+
+    if batch_id is None:
+        batch_id = pd.Timestamp.now().strftime("%Y%m%dT%H%M%S%f")
+
+    date_processed = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    sentences = {name: [] for name in SENTENCES_SCHEMA.names}
+    mentions = {name: [] for name in MENTIONS_SCHEMA.names}
+
+    for article in articles:
+        for row in article.to_dict("records"):
+            sentences["gddid"].append(row["gddid"])
+            sentences["sentid"].append(int(row["sentid"]))
+            sentences["section_name"].append(row["section_name"])
+            sentences["text"].append(row["text"])
+            sentences["model_name"].append(row["model_name"])
+            sentences["date_processed"].append(date_processed)
+
+            # same order as the json export so articles read back identically
+            for label in ENTITY_LABELS:
+                for entity in row[label]:
+                    mentions["gddid"].append(row["gddid"])
+                    mentions["sentid"].append(int(row["sentid"]))
+                    mentions["label"].append(label)
+                    mentions["name"].append(get_entity_name(entity["text"]))
+                    mentions["text"].append(entity["text"])
+                    mentions["start"].append(int(entity["start"]))
+                    mentions["end"].append(int(entity["end"]))
+
+    for table_name, columns, schema in [
+        (SENTENCES_TABLE, sentences, SENTENCES_SCHEMA),
+        (MENTIONS_TABLE, mentions, MENTIONS_SCHEMA),
+    ]:
+        partition_path = os.path.join(output_path, table_name, f"batch={batch_id}")
+        os.makedirs(partition_path, exist_ok=True)
+        pq.write_table(
+            pa.Table.from_pydict(columns, schema=schema),
+            os.path.join(partition_path, "part-0.parquet"),
+            compression="zstd",
+        )
+
+    logger.info(
+        f"Exported {len(sentences['gddid'])} sentences and {len(mentions['gddid'])} entity mentions to batch {batch_id}"
+    )
+
+    return batch_id
+
+
+def has_entity_dataset(output_path: str) -> bool:
+    """
+    Checks whether a directory contains an entity dataset.
+
+    Parameters
+    ----------
+    output_path : str
+        The directory to check.
+
+    Returns
+    -------
+    bool
+        True if the sentences dataset exists.
+    """
+
+    return os.path.isdir(os.path.join(output_path, SENTENCES_TABLE))
+
+
+def read_entity_table(
+    output_path: str,
+    table_name: str,
+    gddid: str = None,
+    columns: list = None,
+    batch: str = None,
+) -> pa.Table:
+    """
+    Reads one of the entity datasets keeping only the latest batch of each
+    article, so articles reprocessed into a later batch aren't duplicated.
+
+    Parameters
+    ----------
+    output_path : str
+        The directory containing the datasets.
+    table_name : str
+        Either SENTENCES_TABLE or MENTIONS_TABLE.
+    gddid : str, optional
+        Only read the rows of this article.
+    columns : list, optional
+        The columns to read, by default all.
+    batch : str, optional
+        Only read the rows of this batch instead of each article's latest.
+
+    Returns
+    -------
+    pa.Table
+        The rows of the latest batch of each article.
+    """
+
+    dataset = ds.dataset(
+        os.path.join(output_path, table_name),
+        format="parquet",
+        partitioning=BATCH_PARTITIONING,
+    )
+
+    if columns is not None:
+        columns = list(dict.fromkeys(columns + ["gddid", "batch"]))
+
+    row_filter = None
+    if gddid is not None:
+        row_filter = pc.field("gddid") == gddid
+    if batch is not None:
+        batch_filter = pc.field("batch") == batch
+        row_filter = batch_filter if row_filter is None else row_filter & batch_filter
+
+    table = dataset.to_table(columns=columns, filter=row_filter)
+
+    if table.num_rows == 0 or batch is not None:
+        return table
+
+    # filter rather than join so rows keep the order they were written in
+    latest_batches = table.group_by("gddid").aggregate([("batch", "max")])
+    row_latest_batch = latest_batches["batch_max"].take(
+        pc.index_in(table["gddid"], value_set=latest_batches["gddid"])
+    )
+
+    return table.filter(pc.equal(table["batch"], row_latest_batch))
+
+
+def list_entity_articles(output_path: str) -> pd.DataFrame:
+    """
+    Lists the articles in an entity dataset with the date they were processed.
+
+    Parameters
+    ----------
+    output_path : str
+        The directory containing the datasets.
+
+    Returns
+    -------
+    pd.DataFrame
+        The gddid and date_processed of every article.
+    """
+
+    sentences = read_entity_table(
+        output_path, SENTENCES_TABLE, columns=["date_processed"]
+    ).to_pandas()
+
+    return sentences[["gddid", "date_processed"]].drop_duplicates(
+        "gddid", ignore_index=True
+    )
+
+
+def read_article_entities(output_path: str, gddid: str) -> dict:
+    """
+    Reads an article's entities from the datasets in the same structure as
+    the exported json files.
+
+    Parameters
+    ----------
+    output_path : str
+        The directory containing the datasets.
+    gddid : str
+        The GDD ID of the article.
+
+    Returns
+    -------
+    dict
+        The article's entities and relevant sentences.
+    """
+
+    sentences = read_entity_table(output_path, SENTENCES_TABLE, gddid=gddid)
+    if sentences.num_rows == 0:
+        raise FileNotFoundError(f"No entities found for GDD ID {gddid} in {output_path}")
+
+    # mentions come from the same batch as the article's latest sentences
+    mentions = read_entity_table(
+        output_path,
+        MENTIONS_TABLE,
+        gddid=gddid,
+        batch=sentences["batch"][0].as_py(),
+    )
+
+    sentences = sentences.to_pylist()
+    sentence_lookup = {sentence["sentid"]: sentence for sentence in sentences}
+
+    results_dict = {
+        "gddid": gddid,
+        "date_processed": sentences[0]["date_processed"],
+        "model_name": sentences[0]["model_name"],
+        "entities": {label: {} for label in ENTITY_LABELS},
+        "relevant_sentences": [
+            {"text": sentence["text"], "sentid": sentence["sentid"]}
+            for sentence in sentences
+        ],
+    }
+
+    for mention in mentions.to_pylist():
+        sentence = sentence_lookup[mention["sentid"]]
+        label_entities = results_dict["entities"][mention["label"]]
+        if mention["name"] not in label_entities:
+            label_entities[mention["name"]] = {
+                "corrected_name": None,
+                "deleted": False,
+                "sentence": [],
+            }
+        label_entities[mention["name"]]["sentence"].append(
+            {
+                "text": sentence["text"],
+                "section_name": sentence["section_name"],
+                "sentid": sentence["sentid"],
+                "char_index": {"start": mention["start"], "end": mention["end"]},
+            }
+        )
+
+    return results_dict
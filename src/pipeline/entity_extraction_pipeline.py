@@ -1,18 +1,28 @@
 # Author: Ty Andrews
 # Date: 2023-06-05
 """
-Usage: entity_extraction_pipeline.py --article_text_path=<article_text_path> --output_path=<output_path> [--max_sentences=<max_sentences>] [--max_articles=<max_articles>]
+Usage: entity_extraction_pipeline.py --article_text_path=<article_text_path> --output_path=<output_path> [--max_sentences=<max_sentences>] [--max_articles=<max_articles>] [--workers=<workers>]
 
 Options:
 --article_text_path=<article_text_path> The path to the article text data file.
 --output_path=<output_path> The path to export the extracted entities to.
 --max_sentences=<max_sentences> The maximum number of sentences to extract entities from. [default: -1]
 --max_articles <max_articles> The maximum number of articles to extract entities from. [default: -1]
+--workers=<workers> The number of worker processes, each holding its own model. Defaults to the WORKERS environment variable or 1.
 """ 
 
 import os
 import sys
+import copy
+import multiprocessing
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
 
+import numpy as np
 import pandas as pd
 import json
 from docopt import docopt
@@ -22,28 +32,66 @@ from dotenv import load_dotenv, find_dotenv
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 
-from src.entity_extraction.preprocessing.labelling_preprocessing import get_journal_articles
+from src.entity_extraction.preprocessing.labelling_preprocessing import (
+    get_journal_articles,
+    iter_journal_articles,
+    get_hash,
+)
 from src.logs import get_logger
 from src.entity_extraction.prediction.hf_entity_extraction import (
     load_ner_model_pipeline,
+    predict_with_token_budget,
 )
 from src.entity_extraction.prediction.spacy_entity_extraction import (
-    spacy_extract_all,
+    spacy_extract_batch,
+)
+from src.entity_extraction.prediction.onnx_entity_extraction import (
+    load_onnx_ner_pipeline,
+)
+from src.entity_extraction.prediction.ner_cache import (
+    NERPredictionCache,
+    get_model_fingerprint,
 )
 
 load_dotenv(find_dotenv())
 
 # get the MODEL_NAME from environment variables
 HF_NER_MODEL_PATH = os.getenv("HF_NER_MODEL_PATH", "./models/ner/metaextractor")
+ONNX_NER_MODEL_PATH = os.getenv("ONNX_NER_MODEL_PATH", "./models/ner/metaextractor-onnx")
 SPACY_NER_MODEL_NAME = os.getenv("SPACY_NER_MODEL_NAME", "en_metaextractor_spacy")
 USE_NER_MODEL_TYPE = os.getenv("USE_NER_MODEL_TYPE", "huggingface")
 MAX_SENTENCES = os.getenv("MAX_SENTENCES", "-1")
 MAX_ARTICLES = os.getenv("MAX_ARTICLES", "-1")
+# number of articles whose sentence batches are pooled into one inference stream
+ARTICLE_BATCH_SIZE = os.getenv("ARTICLE_BATCH_SIZE", "16")
+# number of sentence batches passed to the model at once
+NER_BATCH_SIZE = os.getenv("NER_BATCH_SIZE", "32")
+# padded tokens per forward pass, defaults to a CPU or GPU budget if unset
+NER_MAX_BATCH_TOKENS = os.getenv("NER_MAX_BATCH_TOKENS")
+# processes spacy splits each stream of texts across, -1 for one per CPU
+SPACY_N_PROCESS = os.getenv("SPACY_N_PROCESS", "1")
+# number of worker processes, each holding its own copy of the model
+WORKERS = os.getenv("WORKERS", "1")
+# append-only record of the articles already processed in the output directory
+MANIFEST_FILE_NAME = "extraction_manifest.jsonl"
+# json writes one file per article, parquet writes a batch of the entity dataset
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "json")
+# directory of the on disk NER prediction cache, caching is disabled if unset
+NER_CACHE_DIR = os.getenv("NER_CACHE_DIR")
+NER_CACHE_MAX_ENTRIES = os.getenv("NER_CACHE_MAX_ENTRIES", "1000000")
 
 logger = get_logger(__name__)
 
 ALL_LABELS = ["TAXA", "GEOG", "ALTI", "EMAIL", "SITE", "REGION", "AGE"]
 
+# process-wide registry of loaded NER models keyed by (model_type, model_path)
+# so the weights are read from disk once per pipeline run instead of per article
+NER_MODEL_REGISTRY = {}
+# process-wide prediction caches keyed by (model_type, model_path)
+NER_CACHE_REGISTRY = {}
+
+WARM_UP_TEXT = "Pollen of Pinus and Picea was recovered at 1200 m asl near Lake Garibaldi, dated to 8500 BP."
+
 
 def load_relevant_articles(relevance_results_path: str) -> pd.DataFrame:
     """
@@ -124,7 +172,56 @@ def load_article_text_data(article_text_path: str) -> pd.DataFrame:
 
     logger.info(f"Loading article text data from {article_text_path}")
     # read in article text data to dataframe
-    article_text_data = get_journal_articles(article_text_path)
+    article_text_data = prepare_article_text_data(
+        get_journal_articles(article_text_path)
+    )
+
+    logger.info(
+        f"Done loading articles, found {len(article_text_data.gddid.unique())} articles."
+    )
+
+    return article_text_data
+
+
+def iter_article_text_data(article_text_path: str, chunksize: int = 100000):
+    """
+    Streams the article text data file one article at a time.
+
+    Parameters
+    ----------
+    article_text_path : str
+        The path to the article text data file.
+    chunksize : int
+        The number of rows read from the file at a time.
+
+    Yields
+    ------
+    pd.DataFrame
+        The article text data of a single article.
+    """
+
+    logger.info(f"Streaming article text data from {article_text_path}")
+
+    for journal_article in iter_journal_articles(
+        article_text_path, chunksize=chunksize
+    ):
+        yield prepare_article_text_data(journal_article)
+
+
+def prepare_article_text_data(article_text_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the text length, word count and section name to the article text data.
+
+    Parameters
+    ----------
+    article_text_data : pd.DataFrame
+        The cleaned sentences with the columns "gddid", "sentid" and "words".
+
+    Returns
+    -------
+    pd.DataFrame
+        The article text data.
+    """
 
     # rename words column to text
     article_text_data = article_text_data.rename(columns={"words": "text"})
@@ -172,10 +269,6 @@ def load_article_text_data(article_text_path: str) -> pd.DataFrame:
         "Introduction"
     )
 
-    logger.info(
-        f"Done loading articles, found {len(article_text_data.gddid.unique())} articles."
-    )
-
     return article_text_data
 
 
@@ -190,16 +283,41 @@ def combine_sentence_data(
         raise ValueError(
             "article_text_data must only contain one article to avoid batch splitting across articles."
         )
+
+    return combine_multi_article_sentence_data(
+        article_text_data, max_word_length=max_word_length
+    )
+
+
+def combine_multi_article_sentence_data(
+    article_text_data: pd.DataFrame, max_word_length=256
+) -> pd.DataFrame:
+    """
+    Combines the sentences of one or more articles into batches of
+    max_word_length words or less. Batches never span two articles and are
+    keyed by (gddid, batch) so predictions can be scattered back to articles.
+
+    Parameters
+    ----------
+    article_text_data : pd.DataFrame
+        The article text data for any number of articles.
+    max_word_length : int
+        The maximum number of words in each batch.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (gddid, batch) in the original article order.
+    """
     batch_df = article_text_data.copy(deep=True)
 
+    # restart the word count for each article so batches stay within an article
     batch_df["batch"] = (
-        article_text_data.loc[:, "word_count"]
-        .cumsum()
-        .apply(lambda x: int(x / max_word_length))
+        batch_df.groupby("gddid", sort=False)["word_count"].cumsum()
+        // max_word_length
     )
 
-    batch_df = batch_df.groupby("batch", as_index=False).agg(
-        gddid=("gddid", "first"),
+    batch_df = batch_df.groupby(["gddid", "batch"], as_index=False, sort=False).agg(
         sentid_list=("sentid", lambda x: x.tolist()),
         section_name_list=("section_name", lambda x: x.tolist()),
         text_length_list=("text_length", lambda x: x.tolist()),
@@ -214,6 +332,116 @@ def combine_sentence_data(
     return batch_df
 
 
+def get_sentence_offsets(text_length_list: list) -> tuple:
+    """
+    Gets the start and end character offsets of each sentence in a batch
+    where the sentences were joined with a single space.
+
+    Parameters
+    ----------
+    text_length_list : list
+        The character length of each sentence in the batch.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        The start and end offsets of each sentence, both sorted ascending.
+    """
+    text_lengths = np.asarray(text_length_list, dtype=np.int64)
+    sentence_index = np.arange(len(text_lengths))
+    cumulative_lengths = np.cumsum(text_lengths)
+
+    # add additional index for the space between sentences
+    sent_starts = cumulative_lengths - text_lengths + sentence_index
+    sent_ends = cumulative_lengths + sentence_index + 1
+
+    return sent_starts, sent_ends
+
+
+def recreate_sentence_columns(row) -> dict:
+    """
+    Splits a batch back into its original sentences as columns of equal
+    length lists. Entities are assigned to sentences with a sorted search
+    over the sentence offsets instead of checking every entity against
+    every sentence.
+
+    Parameters
+    ----------
+    row : pd.Series or dict
+        The row of the extracted entities results with the
+        columns "text", "text_length_list", "word_count_list", "sentid_list",
+        "section_name_list", "gddid", "model_name" and a column per label.
+
+    Returns
+    -------
+    dict
+        The recreated sentence columns keyed by column name.
+    """
+
+    # get the original sentence
+    original_sentence = row["text"]
+    section_names = row["section_name_list"]
+    n_sentences = len(row["text_length_list"])
+
+    sent_starts, sent_ends = get_sentence_offsets(row["text_length_list"])
+
+    columns = {}
+
+    for label in ALL_LABELS:
+        sentence_entities = [[] for _ in range(n_sentences)]
+        entities = row[label]
+
+        if len(entities) > 0:
+            ent_starts = np.array([ent["start"] for ent in entities])
+            ent_ends = np.array([ent["end"] for ent in entities])
+
+            # an entity belongs to every sentence where start <= sent_end and
+            # end >= sent_start, which is a contiguous range of sentences
+            first_sentences = np.searchsorted(sent_ends, ent_starts, side="left")
+            last_sentences = np.searchsorted(sent_starts, ent_ends, side="right") - 1
+
+            for ent, first, last in zip(entities, first_sentences, last_sentences):
+                for i in range(first, last + 1):
+                    # prevent overwriting the original dict
+                    updated_ent = ent.copy()
+                    updated_ent["start"] = ent["start"] - int(sent_starts[i])
+                    updated_ent["end"] = ent["end"] - int(sent_starts[i])
+                    updated_ent["section_name"] = section_names[i]
+                    sentence_entities[i].append(updated_ent)
+
+        columns[label] = sentence_entities
+
+    columns["sentid"] = list(row["sentid_list"])
+    # remove leading/trailing whitespace
+    columns["text"] = [
+        original_sentence[start:end].strip()
+        for start, end in zip(sent_starts, sent_ends)
+    ]
+    columns["word_count"] = list(row["word_count_list"])
+    columns["text_length"] = list(row["text_length_list"])
+    columns["gddid"] = [row["gddid"]] * n_sentences
+    columns["section_name"] = list(section_names)
+    columns["model_name"] = [row["model_name"]] * n_sentences
+
+    for sentid, text, text_length, word_count in zip(
+        columns["sentid"],
+        columns["text"],
+        columns["text_length"],
+        columns["word_count"],
+    ):
+        if len(text) != text_length:
+            logger.warning(
+                f"Sentence length does not match text length, sentid: {sentid}"
+            )
+
+        if len(text.split()) != word_count:
+            logger.warning(
+                f"Word count does not match number of words, sentid: {sentid}"
+            )
+
+    return columns
+
+
 def recreate_original_sentences_with_labels(row):
     """
     Recreates the original sentence with the labels added to the correct sentences.
@@ -231,64 +459,280 @@ def recreate_original_sentences_with_labels(row):
         The recreated sentences with the labels added and start/end indices adjusted.
     """
 
-    # get the original sentence
-    original_sentence = row["text"]
+    return pd.DataFrame(recreate_sentence_columns(row))
 
-    split_df = pd.DataFrame()
 
-    for i in range(0, len(row["text_length_list"])):
-        # initialize empty df with columns for each label
-        sent_df = pd.DataFrame(columns=ALL_LABELS)
+def warm_up_ner_model(ner_model, model_type: str) -> None:
+    """
+    Runs a single short prediction so lazy initialisation (thread pools, kernel
+    selection, tokenizer caches) is paid before the first article is processed.
+
+    Parameters
+    ----------
+    ner_model : transformers.pipelines.Pipeline or spacy.language.Language
+        The loaded NER model.
+    model_type : str
+        Either "huggingface", "onnx" or "spacy".
+    """
 
-        sent_df["sentid"] = [row["sentid_list"][i]]
+    start_time = pd.Timestamp.now()
 
-        sent_start = sum(row["text_length_list"][0:i]) + i
-        # add additional i for the space between sentences
-        sent_end = sum(row["text_length_list"][0 : i + 1]) + i + 1
+    if model_type in ("huggingface", "onnx"):
+        ner_model([WARM_UP_TEXT])
+    elif model_type == "spacy":
+        ner_model(WARM_UP_TEXT)
 
-        sent_df["text"] = original_sentence[
-            sent_start:sent_end
-        ].strip()  # remove leading/trailing whitespace
+    logger.info(f"Warmed up {model_type} model in {pd.Timestamp.now() - start_time}")
 
-        sent_df["word_count"] = [row["word_count_list"][i]]
-        sent_df["text_length"] = [row["text_length_list"][i]]
-        sent_df["gddid"] = [row["gddid"]]
-        sent_df["section_name"] = [row["section_name_list"][i]]
-        sent_df["model_name"] = [row["model_name"]]
 
-        for label in ALL_LABELS:
-            lab_ents = []
-            for ent in row[label]:
-                # prevent overwriting the original dict
-                updated_ent = ent.copy()
-                # if the label start is less than the next sentence start then add it to the labels_df
-                if (ent["start"] <= sent_end) & (ent["end"] >= sent_start):
-                    updated_ent["start"] = ent["start"] - sent_start
-                    updated_ent["end"] = ent["end"] - sent_start
-                    updated_ent["section_name"] = row["section_name_list"][i]
-                    lab_ents.append(updated_ent)
-
-            sent_df[label] = [lab_ents]
-
-        if len(sent_df["text"].iloc[0]) != sent_df["text_length"].iloc[0]:
-            logger.warning(
-                f"Sentence length does not match text length, sentid: {sent_df['sentid'].iloc[0]}"
-            )
+def load_ner_model(model_type: str, model_path: str):
+    """
+    Loads the NER model once per process and returns the cached instance on
+    subsequent calls with the same model type and path.
 
-        if len(sent_df["text"].iloc[0].split()) != sent_df["word_count"].iloc[0]:
-            logger.warning(
-                f"Word count does not match number of words, sentid: {sent_df['sentid'].iloc[0]}"
+    Parameters
+    ----------
+    model_type : str
+        Either "huggingface", "onnx" or "spacy".
+    model_path : str
+        The path or name of the model to load.
+
+    Returns
+    -------
+    transformers.pipelines.Pipeline or spacy.language.Language
+        The loaded and warmed up NER model.
+    """
+
+    registry_key = (model_type, model_path)
+    if registry_key in NER_MODEL_REGISTRY:
+        return NER_MODEL_REGISTRY[registry_key]
+
+    logger.info(f"Loading {model_type} model from {model_path}")
+
+    if model_type == "huggingface":
+        ner_model = load_ner_model_pipeline(model_path=model_path)
+    elif model_type == "onnx":
+        ner_model = load_onnx_ner_pipeline(model_path=model_path)
+    elif model_type == "spacy":
+        spacy.require_cpu()
+        ner_model = spacy.load(model_path)
+    else:
+        raise ValueError(
+            f"Model type {model_type} not supported. Please set MODEL_TYPE to either 'huggingface', 'onnx' or 'spacy'."
+        )
+
+    warm_up_ner_model(ner_model, model_type)
+
+    NER_MODEL_REGISTRY[registry_key] = ner_model
+
+    return ner_model
+
+
+def get_ner_cache(model_type: str, model_path: str):
+    """
+    Opens the NER prediction cache for a model once per process, if caching
+    is enabled with the NER_CACHE_DIR environment variable.
+
+    Parameters
+    ----------
+    model_type : str
+        Either "huggingface", "onnx" or "spacy".
+    model_path : str
+        The path or name of the model.
+
+    Returns
+    -------
+    NERPredictionCache or None
+        The prediction cache, None if caching is disabled.
+    """
+
+    if NER_CACHE_DIR is None:
+        return None
+
+    registry_key = (model_type, model_path)
+    if registry_key not in NER_CACHE_REGISTRY:
+        NER_CACHE_REGISTRY[registry_key] = NERPredictionCache(
+            os.path.join(NER_CACHE_DIR, "ner_predictions.sqlite"),
+            get_model_fingerprint(model_type, model_path),
+            max_entries=int(NER_CACHE_MAX_ENTRIES),
+        )
+        logger.info(f"Using NER prediction cache in {NER_CACHE_DIR}")
+
+    return NER_CACHE_REGISTRY[registry_key]
+
+
+def predict_entity_labels(
+    texts: list,
+    model_type: str,
+    ner_model,
+    batch_size: int = None,
+    ner_cache=None,
+) -> list:
+    """
+    Runs the NER model over a stream of text batches in fixed size chunks,
+    skipping the model for text batches found in the prediction cache.
+
+    Parameters
+    ----------
+    texts : list
+        The text of each sentence batch to extract entities from.
+    model_type : str
+        Either "huggingface", "onnx" or "spacy".
+    ner_model : transformers.pipelines.Pipeline or spacy.language.Language
+        The loaded NER model.
+    batch_size : int, optional
+        The number of texts passed to the model at once, if None all texts
+        are passed in a single call.
+    ner_cache : NERPredictionCache, optional
+        The prediction cache to read from and add new predictions to.
+
+    Returns
+    -------
+    list
+        A list of entities for each text with the keys "start", "end",
+        "labels" and "text".
+    """
+
+    if ner_cache is None:
+        return run_ner_model(texts, model_type, ner_model, batch_size)
+
+    raw_labels = ner_cache.get_many(texts)
+    miss_index = [i for i, labels in enumerate(raw_labels) if labels is None]
+
+    logger.debug(
+        f"NER prediction cache hits: {len(texts) - len(miss_index)}, misses: {len(miss_index)}"
+    )
+
+    # only run the model once for each distinct uncached text
+    miss_texts = list(dict.fromkeys(texts[i] for i in miss_index))
+    if len(miss_texts) > 0:
+        predicted_labels = dict(
+            zip(
+                miss_texts,
+                run_ner_model(miss_texts, model_type, ner_model, batch_size),
             )
+        )
+        ner_cache.put_many(miss_texts, list(predicted_labels.values()))
+
+    # duplicate windows get their own copy of the entities
+    used_texts = set()
+    for i in miss_index:
+        if texts[i] in used_texts:
+            raw_labels[i] = copy.deepcopy(predicted_labels[texts[i]])
+        else:
+            raw_labels[i] = predicted_labels[texts[i]]
+            used_texts.add(texts[i])
+
+    ner_cache.log_stats()
+
+    return raw_labels
+
+
+def run_ner_model(
+    texts: list, model_type: str, ner_model, batch_size: int = None
+) -> list:
+    """
+    Runs the NER model over a stream of text batches in fixed size chunks.
+
+    Parameters
+    ----------
+    texts : list
+        The text of each sentence batch to extract entities from.
+    model_type : str
+        Either "huggingface", "onnx" or "spacy".
+    ner_model : transformers.pipelines.Pipeline or spacy.language.Language
+        The loaded NER model.
+    batch_size : int, optional
+        The maximum number of texts passed to the model at once, if None all
+        texts are passed in a single call. HuggingFace models are batched by
+        token length within the NER_MAX_BATCH_TOKENS budget up to this size.
+
+    Returns
+    -------
+    list
+        A list of entities for each text with the keys "start", "end",
+        "labels" and "text".
+    """
+
+    start_time = pd.Timestamp.now()
+    logger.info("Starting entity extraction. This may take a while...")
+
+    if model_type in ("huggingface", "onnx"):
+        max_batch_tokens = (
+            int(NER_MAX_BATCH_TOKENS) if NER_MAX_BATCH_TOKENS is not None else None
+        )
+        if batch_size is not None and batch_size < 1:
+            batch_size = None
+
+        # bucket the whole stream by token length, batch_size caps each batch
+        raw_labels = predict_with_token_budget(
+            ner_model,
+            texts,
+            max_batch_tokens=max_batch_tokens,
+            max_batch_size=batch_size,
+        )
+
+        # update "word" attribute to be called "text" to match spacy
+        # update "entitiy_group" to a list of the entity groups called labels
+        for label in raw_labels:
+            for entity in label:
+                entity["text"] = entity.pop("word")
+                entity["labels"] = [entity.pop("entity_group")]
+
+    elif model_type == "spacy":
+        if batch_size is None or batch_size < 1:
+            batch_size = max(len(texts), 1)
+
+        # spacy streams the docs itself, splitting them across processes
+        raw_labels = spacy_extract_batch(
+            texts,
+            ner_model,
+            batch_size=batch_size,
+            n_process=int(SPACY_N_PROCESS),
+        )
+
+    else:
+        raise ValueError(
+            f"Model type {model_type} not supported. Please set MODEL_TYPE to either 'huggingface', 'onnx' or 'spacy'."
+        )
+
+    logger.info(
+        f"Finished entity extraction in {pd.Timestamp.now() - start_time} to process {len(texts)} batches."
+    )
 
-        split_df = pd.concat([split_df, sent_df])
+    return raw_labels
 
-    return split_df
+
+def split_entity_labels(article_batch: pd.DataFrame) -> pd.DataFrame:
+    """
+    Splits the raw labels of each batch into one column per entity label.
+
+    Parameters
+    ----------
+    article_batch : pd.DataFrame
+        The sentence batches with a "raw_labels" column.
+
+    Returns
+    -------
+    pd.DataFrame
+        The sentence batches with a list of entities for each label.
+    """
+
+    # TODO: deal with multiple labels for words in this grouping
+    for label in ALL_LABELS:
+        article_batch[label] = article_batch["raw_labels"].apply(
+            lambda x: [entity for entity in x if entity["labels"][0] == label]
+        )
+
+    return article_batch
 
 
 def extract_entities(
     article_text_data: pd.DataFrame,
     model_type: str = "huggingface",
     model_path: str = "metaextractor",
+    ner_model=None,
+    ner_cache=None,
 ) -> pd.DataFrame:
     """
     Extracts the entities from the article text data.
@@ -297,6 +741,17 @@ def extract_entities(
     ----------
     article_text_data : pd.DataFrame
         The article text data.
+    model_type : str
+        Either "huggingface", "onnx" or "spacy".
+    model_path : str
+        The path or name of the model, used for the model name and to load
+        the model when one isn't passed in.
+    ner_model : transformers.pipelines.Pipeline or spacy.language.Language, optional
+        An already loaded model, if None the model is fetched from the
+        process-wide registry.
+    ner_cache : NERPredictionCache, optional
+        The prediction cache to use, if None the cache configured by the
+        NER_CACHE_DIR environment variable is used when set.
 
     Returns
     -------
@@ -313,81 +768,83 @@ def extract_entities(
     # turn the article text into batches of 256 words or less
     article_batch = combine_sentence_data(article_text_data)
 
-    if model_type == "huggingface":
-        # load the model
-        logger.debug(f"Loading model from {model_path}")
-        ner_pipe = load_ner_model_pipeline(model_path=model_path)
+    if ner_model is None:
+        ner_model = load_ner_model(model_type, model_path)
 
-        start_time = pd.Timestamp.now()
-        logger.info("Starting entity extraction. This may take a while...")
+    if ner_cache is None:
+        ner_cache = get_ner_cache(model_type, model_path)
 
-        raw_labels = ner_pipe(article_batch["text"].tolist())
-        logger.info(
-            f"Finished entity extraction in {pd.Timestamp.now() - start_time} to process {len(article_batch)} batches."
-        )
+    article_batch["raw_labels"] = predict_entity_labels(
+        article_batch["text"].tolist(), model_type, ner_model, ner_cache=ner_cache
+    )
 
-        # update "word" attribute to be called "text" to match spacy
-        # update "entitiy_group" to a list of the entity groups called labels
-        for label in raw_labels:
-            for entity in label:
-                entity["text"] = entity.pop("word")
-                entity["labels"] = [entity.pop("entity_group")]
+    article_batch["model_name"] = model_name
 
-        # get the predicted labels
-        # article_batch["raw_labels"] = ner_pipe(article_batch["text"].tolist())
-        article_batch["raw_labels"] = raw_labels
-
-        # # create empty column to be filled with predicted labels
-        # article_batch["raw_labels"] = len(article_batch) * [None]
-
-        # try:
-        #     # use tqdm to showprogress in batches, use base 4 or if less samples use single batch
-        #     batch_size = min(2, len(article_batch))
-        #     for i in tqdm(range(0, len(article_batch), batch_size)):
-        #         raw_labels = ner_pipe(
-        #             article_batch.text.iloc[i : i + batch_size]
-        #             .apply(lambda x: " ".join(x))
-        #             .tolist()
-        #         )
-        #         logger.debug(f"Found {len(raw_labels)} entities in batch {i}")
-        #         # update "word" attribute to be called "text" to match spacy
-        #         # update "entitiy_group" to a list of the entity groups called labels
-        #         for label in raw_labels:
-        #             for entity in label:
-        #                 entity["text"] = entity.pop("word")
-        #                 entity["labels"] = [entity.pop("entity_group")]
-        #         article_batch.raw_labels.iloc[i : i + batch_size] = raw_labels
-        # except Exception as e:
-        #     logger.error(
-        #         f"Error extracting entities for GDD ID: {article_batch['gddid'].iloc[0]}, skipping rest of article and returning results to this point. Error: {e}"
-        #     )
-        #     pass
+    return split_entity_labels(article_batch)
 
-        logger.info(
-            f"Finished entity extraction in {pd.Timestamp.now() - start_time} to process {len(article_batch)} batches."
-        )
 
-    elif model_type == "spacy":
-        spacy.require_cpu()
-        logger.info(f"Loading model from {model_path}")
-        spacy_model = spacy.load(model_path)
+def extract_entities_from_articles(
+    article_text_data: pd.DataFrame,
+    model_type: str = "huggingface",
+    model_path: str = "metaextractor",
+    ner_model=None,
+    batch_size: int = 32,
+    ner_cache=None,
+) -> pd.DataFrame:
+    """
+    Extracts the entities from many articles at once by pooling the sentence
+    batches of all articles into a single stream that is fed to the model in
+    fixed size chunks. Predictions are scattered back by (gddid, batch).
 
-        start_time = pd.Timestamp.now()
-        logger.info("Starting entity extraction. This may take a while...")
+    Parameters
+    ----------
+    article_text_data : pd.DataFrame
+        The article text data for one or more articles.
+    model_type : str
+        Either "huggingface", "onnx" or "spacy".
+    model_path : str
+        The path or name of the model, used for the model name and to load
+        the model when one isn't passed in.
+    ner_model : transformers.pipelines.Pipeline or spacy.language.Language, optional
+        An already loaded model, if None the model is fetched from the
+        process-wide registry.
+    batch_size : int
+        The number of sentence batches passed to the model at once.
+    ner_cache : NERPredictionCache, optional
+        The prediction cache to use, if None the cache configured by the
+        NER_CACHE_DIR environment variable is used when set.
 
-        article_batch["raw_labels"] = article_batch["text"].apply(
-            lambda x: spacy_extract_all(x, spacy_model)
-        )
+    Returns
+    -------
+    pd.DataFrame
+        The extracted entities for every article, one row per (gddid, batch).
+    """
 
-    article_batch["model_name"] = model_name
+    model_name = model_path.split(os.sep)[-1]
 
-    # TODO: deal with multiple labels for words in this grouping
-    for label in ALL_LABELS:
-        article_batch[label] = article_batch["raw_labels"].apply(
-            lambda x: [entity for entity in x if entity["labels"][0] == label]
-        )
+    logger.info(
+        f"Extracting entities from {len(article_text_data)} sentences across {article_text_data['gddid'].nunique()} articles. Using {model_name} model"
+    )
 
-    return article_batch
+    article_batch = combine_multi_article_sentence_data(article_text_data)
+
+    if ner_model is None:
+        ner_model = load_ner_model(model_type, model_path)
+
+    if ner_cache is None:
+        ner_cache = get_ner_cache(model_type, model_path)
+
+    article_batch["raw_labels"] = predict_entity_labels(
+        article_batch["text"].tolist(),
+        model_type,
+        ner_model,
+        batch_size=batch_size,
+        ner_cache=ner_cache,
+    )
+
+    article_batch["model_name"] = model_name
+
+    return split_entity_labels(article_batch)
 
 
 def post_process_extracted_entities(extracted_entities: pd.DataFrame) -> dict:
@@ -409,43 +866,37 @@ def post_process_extracted_entities(extracted_entities: pd.DataFrame) -> dict:
         f"Post-processing extracted entities from {len(extracted_entities)} batches."
     )
 
-    # TODO: optimize this to use apply or map instead of iterating over rows
-    # issue is that function returns expanded dataframe so it can't be applied to a series
-    recreated_sentences = pd.DataFrame()
-    for i, row in extracted_entities.iterrows():
-        recreated_sentences = pd.concat(
-            [
-                recreated_sentences,
-                recreate_original_sentences_with_labels(row),
-            ]
-        )
+    # build the sentence columns for all batches then create a single dataframe
+    recreated_columns = {}
+    for row in extracted_entities.to_dict("records"):
+        for column, values in recreate_sentence_columns(row).items():
+            recreated_columns.setdefault(column, []).extend(values)
+
+    recreated_sentences = pd.DataFrame(recreated_columns)
 
     logger.debug(
         f"Post processed and re-assembled {len(recreated_sentences)} sentences."
     )
 
+    if len(recreated_sentences) == 0:
+        return recreated_sentences
+
     # add in the sentence text before/after non-empty sentences to recreate the original text
     recreated_sentences["sentid_before"] = recreated_sentences["sentid"] - 1
     recreated_sentences["sentid_after"] = recreated_sentences["sentid"] + 1
+
+    has_entities = (
+        recreated_sentences[ALL_LABELS].apply(lambda x: x.str.len()).sum(axis=1) > 0
+    )
+
     # keep sentences with at least one entity and one sentence before/after
     recreated_sentences = recreated_sentences[
-        (recreated_sentences[ALL_LABELS].applymap(len).sum(axis=1) > 0)
-        # or keep senteences with at least one entity and one sentence before/after
-        | (
-            recreated_sentences["sentid"].isin(
-                recreated_sentences.loc[
-                    recreated_sentences[ALL_LABELS].applymap(len).sum(axis=1) > 0,
-                    "sentid_after",
-                ].to_list()
-            )
+        has_entities
+        | recreated_sentences["sentid"].isin(
+            recreated_sentences.loc[has_entities, "sentid_after"]
         )
-        | (
-            recreated_sentences["sentid"].isin(
-                recreated_sentences.loc[
-                    recreated_sentences[ALL_LABELS].applymap(len).sum(axis=1) > 0,
-                    "sentid_before",
-                ].to_list()
-            )
+        | recreated_sentences["sentid"].isin(
+            recreated_sentences.loc[has_entities, "sentid_before"]
         )
     ]
 
@@ -543,98 +994,756 @@ def export_extracted_entities(
     return results_dict
 
 
-def main():
-    opt = docopt(__doc__)
+def get_article_hash(article_text: pd.DataFrame) -> str:
+    """
+    Hashes the sentences of an article so changes to its text can be detected
+    between runs.
 
-    logger.debug(f"Running entity extraction pipeline with options:\n{opt}")
+    Parameters
+    ----------
+    article_text : pd.DataFrame
+        The article text data for a single article.
 
-    for f in os.listdir(opt["--article_text_path"]):
-        logger.info(f"Processing file: {f}")
+    Returns
+    -------
+    str
+        The hash of the article's sentence ids and text.
+    """
 
-        file_path = os.path.join(opt["--article_text_path"], f)
+    return get_hash(
+        "\n".join(
+            f"{sentid}\t{text}"
+            for sentid, text in zip(article_text["sentid"], article_text["text"])
+        )
+    )
 
-        article_text_data = load_article_text_data(file_path)
 
-        if MAX_ARTICLES is not None and int(MAX_ARTICLES) != -1:
-            article_text_data = article_text_data[
-                # 7 index used for testing with entities in first couple sentences of article 7
-                article_text_data["gddid"].isin(
-                    article_text_data["gddid"].unique()[
-                        0 : 0 + int(MAX_ARTICLES)
-                    ]
-                )
-            ]
-            logger.info(
-                f"Using just a subsample of the data of with {int(MAX_ARTICLES)} articles"
+def load_manifest(output_path: str) -> dict:
+    """
+    Loads the latest manifest record of every article processed into the
+    output directory.
+
+    Parameters
+    ----------
+    output_path : str
+        The path the extracted entities are exported to.
+
+    Returns
+    -------
+    dict
+        The latest manifest record keyed by GDD ID.
+    """
+
+    manifest = {}
+    manifest_path = os.path.join(output_path, MANIFEST_FILE_NAME)
+
+    if not os.path.exists(manifest_path):
+        return manifest
+
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a run killed mid write can leave a truncated last line
+                logger.warning(f"Skipping malformed manifest line: {line.strip()}")
+                continue
+            manifest[record["gddid"]] = record
+
+    logger.info(f"Loaded manifest with {len(manifest)} articles from {manifest_path}")
+
+    return manifest
+
+
+def append_manifest_record(
+    output_path: str,
+    manifest: dict,
+    article_gdd: str,
+    status: str,
+    model_name: str,
+    input_hash: str,
+    model_fingerprint: str = None,
+) -> None:
+    """
+    Appends the processing status of an article to the manifest file and the
+    in-memory manifest.
+
+    Parameters
+    ----------
+    output_path : str
+        The path the extracted entities are exported to.
+    manifest : dict
+        The in-memory manifest keyed by GDD ID.
+    article_gdd : str
+        The GDD ID of the article.
+    status : str
+        One of 'completed', 'no_entities' or 'failed'.
+    model_name : str
+        The name of the model the article was processed with.
+    input_hash : str
+        The hash of the article's text.
+    model_fingerprint : str, optional
+        The fingerprint of the model's files, see get_model_fingerprint.
+    """
+
+    record = {
+        "gddid": article_gdd,
+        "status": status,
+        "model_name": model_name,
+        "model_fingerprint": model_fingerprint,
+        "input_hash": input_hash,
+        "date_processed": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+    with open(os.path.join(output_path, MANIFEST_FILE_NAME), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    manifest[article_gdd] = record
+
+
+def is_article_processed(
+    manifest: dict,
+    article_gdd: str,
+    model_name: str,
+    input_hash: str,
+    model_fingerprint: str = None,
+) -> bool:
+    """
+    Checks whether an article was already processed with the same text and
+    model so it can be skipped. The model is compared by its fingerprint too
+    so a model retrained or exported again into the same path isn't treated
+    as unchanged.
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest keyed by GDD ID.
+    article_gdd : str
+        The GDD ID of the article.
+    model_name : str
+        The name of the model the article is being processed with.
+    input_hash : str
+        The hash of the article's text.
+    model_fingerprint : str, optional
+        The fingerprint of the model's files, see get_model_fingerprint.
+
+    Returns
+    -------
+    bool
+        True if the article completed with the same text and model.
+    """
+
+    record = manifest.get(article_gdd)
+
+    return (
+        record is not None
+        and record["status"] in ("completed", "no_entities")
+        and record["model_name"] == model_name
+        and record.get("model_fingerprint") == model_fingerprint
+        and record["input_hash"] == input_hash
+    )
+
+
+def post_process_article(
+    article_gdd: str, extracted_entities: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Post-processes the extracted entities of a single article.
+
+    Parameters
+    ----------
+    article_gdd : str
+        The GDD ID of the article.
+    extracted_entities : pd.DataFrame
+        The extracted entities for the article's sentence batches.
+
+    Returns
+    -------
+    pd.DataFrame or None
+        The post-processed entities, empty if no entities were found and None
+        if post processing failed.
+    """
+
+    try:
+        pprocessed_entities = post_process_extracted_entities(extracted_entities)
+    except Exception as e:
+        logger.error(
+            f"Error post processing entities for GDD ID: {article_gdd}, no results output. Error: {e}"
+        )
+        return None
+
+    if len(pprocessed_entities) == 0:
+        logger.warning(
+            f"No entities extracted for GDD ID: {article_gdd}, skipping article."
+        )
+
+    return pprocessed_entities
+
+
+def get_article_status(pprocessed_entities) -> str:
+    """
+    Gets the manifest status of an article from its post-processed entities.
+
+    Parameters
+    ----------
+    pprocessed_entities : pd.DataFrame or None
+        The post-processed entities, None if post processing failed.
+
+    Returns
+    -------
+    str
+        One of 'completed', 'no_entities' or 'failed'.
+    """
+
+    if pprocessed_entities is None:
+        return "failed"
+    elif len(pprocessed_entities) == 0:
+        return "no_entities"
+    return "completed"
+
+
+def write_article_results(
+    article_gdd: str,
+    pprocessed_entities,
+    output_path: str,
+    manifest: dict = None,
+    model_name: str = None,
+    input_hash: str = None,
+    model_fingerprint: str = None,
+) -> None:
+    """
+    Exports the post-processed entities of a single article to json, replacing
+    any existing results for the article, and records the outcome in the
+    manifest.
+
+    Parameters
+    ----------
+    article_gdd : str
+        The GDD ID of the article.
+    pprocessed_entities : pd.DataFrame or None
+        The post-processed entities, nothing is written if None or empty.
+    output_path : str
+        The path to export the extracted entities to.
+    manifest : dict, optional
+        The in-memory manifest, the outcome is not recorded if not provided.
+    model_name : str, optional
+        The name of the model the article was processed with.
+    input_hash : str, optional
+        The hash of the article's text.
+    model_fingerprint : str, optional
+        The fingerprint of the model's files.
+    """
+
+    status = get_article_status(pprocessed_entities)
+
+    if status == "completed":
+        # delete the file if it already exists with the article_gdd name
+        if os.path.exists(os.path.join(output_path, f"{article_gdd}.json")):
+            os.remove(os.path.join(output_path, f"{article_gdd}.json"))
+            logger.warning(
+                f"Deleted existing file {article_gdd}.json in output directory."
             )
 
-        # if max_sentences is not -1 then only use the first max_sentences sentences
-        if MAX_SENTENCES is not None and int(MAX_SENTENCES) != -1:
-            # get just sentence id's for each gdd up to max_sentences
-            article_text_data = article_text_data[
-                article_text_data["sentid"].isin(
-                    article_text_data["sentid"].unique()[0 : int(MAX_SENTENCES)]
-                )
-            ]
-            logger.info(
-                f"Using just a subsample of the data of with {int(MAX_SENTENCES)} sentences"
+        export_extracted_entities(
+            extracted_entities=pprocessed_entities,
+            output_path=output_path,
+        )
+
+    # record the outcome only after the json is written so a killed run redoes it
+    if manifest is not None:
+        append_manifest_record(
+            output_path,
+            manifest,
+            article_gdd,
+            status,
+            model_name,
+            input_hash,
+            model_fingerprint,
+        )
+
+
+def extract_article_group(
+    article_text: pd.DataFrame,
+    model_type: str,
+    model_path: str,
+    ner_model=None,
+) -> list:
+    """
+    Extracts the entities of a group of articles in one inference stream and
+    post-processes each article's results.
+
+    Parameters
+    ----------
+    article_text : pd.DataFrame
+        The article text data for one or more articles.
+    model_type : str
+        The type of NER model, either 'huggingface', 'onnx' or 'spacy'.
+    model_path : str
+        The path or name of the NER model.
+    ner_model : transformers.pipelines.Pipeline or spacy.language.Language, optional
+        The loaded NER model, taken from the model registry if not provided.
+
+    Returns
+    -------
+    list
+        (gddid, post-processed entities or None) tuples, one per article.
+    """
+
+    batch_gdds = article_text["gddid"].unique()
+    logger.info(f"Processing GDD IDs: {', '.join(batch_gdds)}")
+
+    try:
+        extracted_entities = extract_entities_from_articles(
+            article_text,
+            model_type=model_type,
+            model_path=model_path,
+            ner_model=ner_model,
+            batch_size=int(NER_BATCH_SIZE),
+        )
+
+    except Exception as e:
+        logger.error(
+            f"Error extracting entities for GDD IDs: {', '.join(batch_gdds)}, skipping articles. Error: {e}"
+        )
+        return []
+
+    return [
+        (article_gdd, post_process_article(article_gdd, article_entities))
+        for article_gdd, article_entities in extracted_entities.groupby(
+            "gddid", sort=False
+        )
+    ]
+
+
+def write_group_results(
+    results: list,
+    output_path: str,
+    manifest: dict = None,
+    model_name: str = None,
+    input_hashes: dict = None,
+    output_format: str = "json",
+    model_fingerprint: str = None,
+) -> None:
+    """
+    Exports the post-processed entities of a group of articles either as one
+    json file per article or as one batch of the parquet entity dataset.
+
+    Parameters
+    ----------
+    results : list
+        (gddid, post-processed entities or None) tuples, one per article.
+    output_path : str
+        The path to export the extracted entities to.
+    manifest : dict, optional
+        The in-memory manifest, outcomes are not recorded if not provided.
+    model_name : str, optional
+        The name of the model the articles were processed with.
+    input_hashes : dict, optional
+        The hash of each article's text keyed by GDD ID.
+    output_format : str, optional
+        Either 'json' or 'parquet', by default 'json'.
+    model_fingerprint : str, optional
+        The fingerprint of the model's files.
+    """
+
+    input_hashes = input_hashes or {}
+
+    if output_format == "json":
+        for article_gdd, pprocessed_entities in results:
+            write_article_results(
+                article_gdd,
+                pprocessed_entities,
+                output_path,
+                manifest=manifest,
+                model_name=model_name,
+                input_hash=input_hashes.get(article_gdd),
+                model_fingerprint=model_fingerprint,
             )
+        return
 
-        for article_gdd in article_text_data["gddid"].unique():
-            logger.info(f"Processing GDD ID: {article_gdd}")
+    completed = [
+        pprocessed_entities
+        for _, pprocessed_entities in results
+        if get_article_status(pprocessed_entities) == "completed"
+    ]
+    if len(completed) > 0:
+        # pyarrow is only needed for the parquet output
+        from src.pipeline.entity_dataset import write_entity_batch
+
+        write_entity_batch(completed, output_path)
+
+    # record the outcome only after the batch is written so a killed run redoes it
+    if manifest is not None:
+        for article_gdd, pprocessed_entities in results:
+            append_manifest_record(
+                output_path,
+                manifest,
+                article_gdd,
+                get_article_status(pprocessed_entities),
+                model_name,
+                input_hashes.get(article_gdd),
+                model_fingerprint,
+            )
 
-            article_text = article_text_data[article_text_data["gddid"] == article_gdd]
 
-            if USE_NER_MODEL_TYPE == "huggingface":
-                logger.info(f"Using HuggingFace model {HF_NER_MODEL_PATH}")
-                model_path = HF_NER_MODEL_PATH
-            elif USE_NER_MODEL_TYPE == "spacy":
-                logger.info(f"Using Spacy model {SPACY_NER_MODEL_NAME}")
-                model_path = SPACY_NER_MODEL_NAME
-            else:
-                raise ValueError(
-                    f"Model type {USE_NER_MODEL_TYPE} not supported. Please set MODEL_TYPE to either 'huggingface' or 'spacy'."
-                )
-            try:
-                extracted_entities = extract_entities(
-                    article_text,
-                    model_type=USE_NER_MODEL_TYPE,
-                    model_path=model_path,
-                )
+def get_group_hashes(article_text: pd.DataFrame) -> dict:
+    """
+    Hashes the text of every article in a group of articles.
 
-            except Exception as e:
-                logger.error(
-                    f"Error extracting entities for GDD ID: {article_gdd}, skipping article. Error: {e}"
+    Parameters
+    ----------
+    article_text : pd.DataFrame
+        The article text data for one or more articles.
+
+    Returns
+    -------
+    dict
+        The article text hash keyed by GDD ID.
+    """
+
+    return {
+        article_gdd: get_article_hash(article)
+        for article_gdd, article in article_text.groupby("gddid", sort=False)
+    }
+
+
+def process_article_group(
+    article_text: pd.DataFrame,
+    model_path: str,
+    ner_model,
+    output_path: str,
+    manifest: dict = None,
+    output_format: str = "json",
+    model_fingerprint: str = None,
+) -> None:
+    """
+    Extracts the entities of a group of articles in one inference stream then
+    post-processes and exports each article's results.
+
+    Parameters
+    ----------
+    article_text : pd.DataFrame
+        The article text data for one or more articles.
+    model_path : str
+        The path or name of the NER model.
+    ner_model : transformers.pipelines.Pipeline or spacy.language.Language
+        The loaded NER model.
+    output_path : str
+        The path to export the extracted entities to.
+    manifest : dict, optional
+        The in-memory manifest to record each article's outcome in.
+    output_format : str, optional
+        Either 'json' or 'parquet', by default 'json'.
+    model_fingerprint : str, optional
+        The fingerprint of the model's files recorded in the manifest,
+        computed from the model path if not provided.
+    """
+
+    input_hashes = get_group_hashes(article_text) if manifest is not None else {}
+    if manifest is not None and model_fingerprint is None:
+        model_fingerprint = get_model_fingerprint(USE_NER_MODEL_TYPE, model_path)
+
+    write_group_results(
+        extract_article_group(article_text, USE_NER_MODEL_TYPE, model_path, ner_model),
+        output_path,
+        manifest=manifest,
+        model_name=model_path,
+        input_hashes=input_hashes,
+        output_format=output_format,
+        model_fingerprint=model_fingerprint,
+    )
+
+
+def iter_article_groups(
+    article_text_path: str,
+    article_batch_size: int = 16,
+    max_articles: int = -1,
+    max_sentences: int = -1,
+    skip_article=None,
+):
+    """
+    Streams the articles of every file in a directory and pools them into
+    groups whose sentence batches share one inference stream.
+
+    Parameters
+    ----------
+    article_text_path : str
+        The directory containing the article text data files.
+    article_batch_size : int, optional
+        The number of articles in each group, by default 16.
+    max_articles : int, optional
+        The maximum number of articles to use from each file, -1 for all.
+    max_sentences : int, optional
+        The maximum number of sentences to use from each article, -1 for all.
+    skip_article : callable, optional
+        Returns True for an article's text data if it should not be processed.
+
+    Yields
+    ------
+    pd.DataFrame
+        The article text data for a group of articles.
+    """
+
+    article_batch_size = max(article_batch_size, 1)
+
+    for f in os.listdir(article_text_path):
+        logger.info(f"Processing file: {f}")
+
+        file_path = os.path.join(article_text_path, f)
+
+        # pool the sentences of several articles so short articles fill batches
+        article_group = []
+        for n_articles, article_text in enumerate(iter_article_text_data(file_path)):
+            if max_articles != -1 and n_articles >= max_articles:
+                break
+
+            # if max_sentences is not -1 then only use the first max_sentences sentences
+            if max_sentences != -1:
+                article_text = article_text[
+                    article_text["sentid"].isin(
+                        article_text["sentid"].unique()[0:max_sentences]
+                    )
+                ]
+
+            if skip_article is not None and skip_article(article_text):
+                logger.info(
+                    f"Skipping GDD ID: {article_text['gddid'].iloc[0]}, already processed."
                 )
                 continue
 
-            try:
-                pprocessed_entities = post_process_extracted_entities(
-                    extracted_entities
-                )
+            # an article of a file that isn't contiguous is streamed again in
+            # full to replace the partial one, so it starts a new group
+            if any(
+                article_text["gddid"].iloc[0] == grouped["gddid"].iloc[0]
+                for grouped in article_group
+            ):
+                yield pd.concat(article_group, ignore_index=True)
+                article_group = []
 
-                if len(pprocessed_entities) == 0:
-                    logger.warning(
-                        f"No entities extracted for GDD ID: {article_gdd}, skipping article."
-                    )
-                    continue
+            article_group.append(article_text)
+
+            if len(article_group) == article_batch_size:
+                yield pd.concat(article_group, ignore_index=True)
+                article_group = []
+
+        if len(article_group) > 0:
+            yield pd.concat(article_group, ignore_index=True)
+
+
+def init_worker(model_type: str, model_path: str, n_threads: int = 1) -> None:
+    """
+    Loads the NER model into a worker process's model registry so every
+    article group the worker receives reuses it.
+
+    Parameters
+    ----------
+    model_type : str
+        The type of NER model, either 'huggingface', 'onnx' or 'spacy'.
+    model_path : str
+        The path or name of the NER model.
+    n_threads : int, optional
+        The number of intra-op threads each worker may use, by default 1.
+    """
+
+    # keep the workers from oversubscribing the cores with torch threads, the
+    # onnx session uses the same number of threads
+    if model_type in ("huggingface", "onnx"):
+        import torch
+
+        torch.set_num_threads(max(n_threads, 1))
+
+    load_ner_model(model_type, model_path)
+
+
+def process_article_groups_in_workers(
+    article_groups,
+    model_type: str,
+    model_path: str,
+    output_path: str,
+    workers: int,
+    max_pending: int = None,
+    manifest: dict = None,
+    output_format: str = "json",
+    model_fingerprint: str = None,
+) -> None:
+    """
+    Shards article groups across a pool of worker processes, each holding its
+    own loaded model, and writes the results from the calling process.
+
+    The number of groups in flight is bounded so the article stream is only
+    read as fast as the workers consume it, and all json output goes through
+    this single writer.
+
+    Parameters
+    ----------
+    article_groups : iterable of pd.DataFrame
+        The article text data groups to process.
+    model_type : str
+        The type of NER model, either 'huggingface', 'onnx' or 'spacy'.
+    model_path : str
+        The path or name of the NER model.
+    output_path : str
+        The path to export the extracted entities to.
+    workers : int
+        The number of worker processes.
+    max_pending : int, optional
+        The maximum number of groups in flight, by default twice the workers.
+    manifest : dict, optional
+        The in-memory manifest to record each article's outcome in.
+    output_format : str, optional
+        Either 'json' or 'parquet', by default 'json'.
+    model_fingerprint : str, optional
+        The fingerprint of the model's files recorded in the manifest,
+        computed from the model path if not provided.
+    """
+
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    if manifest is not None and model_fingerprint is None:
+        model_fingerprint = get_model_fingerprint(model_type, model_path)
+
+    n_threads = max((os.cpu_count() or 1) // workers, 1)
+
+    def write_completed(futures):
+        for future in futures:
+            _, input_hashes = pending.pop(future)
+            try:
+                results = future.result()
             except Exception as e:
-                logger.error(
-                    f"Error post processing entities for GDD ID: {article_gdd}, no results output. Error: {e}"
-                )
+                logger.error(f"Worker failed to process article group. Error: {e}")
                 continue
+            write_group_results(
+                results,
+                output_path,
+                manifest=manifest,
+                model_name=model_path,
+                input_hashes=input_hashes,
+                output_format=output_format,
+                model_fingerprint=model_fingerprint,
+            )
 
-            # delete the file if it already exists with the article_gdd name
-            if os.path.exists(os.path.join(opt["--output_path"], f"{article_gdd}.json")):
-                os.remove(os.path.join(opt["--output_path"], f"{article_gdd}.json"))
-                logger.warning(
-                    f"Deleted existing file {article_gdd}.json in output directory."
-                )
+    # spawn so workers never inherit torch or tokenizer thread state
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(model_type, model_path, n_threads),
+    ) as executor:
+        # in flight futures mapped to their articles' GDD IDs and text hashes
+        pending = {}
+        for article_text in article_groups:
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                write_completed(done)
+
+            # an article streamed again must be written after its earlier version
+            group_gdds = set(article_text["gddid"].unique())
+            earlier = [
+                future
+                for future, (pending_gdds, _) in pending.items()
+                if group_gdds & pending_gdds
+            ]
+            if len(earlier) > 0:
+                wait(earlier)
+                write_completed(earlier)
 
-            export_extracted_entities(
-                extracted_entities=pprocessed_entities,
-                output_path=opt["--output_path"],
+            future = executor.submit(
+                extract_article_group, article_text, model_type, model_path
             )
+            pending[future] = (
+                group_gdds,
+                get_group_hashes(article_text) if manifest is not None else {},
+            )
+
+        write_completed(as_completed(list(pending)))
+
+
+def main():
+    opt = docopt(__doc__)
+
+    logger.debug(f"Running entity extraction pipeline with options:\n{opt}")
+
+    if USE_NER_MODEL_TYPE == "huggingface":
+        logger.info(f"Using HuggingFace model {HF_NER_MODEL_PATH}")
+        model_path = HF_NER_MODEL_PATH
+    elif USE_NER_MODEL_TYPE == "onnx":
+        logger.info(f"Using ONNX model {ONNX_NER_MODEL_PATH}")
+        model_path = ONNX_NER_MODEL_PATH
+    elif USE_NER_MODEL_TYPE == "spacy":
+        logger.info(f"Using Spacy model {SPACY_NER_MODEL_NAME}")
+        model_path = SPACY_NER_MODEL_NAME
+    else:
+        raise ValueError(
+            f"Model type {USE_NER_MODEL_TYPE} not supported. Please set MODEL_TYPE to either 'huggingface', 'onnx' or 'spacy'."
+        )
+
+    if OUTPUT_FORMAT not in ("json", "parquet"):
+        raise ValueError(
+            f"Output format {OUTPUT_FORMAT} not supported. Please set OUTPUT_FORMAT to either 'json' or 'parquet'."
+        )
+
+    max_articles = int(MAX_ARTICLES) if MAX_ARTICLES is not None else -1
+    max_sentences = int(MAX_SENTENCES) if MAX_SENTENCES is not None else -1
+    workers = max(int(opt["--workers"] or WORKERS), 1)
+
+    if max_articles != -1:
+        logger.info(
+            f"Using just a subsample of the data of with {max_articles} articles"
+        )
+    if max_sentences != -1:
+        logger.info(
+            f"Using just a subsample of the data of with {max_sentences} sentences"
+        )
+
+    # skip articles already processed with the same text and model files
+    manifest = load_manifest(opt["--output_path"])
+    model_fingerprint = get_model_fingerprint(USE_NER_MODEL_TYPE, model_path)
+
+    def skip_article(article_text):
+        return is_article_processed(
+            manifest,
+            article_text["gddid"].iloc[0],
+            model_path,
+            get_article_hash(article_text),
+            model_fingerprint,
+        )
+
+    article_groups = iter_article_groups(
+        opt["--article_text_path"],
+        article_batch_size=int(ARTICLE_BATCH_SIZE),
+        max_articles=max_articles,
+        max_sentences=max_sentences,
+        skip_article=skip_article,
+    )
+
+    if workers > 1:
+        logger.info(f"Processing articles with {workers} worker processes")
+        process_article_groups_in_workers(
+            article_groups,
+            model_type=USE_NER_MODEL_TYPE,
+            model_path=model_path,
+            output_path=opt["--output_path"],
+            workers=workers,
+            manifest=manifest,
+            output_format=OUTPUT_FORMAT,
+            model_fingerprint=model_fingerprint,
+        )
+        return
+
+    # load the model once for the whole run and reuse it for every article
+    ner_model = load_ner_model(USE_NER_MODEL_TYPE, model_path)
+
+    for article_text in article_groups:
+        process_article_group(
+            article_text,
+            model_path,
+            ner_model,
+            opt["--output_path"],
+            manifest,
+            output_format=OUTPUT_FORMAT,
+            model_fingerprint=model_fingerprint,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+# Author Kelly Wu
+# June 28 2023
+
+import os
+import sys
+
+# ensure that the parent directory is on the path for relative imports
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(os.path.dirname(current_dir))
+script_dir = os.path.join(parent_dir, "src", "article_relevance")
+
+sys.path.append(script_dir)
+
+from crossref_cache import CrossRefCache
+
+
+def test_crossref_cache_keyed_by_lowercase_doi(tmp_path):
+    cache = CrossRefCache(str(tmp_path / "crossref.sqlite"))
+
+    assert cache.get_many(["10.1000/ABC", "10.1000/missing"]) == {}
+
+    cache.put_many({"10.1000/ABC": {"DOI": "10.1000/abc"}, "10.1000/missing": None})
+
+    assert cache.get_many(["10.1000/abc", "10.1000/MISSING", "10.1000/new"]) == {
+        "10.1000/abc": {"DOI": "10.1000/abc"},
+        "10.1000/missing": None,
+    }
+    assert cache.hits == 2
+    assert cache.misses == 3
+
+
+def test_crossref_cache_expires_responses(tmp_path):
+    cache_path = str(tmp_path / "crossref.sqlite")
+    CrossRefCache(cache_path).put_many({"10.1000/abc": {"DOI": "10.1000/abc"}})
+
+    # a negative time to live expires everything already stored
+    assert CrossRefCache(cache_path, ttl_days=-1).get_many(["10.1000/abc"]) == {}
+    assert CrossRefCache(cache_path, ttl_days=1).get_many(["10.1000/abc"]) == {
+        "10.1000/abc": {"DOI": "10.1000/abc"}
+    }
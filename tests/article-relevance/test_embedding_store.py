@@ -0,0 +1,105 @@
+# Author Kelly Wu
+# June 29 2023
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# ensure that the parent directory is on the path for relative imports
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(os.path.dirname(current_dir))
+script_dir = os.path.join(parent_dir, "src", "article_relevance")
+
+sys.path.append(script_dir)
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from embedding_store import (EmbeddingStore,
+                             add_store_embeddings,
+                             embeddings_to_arrow,
+                             arrow_to_embeddings,
+                             read_embedding_parquet)
+
+
+def test_embedding_store_append_and_reload(tmp_path):
+    store = EmbeddingStore(str(tmp_path), model_name="model", dim=4)
+    embeddings = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+    store.add_many(["10.1000/A", "10.1000/b", "10.1000/a"], embeddings)
+
+    # the duplicated DOI keeps its first embedding
+    assert len(store) == 2
+    assert store.get_rows(["10.1000/a", "10.1000/B", "10.1000/c"]).tolist() == [0, 1, -1]
+
+    reloaded = EmbeddingStore(str(tmp_path), model_name="model", dim=4)
+    np.testing.assert_array_equal(
+        reloaded.get_embeddings(reloaded.get_rows(["10.1000/b", "10.1000/a"])),
+        embeddings[[1, 0]],
+    )
+
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path), model_name="other-model", dim=4)
+
+
+def test_embedding_store_drops_partial_append(tmp_path):
+    store = EmbeddingStore(str(tmp_path), model_name="model", dim=4)
+    store.add_many(["10.1000/a"], np.ones((1, 4), dtype=np.float32))
+
+    # an append interrupted after writing part of the embeddings
+    with open(store.embeddings_path, "ab") as f:
+        f.write(np.zeros(6, dtype=np.float32).tobytes())
+
+    reloaded = EmbeddingStore(str(tmp_path), model_name="model", dim=4)
+    assert len(reloaded) == 1
+
+    reloaded.add_many(["10.1000/b"], np.full((1, 4), 2, dtype=np.float32))
+    np.testing.assert_array_equal(
+        EmbeddingStore(str(tmp_path), model_name="model", dim=4).get_embeddings(np.array([0, 1])),
+        [[1, 1, 1, 1], [2, 2, 2, 2]],
+    )
+
+
+def test_add_store_embeddings(tmp_path):
+    store = EmbeddingStore(str(tmp_path), model_name="model", dim=4)
+    store.add_many(["10.1000/a"], np.ones((1, 4), dtype=np.float32))
+
+    output_df, embeddings = add_store_embeddings(pd.DataFrame({"DOI": ["10.1000/A", "10.1000/b"]}), store)
+
+    assert output_df.columns.tolist() == ["DOI"]
+    assert embeddings.dtype == np.float32
+    assert embeddings[0].tolist() == [1, 1, 1, 1]
+    assert np.isnan(embeddings[1]).all()
+
+
+def test_embedding_arrow_round_trip(tmp_path):
+    embeddings = np.arange(12, dtype=np.float32).reshape(3, 4)
+    embeddings[1] = np.nan
+
+    column = embeddings_to_arrow(embeddings)
+    assert column.type == pa.list_(pa.float32(), 4)
+
+    # the matrix is a view of the column's memory
+    view = arrow_to_embeddings(column)
+    assert not view.flags.owndata
+    np.testing.assert_array_equal(view, embeddings)
+
+    # null rows written by other tools are read as NaN
+    with_nulls = pa.array([[1, 2, 3, 4], None], pa.list_(pa.float32(), 4))
+    np.testing.assert_array_equal(arrow_to_embeddings(with_nulls)[1], [np.nan] * 4)
+
+    table = pa.table({"DOI": ["a", "b", "c"], "embedding": column})
+    pq.write_table(table, str(tmp_path / "embeddings.parquet"), compression="zstd")
+    output_df, output_embeddings = read_embedding_parquet(str(tmp_path / "embeddings.parquet"))
+
+    assert output_df.columns.tolist() == ["DOI"]
+    np.testing.assert_array_equal(output_embeddings, embeddings)
+
+    # files without an embedding column are read as they are
+    pq.write_table(table.drop(["embedding"]), str(tmp_path / "no_embeddings.parquet"))
+    output_df, output_embeddings = read_embedding_parquet(str(tmp_path / "no_embeddings.parquet"))
+    assert output_df.columns.tolist() == ["DOI"]
+    assert output_embeddings is None
@@ -8,6 +8,11 @@ import pandas as pd
 from pandas.testing import assert_frame_equal
 import warnings
 import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
 
 
 # ensure that the parent directory is on the path for relative imports
@@ -17,7 +22,11 @@ script_dir = os.path.join(parent_dir, "src", "article_relevance")
 
 sys.path.append(script_dir)
 
-from gdd_api_query import get_new_gdd_articles
+from gdd_api_query import (get_new_gdd_articles,
+                            get_gdd_session,
+                            stream_gdd_pages,
+                            GDD_PAGES_FILE_NAME,
+                            GDD_CURSOR_FILE_NAME)
 
 def test_get_new_gdd_articles():
     json_path = 'test_data/gdd_api_return.json'
@@ -71,8 +80,94 @@ def test_get_new_gdd_articles():
     assert df.shape[0] == 26
 
 
-
-
-
-    
-   
\ No newline at end of file
+class GddStubHandler(BaseHTTPRequestHandler):
+    n_pages = 3
+    # pages answering with a server error
+    failing_pages = set()
+    requested = []
+
+    def do_GET(self):
+        page = int(self.path.split("page=", 1)[1]) if "page=" in self.path else 1
+        self.requested.append(page)
+
+        if page in self.failing_pages:
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        next_page = ""
+        if page < self.n_pages:
+            next_page = f"http://{self.headers['Host']}/api/articles?page={page + 1}"
+        body = json.dumps({
+            "success": {
+                "data": [{"_gddid": f"{page}-{i}"} for i in range(2)],
+                "next_page": next_page,
+            }
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gdd_stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GddStubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    GddStubHandler.failing_pages = set()
+    GddStubHandler.requested = []
+    yield f"http://127.0.0.1:{server.server_port}/api/articles"
+    server.shutdown()
+
+
+def test_stream_gdd_pages_resumes_from_cursor(tmp_path, gdd_stub_url):
+    api_call = gdd_stub_url + "?min_acquired=2023-01-01"
+    session = get_gdd_session(max_retries=2, backoff_factor=0)
+
+    # the last page keeps failing, the query stops after the retries
+    GddStubHandler.failing_pages = {3}
+    with pytest.raises(requests.HTTPError):
+        stream_gdd_pages(api_call, str(tmp_path), session=session)
+    assert GddStubHandler.requested == [1, 2, 3, 3, 3]
+
+    with open(tmp_path / GDD_CURSOR_FILE_NAME) as f:
+        assert json.load(f)["n_pages"] == 2
+
+    # articles written after the last checkpoint are dropped on resume
+    with open(tmp_path / GDD_PAGES_FILE_NAME, "a") as f:
+        f.write('{"_gddid": "partial')
+
+    GddStubHandler.failing_pages = set()
+    GddStubHandler.requested = []
+    pages_path = stream_gdd_pages(api_call, str(tmp_path), session=session)
+    assert GddStubHandler.requested == [3]
+
+    with open(pages_path) as f:
+        gddids = [json.loads(line)["_gddid"] for line in f]
+    assert gddids == ["1-0", "1-1", "2-0", "2-1", "3-0", "3-1"]
+
+    # a different query starts afresh
+    GddStubHandler.requested = []
+    stream_gdd_pages(gdd_stub_url + "?page=2", str(tmp_path), session=session)
+    assert GddStubHandler.requested == [2, 3]
+
+
+def test_get_gdd_session_fails_fast_when_unreachable():
+    session = get_gdd_session(max_retries=10, backoff_factor=0.1, connect_retries=1, backoff_max=0.2)
+    retry = session.get_adapter("https://xdd.wisc.edu").max_retries
+    assert retry.total == 10
+    assert retry.connect == 1
+
+    # nothing listens on the port of a closed server
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GddStubHandler)
+    port = server.server_port
+    server.server_close()
+
+    start_time = time.perf_counter()
+    with pytest.raises(requests.ConnectionError):
+        session.get(f"http://127.0.0.1:{port}/api/articles", timeout=5)
+    assert time.perf_counter() - start_time < 5
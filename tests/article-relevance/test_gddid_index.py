@@ -0,0 +1,39 @@
+# Author Kelly Wu
+# July 3 2023
+
+import os
+import sys
+
+import pandas as pd
+
+# ensure that the parent directory is on the path for relative imports
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(os.path.dirname(current_dir))
+script_dir = os.path.join(parent_dir, "src", "article_relevance")
+
+sys.path.append(script_dir)
+
+from gddid_index import GddidIndex
+from gdd_api_query import find_max_date_from_parquet
+
+
+def test_gddid_index_syncs_with_folder(tmp_path):
+    pd.DataFrame({"gddid": ["a", "b"]}).to_parquet(tmp_path / "article-relevance-prediction_2023-06-01T10-00-00.parquet")
+    pd.DataFrame({"gddid": ["c"]}).to_parquet(tmp_path / "reviewed.parquet")
+
+    gddid_index = GddidIndex(str(tmp_path))
+    assert gddid_index.n_files() == 2
+    assert gddid_index.find_existing(["a", "c", "d", "a"]) == {"a", "c"}
+
+    # files written by prediction_export are added without being read
+    gddid_index.add_file("article-relevance-prediction_2023-07-01T10-00-00.parquet", ["d"])
+    assert gddid_index.max_run_date() == "2023-07-01"
+    gddid_index.close()
+
+    # the added file doesn't exist, it is dropped with its gddids when reopened
+    gddid_index = GddidIndex(str(tmp_path))
+    assert gddid_index.find_existing(["a", "c", "d"]) == {"a", "c"}
+    assert gddid_index.max_run_date() == "2023-06-01"
+    gddid_index.close()
+
+    assert find_max_date_from_parquet(str(tmp_path)) == "2023-06-01"
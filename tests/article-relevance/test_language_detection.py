@@ -0,0 +1,69 @@
+# Author Kelly Wu
+# July 4 2023
+
+import os
+import sys
+
+import pytest
+
+# ensure that the parent directory is on the path for relative imports
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(os.path.dirname(current_dir))
+script_dir = os.path.join(parent_dir, "src", "article_relevance")
+
+sys.path.append(script_dir)
+
+import language_detection
+from language_detection import detect_languages, get_language_detector, LanguageCache
+
+TEXTS = [
+    "Fossil pollen records from lake sediments show the vegetation history of the Holocene.",
+    "Le pollen fossile des lacs du Québec montre une transition de la végétation au cours de l'Holocène.",
+    "Die Pollenanalyse eines Moores in Süddeutschland zeigt die Vegetationsgeschichte seit der letzten Eiszeit.",
+    "El análisis de polen de sedimentos lacustres revela cambios climáticos durante el Holoceno en los Andes.",
+    "Палинологический анализ торфяника показывает историю растительности в голоцене.",
+]
+
+
+@pytest.mark.parametrize("detector", ["ngram", "langdetect"])
+def test_detect_languages(detector):
+    assert detect_languages(TEXTS + ["12345 ..."], detector=detector) == ["en", "fr", "de", "es", "ru", "error"]
+
+
+def test_detect_languages_cached(monkeypatch):
+    language_detection.LANGUAGE_CACHES.clear()
+    ngram_detector = get_language_detector("ngram")
+
+    detected = []
+    original_detect = ngram_detector.detect
+    monkeypatch.setattr(ngram_detector, "detect", lambda text: detected.append(text) or original_detect(text))
+
+    # each distinct text is detected once, in a thread pool
+    assert detect_languages(TEXTS + TEXTS, detector="ngram", max_workers=4) == ["en", "fr", "de", "es", "ru"] * 2
+    assert sorted(detected) == sorted(TEXTS)
+
+    assert detect_languages(TEXTS[:1], detector="ngram") == ["en"]
+    assert len(detected) == len(TEXTS)
+
+    with pytest.raises(ValueError):
+        detect_languages(TEXTS, detector="unknown")
+
+
+def test_language_cache_bounded_and_persisted(tmp_path, monkeypatch):
+    cache = LanguageCache(max_entries=2)
+    cache.put_many({("ngram", "a"): "en", ("ngram", "b"): "fr"})
+    assert cache.get_many([("ngram", "a")]) == {("ngram", "a"): "en"}
+    # b is the least recently used so it's dropped first
+    cache.put_many({("ngram", "c"): "de"})
+    assert len(cache) == 2
+    assert cache.get_many([("ngram", "a"), ("ngram", "b"), ("ngram", "c")]) == {("ngram", "a"): "en", ("ngram", "c"): "de"}
+
+    cache_path = str(tmp_path / "cache.sqlite")
+    language_detection.LANGUAGE_CACHES.clear()
+    assert detect_languages(TEXTS, detector="ngram", cache_path=cache_path) == ["en", "fr", "de", "es", "ru"]
+
+    # a later run reads the languages back from the database
+    language_detection.LANGUAGE_CACHES.clear()
+    ngram_detector = get_language_detector("ngram")
+    monkeypatch.setattr(ngram_detector, "detect", lambda text: pytest.fail("detected a cached text"))
+    assert detect_languages(TEXTS, detector="ngram", cache_path=cache_path) == ["en", "fr", "de", "es", "ru"]
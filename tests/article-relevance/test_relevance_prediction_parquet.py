@@ -4,11 +4,17 @@
 import os
 import sys
 import pytest
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pandas.testing import assert_frame_equal, assert_series_equal
 import warnings
 
 import shutil
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 
@@ -19,10 +25,15 @@ script_dir = os.path.join(parent_dir, "src", "article_relevance")
 
 sys.path.append(script_dir)
 
+import relevance_prediction_parquet
 from relevance_prediction_parquet import (crossref_extract, 
                                               data_preprocessing, 
                                               add_embeddings, 
-                                              relevance_prediction)
+                                              get_embedding_model,
+                                              relevance_prediction,
+                                              prediction_export,
+                                              clean_text)
+from embedding_store import read_embedding_parquet, add_embedding_columns
 
 # Locate test files
 @pytest.fixture(autouse=True)
@@ -56,6 +67,127 @@ def test_crossref_extract(tmp_path):
     ) 
 
 
+class CrossRefStubHandler(BaseHTTPRequestHandler):
+    # DOIs that fail with a server error on their first request
+    flaky_dois = {"10.1000/flaky"}
+    requested = []
+
+    def do_GET(self):
+        doi = self.path.split("/works/", 1)[1]
+        self.requested.append(doi)
+
+        if doi in self.flaky_dois and self.requested.count(doi) == 1:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        if doi.startswith("10.1000/missing"):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        if doi.startswith("10.1000/malformed"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            self.wfile.write(b"<html><body>Service temporarily unavailable</body></html>")
+            return
+
+        body = json.dumps({
+            "status": "ok",
+            "message": {
+                "DOI": doi,
+                "URL": f"https://doi.org/{doi}",
+                "title": [f"Title of {doi}"],
+                "language": "en",
+            },
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def crossref_stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CrossRefStubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    CrossRefStubHandler.requested = []
+    yield f"http://127.0.0.1:{server.server_address[1]}/works"
+    server.shutdown()
+
+
+def test_crossref_extract_concurrent_with_retries(tmp_path, crossref_stub_url, monkeypatch):
+    monkeypatch.setattr(relevance_prediction_parquet, "CROSSREF_BACKOFF_FACTOR", 0)
+
+    dois = [f"10.1000/article{i}" for i in range(20)] + ["10.1000/flaky", "10.1000/missing"]
+    doi_file_path = tmp_path / 'doi_list.json'
+    with open(doi_file_path, 'w') as f:
+        json.dump({
+            "queryinfo_min_date": None,
+            "queryinfo_max_date": "2023-06-26",
+            "queryinfo_n_recent": len(dois),
+            "queryinfo_term": None,
+            "data": {
+                "gddid": [f"gdd{i}" for i in range(len(dois))],
+                "DOI": dois,
+            },
+        }, f)
+
+    output_df = crossref_extract(doi_file_path,
+                                 base_url=crossref_stub_url,
+                                 max_workers=4,
+                                 rate_limit=1000)
+
+    # rows keep the order of the input and only the missing DOI is invalid
+    assert output_df['gddid'].tolist() == [f"gdd{i}" for i in range(len(dois))]
+    assert output_df['valid_for_prediction'].tolist() == [1] * 21 + [0]
+    assert output_df.loc[20, 'title'] == ["Title of 10.1000/flaky"]
+    assert output_df.loc[0, 'abstract'] == ''
+    assert CrossRefStubHandler.requested.count("10.1000/flaky") == 2
+
+
+def test_crossref_extract_cached_and_offline(tmp_path, crossref_stub_url):
+    doi_file_path = tmp_path / 'doi_list.json'
+    with open(doi_file_path, 'w') as f:
+        json.dump({
+            "queryinfo_min_date": None,
+            "queryinfo_max_date": "2023-06-26",
+            "queryinfo_n_recent": 4,
+            "queryinfo_term": None,
+            "data": {
+                "gddid": ["gdd0", "gdd1", "gdd2", "gdd3"],
+                "DOI": ["10.1000/Article0", "10.1000/article1", "10.1000/missing", "10.1000/malformed"],
+            },
+        }, f)
+    cache_path = str(tmp_path / 'crossref.sqlite')
+
+    first_df = crossref_extract(doi_file_path, base_url=crossref_stub_url, cache_path=cache_path)
+    assert len(CrossRefStubHandler.requested) == 4
+    # a malformed response doesn't abort the query, the doi is left invalid
+    assert first_df['valid_for_prediction'].tolist()[1:] == [1, 0, 0]
+
+    # the rerun is served from the cache, including the missing doi,
+    # the malformed response wasn't cached so it's queried again
+    CrossRefStubHandler.requested = []
+    cached_df = crossref_extract(doi_file_path, base_url=crossref_stub_url, cache_path=cache_path)
+    assert CrossRefStubHandler.requested == ["10.1000/malformed"]
+    assert_frame_equal(cached_df, first_df)
+
+    # offline uncached doi are left invalid instead of being queried
+    CrossRefStubHandler.requested = []
+    offline_df = crossref_extract(doi_file_path,
+                                  base_url=crossref_stub_url,
+                                  cache_path=str(tmp_path / 'empty.sqlite'),
+                                  offline=True)
+    assert CrossRefStubHandler.requested == []
+    assert offline_df['valid_for_prediction'].tolist() == [0, 0, 0, 0]
+
+
 def test_data_preprocessing(tmp_path):
 
     # Ignore all DeprecationWarnings
@@ -76,15 +208,142 @@ def test_data_preprocessing(tmp_path):
         assert output_df.shape == expected_df.shape
 
 
+def test_clean_text():
+    metadata_df = pd.DataFrame({
+        'title': [['Pollen ', 'records'], None, ['Lake']],
+        'subtitle': [[], None, ['of the Holocene']],
+        'journal': [['Quaternary'], None, 'Boreas'],
+        'abstract': ['<jats:title>Abstract</jats:title><jats:p>Fossil <jats:italic>Pinus</jats:italic></jats:p>',
+                     None,
+                     '<jats:p>Cores</jats:p><jats:list list-type="bullet">one</jats:list>\nsecond line'],
+        'subject': [['Ecology', 'Paleontology'], None, ['Geology']],
+    })
+
+    cleaned = clean_text(metadata_df)
+
+    assert cleaned['subject_clean'].tolist() == ['Ecology Paleontology', '', 'Geology']
+    assert cleaned['journal'].tolist() == ['Quaternary', '', 'Boreas']
+    # the list tag is removed up to the last > of its line
+    assert cleaned['abstract_clean'].tolist() == [' Abstract  Fossil  Pinus  ', '', ' Cores  \nsecond line']
+    assert cleaned['text_with_abstract'].tolist() == [
+        'Pollen records   Abstract  Fossil  Pinus  ',
+        '  ',
+        'Lake of the Holocene  Cores  \nsecond line',
+    ]
+
+
 def test_add_embeddings(tmp_path):
     
     input_file_path = tmp_path / 'test_data' / 'preprocess_validfile.csv'
 
     # Test if result match with sample file
     input_df = pd.read_csv(input_file_path, index_col=0)
-    output_df = add_embeddings(input_df, 'text_with_abstract', model='allenai/specter2')
+    output_df, embeddings = add_embeddings(input_df, 'text_with_abstract', model='allenai/specter2')
     
     ref_file_path = tmp_path / 'test_data' / 'addembedding_validfile.csv'
 
     expected_df = pd.read_csv(ref_file_path, index_col=0)
-    assert_frame_equal(output_df, expected_df, check_dtype=False, atol=0.01)
\ No newline at end of file
+    output_df = add_embedding_columns(output_df, embeddings).loc[expected_df.index]
+    assert_frame_equal(output_df, expected_df, check_dtype=False, atol=0.01)
+
+@pytest.fixture
+def local_tiny_embedding_model(tmp_path):
+    import torch
+    from sentence_transformers import models, SentenceTransformer
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    words = "pollen of pinus and picea was found at lake garibaldi dated to bp".split()
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+
+    torch.manual_seed(0)
+    bert_path = str(tmp_path / "tiny-bert")
+    BertModel(BertConfig(vocab_size=len(words) + 5,
+                         hidden_size=16,
+                         num_hidden_layers=1,
+                         num_attention_heads=2,
+                         intermediate_size=32)).save_pretrained(bert_path)
+    BertTokenizerFast(str(vocab_file), model_max_length=512).save_pretrained(bert_path)
+
+    transformer = models.Transformer(bert_path)
+    model_path = str(tmp_path / "tiny-embedding-model")
+    SentenceTransformer(
+        modules=[transformer, models.Pooling(transformer.get_word_embedding_dimension())]
+    ).save(model_path)
+
+    return model_path
+
+
+def test_add_embeddings_batched(local_tiny_embedding_model):
+    input_df = pd.DataFrame({
+        'text_with_abstract': ["pollen of pinus", "picea was found at lake garibaldi dated to bp", "no", "lake"],
+        'valid_for_prediction': [1, 1, 0, 1],
+    })
+
+    output_df, embeddings = add_embeddings(input_df, 'text_with_abstract', model=local_tiny_embedding_model, batch_size=2)
+
+    embedding_model = get_embedding_model(local_tiny_embedding_model)
+    assert get_embedding_model(local_tiny_embedding_model) is embedding_model
+
+    # the embeddings are a matrix beside the unchanged frame
+    assert_frame_equal(output_df, input_df)
+    assert embeddings.dtype == np.float32
+    assert embeddings.shape == (4, 16)
+    assert np.isnan(embeddings[2]).all()
+
+    # same embeddings as encoding each text on its own
+    for i in [0, 1, 3]:
+        expected = embedding_model.encode(input_df.loc[i, 'text_with_abstract'])
+        assert embeddings[i] == pytest.approx(expected, abs=1e-5)
+
+
+def test_add_embeddings_reuses_embedding_store(tmp_path, local_tiny_embedding_model, monkeypatch):
+    input_df = pd.DataFrame({
+        'DOI': ["10.1000/A", "10.1000/b", "10.1000/c"],
+        'text_with_abstract': ["pollen of pinus", "picea was found", "lake garibaldi"],
+        'valid_for_prediction': [1, 1, 1],
+    })
+    store_path = str(tmp_path / 'embedding_store')
+
+    _, first_embeddings = add_embeddings(input_df.iloc[:2], 'text_with_abstract',
+                              model=local_tiny_embedding_model, embedding_store_path=store_path)
+
+    # only the new article is embedded, the others are read from the store
+    embedding_model = get_embedding_model(local_tiny_embedding_model)
+    encoded = []
+    original_encode = embedding_model.encode
+    monkeypatch.setattr(embedding_model, 'encode',
+                        lambda texts, **kwargs: encoded.extend(texts) or original_encode(texts, **kwargs))
+
+    _, second_embeddings = add_embeddings(input_df, 'text_with_abstract',
+                                          model=local_tiny_embedding_model, embedding_store_path=store_path)
+
+    assert encoded == ["lake garibaldi"]
+    np.testing.assert_array_equal(second_embeddings[:2], first_embeddings)
+    assert second_embeddings[2] == pytest.approx(
+        original_encode("lake garibaldi"), abs=1e-5)
+
+
+def test_prediction_export_embedding_column(tmp_path):
+    embeddings = np.random.default_rng(0).random((2, 768), dtype=np.float32)
+    embeddings[1] = np.nan
+    input_df = pd.DataFrame({'DOI': ["10.1000/a", "10.1000/b"],
+                             'gddid': ["g1", "g2"],
+                             'valid_for_prediction': [1, 0],
+                             'prediction': [1, np.nan]})
+
+    prediction_export(input_df, str(tmp_path), embeddings)
+
+    parquet_folder = tmp_path / 'prediction_parquet'
+    parquet_files = list(parquet_folder.glob('*.parquet'))
+    assert len(parquet_files) == 1
+    # the CSV is only exported on request
+    assert list(parquet_folder.glob('*.csv')) == []
+
+    table = pq.read_table(parquet_files[0])
+    assert table.schema.field('embedding').type == pa.list_(pa.float32(), 768)
+    assert table.column_names == ['DOI', 'gddid', 'valid_for_prediction', 'prediction', 'embedding']
+
+    output_df, output_embeddings = read_embedding_parquet(str(parquet_files[0]))
+    assert_frame_equal(output_df, input_df)
+    np.testing.assert_array_equal(output_embeddings, embeddings)
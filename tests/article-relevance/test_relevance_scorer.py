@@ -0,0 +1,149 @@
+# Author Kelly Wu
+# July 6 2023
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# ensure that the parent directory is on the path for relative imports
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(os.path.dirname(current_dir))
+script_dir = os.path.join(parent_dir, "src", "article_relevance")
+
+sys.path.append(script_dir)
+
+from relevance_prediction_model_retrain import model_train
+from relevance_prediction_parquet import relevance_prediction
+from relevance_scorer import LinearRelevanceScorer
+from export_relevance_scorer import export_relevance_scorer
+
+EMBEDDING_COL = [str(i) for i in range(768)]
+SUBJECT_WORDS = ["Ecology", "Paleontology", "Geology", "Medicine", "Mathematics", "Oceanography", "Chemistry"]
+
+
+def make_articles(n_articles, seed):
+    rng = np.random.default_rng(seed)
+    articles_df = pd.DataFrame({
+        'has_abstract': rng.random(n_articles) < 0.5,
+        'subject_clean': [" ".join(rng.choice(SUBJECT_WORDS, size=rng.integers(0, 4))) for _ in range(n_articles)],
+        'is-referenced-by-count': rng.integers(0, 200, n_articles),
+    })
+    embeddings = pd.DataFrame(rng.normal(size=(n_articles, 768)).astype(np.float32), columns=EMBEDDING_COL)
+    articles_df = pd.concat([articles_df, embeddings], axis=1)
+    articles_df['target'] = (embeddings['0'] + articles_df['subject_clean'].str.contains("Ecology") > 0.5).astype(int)
+    articles_df['text_with_abstract'] = "text"
+
+    return articles_df
+
+
+@pytest.fixture(scope="module")
+def relevance_model(tmp_path_factory):
+    model_dir = tmp_path_factory.mktemp("models")
+    model = model_train(make_articles(200, seed=0), str(model_dir))
+
+    model_file = [file for file in os.listdir(model_dir) if file.endswith(".joblib")][0]
+
+    return model, os.path.join(model_dir, model_file)
+
+
+def test_linear_scorer_matches_pipeline(relevance_model):
+    model, _ = relevance_model
+    articles_df = make_articles(50, seed=1)
+
+    scorer = LinearRelevanceScorer.from_pipeline(model)
+    predict_proba = scorer.predict_proba(articles_df.loc[:, EMBEDDING_COL].to_numpy(),
+                                         articles_df['has_abstract'].to_numpy(),
+                                         articles_df['subject_clean'].to_numpy(),
+                                         articles_df['is-referenced-by-count'].to_numpy(),
+                                         chunk_size=16)
+
+    expected = model.predict_proba(articles_df.drop(columns=['target', 'text_with_abstract']))[:, 1]
+    np.testing.assert_allclose(predict_proba, expected, rtol=1e-10, atol=1e-12)
+
+
+def test_linear_scorer_mask(relevance_model):
+    model, _ = relevance_model
+    articles_df = make_articles(20, seed=4)
+    embeddings = articles_df.loc[:, EMBEDDING_COL].to_numpy(dtype=np.float32)
+    embeddings[5] = np.nan
+    # articles left out by the mask aren't scored, even with unknown features
+    articles_df['has_abstract'] = articles_df['has_abstract'].astype(object)
+    articles_df.loc[[2, 11], 'has_abstract'] = None
+    mask = articles_df['has_abstract'].notnull().to_numpy()
+
+    scorer = LinearRelevanceScorer.from_pipeline(model)
+    predict_proba = scorer.predict_proba(embeddings,
+                                         articles_df['has_abstract'].to_numpy(),
+                                         articles_df['subject_clean'].to_numpy(),
+                                         articles_df['is-referenced-by-count'].to_numpy(),
+                                         chunk_size=3,
+                                         mask=mask)
+
+    scored = mask.copy()
+    scored[5] = False
+    assert np.isnan(predict_proba[~scored]).all()
+    expected = model.predict_proba(articles_df.loc[scored, ['has_abstract', 'subject_clean', 'is-referenced-by-count'] + EMBEDDING_COL]
+                                   .astype({'has_abstract': bool}))[:, 1]
+    np.testing.assert_allclose(predict_proba[scored], expected, rtol=1e-10, atol=1e-12)
+
+
+def test_npz_scorer_matches_pipeline(relevance_model, tmp_path):
+    model, model_path = relevance_model
+    articles_df = make_articles(50, seed=3)
+    # words outside the vocabulary, stop words and repeats
+    articles_df.loc[:4, 'subject_clean'] = ["", "The Ecology of ecology", "Unknown words", "Geology and Medicine", "a"]
+
+    # retraining saves the scorer next to the model
+    assert os.path.exists(model_path.replace(".joblib", ".npz"))
+
+    scorer_path = export_relevance_scorer(model_path, str(tmp_path / "scorer.npz"))
+    scorer = LinearRelevanceScorer.from_npz(scorer_path)
+    predict_proba = scorer.predict_proba(articles_df.loc[:, EMBEDDING_COL].to_numpy(),
+                                         articles_df['has_abstract'].to_numpy(),
+                                         articles_df['subject_clean'].to_numpy(),
+                                         articles_df['is-referenced-by-count'].to_numpy())
+
+    expected = model.predict_proba(articles_df.drop(columns=['target', 'text_with_abstract']))[:, 1]
+    np.testing.assert_allclose(predict_proba, expected, rtol=1e-10, atol=1e-12)
+    assert scorer.classes.tolist() == model.classes_.tolist()
+
+    # the subject word scores are summed in the same order as the pipeline's
+    vectorizer = model.steps[0][1].named_transformers_['text_preprocessor']
+    text_coef = model.steps[-1][1].coef_[0][model.steps[0][1].output_indices_['text_preprocessor']]
+    np.testing.assert_array_equal(scorer.text_scores(articles_df['subject_clean'].to_numpy()),
+                                  vectorizer.transform(articles_df['subject_clean']) @ text_coef)
+
+
+@pytest.mark.parametrize("model_format", [".joblib", ".npz"])
+def test_relevance_prediction_chunked(relevance_model, model_format):
+    model, model_path = relevance_model
+    model_path = model_path.replace(".joblib", model_format)
+    articles_df = make_articles(30, seed=2)
+    for col in ['DOI', 'URL', 'gddid', 'title', 'subtitle', 'abstract', 'journal', 'author', 'language',
+                'published', 'publisher', 'queryinfo_min_date', 'queryinfo_max_date', 'queryinfo_term',
+                'queryinfo_n_recent']:
+        articles_df[col] = col
+    articles_df['valid_for_prediction'] = [1] * 25 + [0] * 5
+    # an article missing an embedding can't be scored
+    articles_df.loc[3, EMBEDDING_COL] = np.nan
+    embeddings = articles_df.loc[:, EMBEDDING_COL].to_numpy(dtype=np.float32)
+
+    result = relevance_prediction(articles_df.drop(columns=EMBEDDING_COL), embeddings, model_path, chunk_size=7)
+
+    expected = model.predict_proba(articles_df.loc[:24, ['has_abstract', 'subject_clean', 'is-referenced-by-count'] + EMBEDDING_COL]
+                                   .drop(index=3))[:, 1]
+    scored = result.loc[:24].drop(index=3)
+    np.testing.assert_allclose(scored['predict_proba'], expected, rtol=1e-10, atol=1e-12)
+    assert (scored['prediction'] == (expected >= 0.5)).all()
+
+    assert result.loc[3, 'valid_for_prediction'] == 0
+    assert np.isnan(result.loc[3, 'predict_proba'])
+    assert result.loc[25:, 'predict_proba'].isnull().all()
+    assert result.columns[:6].tolist() == ['DOI', 'URL', 'gddid', 'valid_for_prediction', 'prediction', 'predict_proba']
+    # the results keep the order of the articles and their embeddings
+    assert result.index.tolist() == articles_df.index.tolist()
+    assert not set(EMBEDDING_COL) & set(result.columns)
+
@@ -106,3 +106,31 @@ def test_get_article_table():
         get_article_table(table_id, location_id, tab_header, data).value
         == expected.value
     )
+
+
+def test_read_entities_from_entity_dataset(tmpdir):
+    """Test that articles exported as a parquet entity dataset are listed"""
+    from src.pipeline.entity_dataset import write_entity_batch
+
+    article = pd.DataFrame(
+        {
+            "gddid": ["1234"],
+            "sentid": [1],
+            "section_name": ["Introduction"],
+            "text": ["This contains taxa Pinaceae."],
+            "model_name": ["metaextractor"],
+            "TAXA": [[{"start": 19, "end": 27, "labels": ["TAXA"], "text": "Pinaceae"}]],
+            "GEOG": [[]],
+            "ALTI": [[]],
+            "EMAIL": [[]],
+            "SITE": [[]],
+            "REGION": [[]],
+            "AGE": [[]],
+        }
+    )
+    write_entity_batch([article], str(tmpdir))
+
+    articles = read_entities(str(tmpdir))
+
+    assert articles["gddid"].tolist() == ["1234"]
+    assert list(articles.columns) == ["gddid", "Date Added"]
@@ -5,6 +5,7 @@ import os
 import sys
 
 import pytest
+import spacy
 
 # ensure that the parent directory is on the path for relative imports
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
@@ -16,6 +17,8 @@ from src.entity_extraction.prediction.baseline_entity_extraction import (
     extract_age,
     extract_altitude,
     extract_email,
+    load_spacy_ner_model,
+    scan_regex_labels,
 )
 
 
@@ -327,6 +330,26 @@ def test_extract_region_names(test_sentences, expected_results):
         assert extract_region_names(test_sentence) == expected_result
 
 
+def test_spacy_ner_model_loaded_once_with_only_ner_pipes(tmpdir):
+    """
+    Tests the spacy model is cached per model name and only runs the
+    components needed for named entity recognition.
+    """
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "LOC", "pattern": "Garibaldi lake"}])
+    nlp.to_disk(str(tmpdir))
+
+    ner_model = load_spacy_ner_model(str(tmpdir))
+
+    assert load_spacy_ner_model(str(tmpdir)) is ner_model
+    assert ner_model.pipe_names == ["entity_ruler"]
+    assert extract_region_names(
+        "Samples were taken at Garibaldi lake.", spacy_model=str(tmpdir)
+    ) == [{"start": 22, "end": 36, "labels": ["REGION"], "text": "Garibaldi lake"}]
+
+
 @pytest.mark.parametrize(
     "test_sentences, expected_results",
     [
@@ -395,3 +418,26 @@ def test_extract_taxa(test_sentences, expected_results):
             )
             == expected_result
         )
+
+
+@pytest.mark.parametrize(
+    "test_sentence",
+    [
+        "Cores from 1500 m asl span 1234 - 1235 BP and 456 to 789 Ma BP.",
+        "The site (49°15'N, 123°W) at 12 m a.s.l. dated to 1234 cal yr BP.",
+        "Contact john.doe@university.edu about 21 : 195 and 10.5 ka BP.",
+        "No labels in this sentence.",
+    ],
+)
+def test_scan_regex_labels(test_sentence):
+    """
+    Tests the single pass scanner gives the same labels as the individual
+    extractors.
+    """
+
+    assert scan_regex_labels(test_sentence) == {
+        "AGE": extract_age(test_sentence),
+        "ALTI": extract_altitude(test_sentence),
+        "EMAIL": extract_email(test_sentence),
+        "GEOG": extract_geographic_coordinates(test_sentence),
+    }
@@ -14,6 +14,8 @@ from src.entity_extraction.prediction.hf_entity_extraction import (
     load_ner_model_pipeline,
     get_hf_token_labels,
     get_predicted_labels,
+    get_token_budget_batches,
+    predict_with_token_budget,
 )
 
 
@@ -95,3 +97,78 @@ def test_get_predicted_labels(tiny_ner_model):
         "OpenAI.",
     ]
     assert isinstance(extracted_df.predicted_labels.iloc[0], list)
+
+
+# a tiny randomly initialized model built locally so no download is needed
+@pytest.fixture
+def local_tiny_ner_pipe(tmpdir):
+    import torch
+    from transformers import (
+        BertConfig,
+        BertForTokenClassification,
+        BertTokenizerFast,
+        pipeline,
+    )
+
+    words = "pollen of pinus and picea was found at lake garibaldi dated to bp".split()
+    vocab_file = os.path.join(str(tmpdir), "vocab.txt")
+    with open(vocab_file, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+
+    torch.manual_seed(0)
+    labels = ["O", "B-TAXA", "I-TAXA", "B-SITE", "I-SITE"]
+    config = BertConfig(
+        vocab_size=len(words) + 5,
+        hidden_size=16,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=32,
+        id2label=dict(enumerate(labels)),
+        label2id={label: i for i, label in enumerate(labels)},
+    )
+
+    return pipeline(
+        "ner",
+        model=BertForTokenClassification(config).eval(),
+        tokenizer=BertTokenizerFast(vocab_file, model_max_length=512),
+        aggregation_strategy="simple",
+    )
+
+
+def test_get_token_budget_batches():
+    batches = get_token_budget_batches([10, 3, 8, 4, 30], max_batch_tokens=20)
+
+    # sorted by length, each batch's padded size fits the budget
+    assert batches == [[1, 3], [2, 0], [4]]
+    assert get_token_budget_batches([3, 4, 5], 100, max_batch_size=2) == [
+        [0, 1],
+        [2],
+    ]
+    assert get_token_budget_batches([], 100) == []
+
+
+def test_predict_with_token_budget_matches_pipeline(local_tiny_ner_pipe):
+    texts = [
+        "pollen of pinus and picea was found at lake garibaldi dated to bp",
+        "pinus",
+        "lake garibaldi pollen",
+        "picea was found at lake garibaldi",
+    ]
+
+    expected = [local_tiny_ner_pipe(text) for text in texts]
+    predicted = predict_with_token_budget(
+        local_tiny_ner_pipe, texts, max_batch_tokens=24
+    )
+
+    assert len(predicted) == len(texts)
+    for expected_labels, predicted_labels in zip(expected, predicted):
+        assert [
+            (entity["entity_group"], entity["start"], entity["end"])
+            for entity in predicted_labels
+        ] == [
+            (entity["entity_group"], entity["start"], entity["end"])
+            for entity in expected_labels
+        ]
+        assert [entity["score"] for entity in predicted_labels] == pytest.approx(
+            [entity["score"] for entity in expected_labels], abs=1e-5
+        )
@@ -14,10 +14,36 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 from src.entity_extraction.preprocessing.labelling_preprocessing import (
     clean_words,
     return_json,
-    chunk_text
+    chunk_text,
+    get_journal_articles,
+    iter_journal_articles,
 )
     
 
+@pytest.fixture
+def sentence_lines():
+    sentences_path = os.path.join(
+        os.path.dirname(__file__),
+        os.pardir,
+        "pipeline",
+        "test_entity_extraction_pipeline",
+        "test_gdd_text",
+    )
+    with open(sentences_path, "r") as f:
+        lines = [line for line in f.read().split("\n") if line.strip()]
+    return lines
+
+
+def write_sentences_file(tmp_path, lines, gddids):
+    """Writes the sentence lines with the gddid of each line replaced"""
+    new_lines = [
+        "\t".join([gddid] + line.split("\t")[1:]) for line, gddid in zip(lines, gddids)
+    ]
+    sentences_path = tmp_path / "sentences_nlp352"
+    sentences_path.write_text("\n".join(new_lines) + "\n")
+    return str(sentences_path)
+
+
 @pytest.fixture
 def sample_words():
     words = ["This", "is", "a", "test", "sentence", "."]
@@ -76,4 +102,57 @@ def test_chunk_text(chunking_args):
     
     assert chunk_text(args, text) == (expected_chunks,
                                       expected_local_index,
-                                      expected_subsection)
\ No newline at end of file
+                                      expected_subsection)
+
+
+def test_iter_journal_articles_contiguous(tmp_path, sentence_lines):
+    gddids = ["gdd1"] * 4 + ["gdd2"] * (len(sentence_lines) - 4)
+    sentences_path = write_sentences_file(tmp_path, sentence_lines, gddids)
+
+    all_articles = get_journal_articles(sentences_path)
+    # a small chunk size makes articles span several chunks
+    articles = list(iter_journal_articles(sentences_path, chunksize=3))
+
+    assert [article["gddid"].unique().tolist() for article in articles] == [
+        ["gdd1"],
+        ["gdd2"],
+    ]
+    pd.testing.assert_frame_equal(
+        pd.concat(articles, ignore_index=True), all_articles
+    )
+
+
+def test_iter_journal_articles_not_contiguous(tmp_path, sentence_lines):
+    gddids = ["gdd1", "gdd2"] * len(sentence_lines)
+    sentences_path = write_sentences_file(tmp_path, sentence_lines, gddids)
+
+    all_articles = get_journal_articles(sentences_path)
+    articles = list(iter_journal_articles(sentences_path, chunksize=3))
+
+    # gdd1 was yielded before it reappeared so it's yielded again in full
+    assert [article["gddid"].iloc[0] for article in articles] == ["gdd1", "gdd1", "gdd2"]
+    assert len(articles[0]) == 1
+    for article in articles[1:]:
+        gddid = article["gddid"].iloc[0]
+        pd.testing.assert_frame_equal(
+            article,
+            all_articles[all_articles["gddid"] == gddid].reset_index(drop=True),
+        )
+
+
+def test_iter_journal_articles_reappearing_late(tmp_path, sentence_lines):
+    n_lines = len(sentence_lines)
+    gddids = ["gdd1"] * 2 + ["gdd2"] * 2 + ["gdd3"] * (n_lines - 5) + ["gdd2"]
+    sentences_path = write_sentences_file(tmp_path, sentence_lines, gddids)
+
+    all_articles = get_journal_articles(sentences_path)
+    articles = list(iter_journal_articles(sentences_path, chunksize=3))
+
+    # gdd1 never reappears so it's only yielded once, before the fallback
+    assert [article["gddid"].iloc[0] for article in articles] == ["gdd1", "gdd2", "gdd2", "gdd3"]
+    for article in articles[:1] + articles[2:]:
+        gddid = article["gddid"].iloc[0]
+        pd.testing.assert_frame_equal(
+            article,
+            all_articles[all_articles["gddid"] == gddid].reset_index(drop=True),
+        )
@@ -0,0 +1,82 @@
+# Author: Ty Andrews
+# Date: 2023-06-20
+
+import os
+import sys
+
+import pytest
+
+# ensure that the parent directory is on the path for relative imports
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+from src.entity_extraction.prediction.ner_cache import (
+    NERPredictionCache,
+    get_model_fingerprint,
+)
+
+
+@pytest.fixture
+def labels():
+    return [
+        [{"start": 0, "end": 8, "labels": ["TAXA"], "text": "Pinaceae"}],
+        [],
+    ]
+
+
+def test_cache_hits_and_misses(tmpdir, labels):
+    cache = NERPredictionCache(os.path.join(str(tmpdir), "cache.sqlite"), "model")
+
+    assert cache.get_many(["Pinaceae pollen.", "No entities."]) == [None, None]
+
+    cache.put_many(["Pinaceae pollen.", "No entities."], labels)
+
+    assert cache.get_many(["Pinaceae pollen.", "No entities.", "New text."]) == [
+        labels[0],
+        labels[1],
+        None,
+    ]
+    assert cache.hits == 2
+    assert cache.misses == 3
+
+
+def test_cache_keyed_by_model(tmpdir, labels):
+    cache_path = os.path.join(str(tmpdir), "cache.sqlite")
+    NERPredictionCache(cache_path, "model_a").put_many(["Pinaceae pollen."], labels[:1])
+
+    assert NERPredictionCache(cache_path, "model_b").get_many(["Pinaceae pollen."]) == [
+        None
+    ]
+    assert NERPredictionCache(cache_path, "model_a").get_many(["Pinaceae pollen."]) == [
+        labels[0]
+    ]
+
+
+def test_cache_evicts_least_recently_used(tmpdir, labels):
+    cache = NERPredictionCache(
+        os.path.join(str(tmpdir), "cache.sqlite"), "model", max_entries=2
+    )
+
+    cache.put_many(["first", "second"], [labels[1], labels[1]])
+    # reading the first entry makes the second the least recently used
+    cache.get_many(["first"])
+    cache.put_many(["third"], [labels[1]])
+
+    assert cache.get_many(["first", "second", "third"]) == [[], None, []]
+
+
+def test_get_model_fingerprint_changes_with_model_files(tmpdir):
+    model_path = os.path.join(str(tmpdir), "model")
+    os.makedirs(model_path)
+    with open(os.path.join(model_path, "config.json"), "w") as f:
+        f.write("{}")
+
+    fingerprint = get_model_fingerprint("spacy", model_path)
+    assert fingerprint == get_model_fingerprint("spacy", model_path)
+
+    with open(os.path.join(model_path, "config.json"), "w") as f:
+        f.write('{"changed": true}')
+
+    assert fingerprint != get_model_fingerprint("spacy", model_path)
+    assert get_model_fingerprint("spacy", "a_model") != get_model_fingerprint(
+        "huggingface", "a_model"
+    )
@@ -0,0 +1,67 @@
+# Author: Ty Andrews
+# Date: 2023-06-21
+
+import os
+import sys
+import json
+
+import pytest
+
+# ensure that the parent directory is on the path for relative imports
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from src.entity_extraction.prediction.onnx_entity_extraction import (
+    compare_with_reference_results,
+    is_parity_check_passed,
+    load_onnx_ner_pipeline,
+    PARITY_CHECK_FILE_NAME,
+)
+
+
+@pytest.fixture
+def reference_results():
+    with open(
+        os.path.join(
+            os.path.dirname(__file__),
+            os.pardir,
+            os.pardir,
+            "results",
+            "ner",
+            "roberta-finetuned-v6",
+            "roberta-finetuned-v6_test_classification_results.json",
+        )
+    ) as f:
+        return json.load(f)
+
+
+def test_compare_with_reference_results(reference_results):
+    within_tolerance = {
+        "token": {"f1": reference_results["token"]["f1"] - 0.005},
+        "entity": {"f1": reference_results["entity"]["f1"] + 0.01},
+    }
+    assert compare_with_reference_results(within_tolerance, reference_results)[
+        "passed"
+    ]
+
+    entity_f1_drop = {
+        "token": {"f1": reference_results["token"]["f1"]},
+        "entity": {"f1": reference_results["entity"]["f1"] - 0.02},
+    }
+    parity_check = compare_with_reference_results(entity_f1_drop, reference_results)
+    assert not parity_check["passed"]
+    assert parity_check["entity"]["reference_f1"] == reference_results["entity"]["f1"]
+
+
+def test_onnx_model_gated_on_parity_check(tmpdir):
+    model_path = str(tmpdir)
+
+    assert not is_parity_check_passed(model_path)
+    with pytest.raises(ValueError):
+        load_onnx_ner_pipeline(model_path)
+
+    with open(os.path.join(model_path, PARITY_CHECK_FILE_NAME), "w") as f:
+        json.dump({"passed": False}, f)
+
+    assert not is_parity_check_passed(model_path)
+    with pytest.raises(ValueError):
+        load_onnx_ner_pipeline(model_path)
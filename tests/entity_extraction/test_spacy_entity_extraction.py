@@ -9,7 +9,10 @@ import pytest
 # ensure that the parent directory is on the path for relative imports
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
 
-from src.entity_extraction.prediction.spacy_entity_extraction import spacy_extract_all
+from src.entity_extraction.prediction.spacy_entity_extraction import (
+    spacy_extract_all,
+    spacy_extract_batch,
+)
 
 @pytest.fixture
 def load_empty_model():
@@ -43,4 +46,26 @@ def test_spacy_extract_all_with_null_model(load_null_model):
         assert entities[0]["start"] == 24
         assert entities[0]["end"] == 38
         assert entities[0]["labels"] == ["SITE"]
-        assert entities[0]["text"] == "Lake Garibaldi"
\ No newline at end of file
+        assert entities[0]["text"] == "Lake Garibaldi"
+
+
+def test_spacy_extract_batch_matches_spacy_extract_all():
+    
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "SITE", "pattern": "Lake Garibaldi"}])
+
+    texts = [
+        "Sample text with a site Lake Garibaldi",
+        "No entities here",
+        "Lake Garibaldi again",
+    ]
+
+    entities = spacy_extract_batch(texts, nlp, batch_size=2)
+
+    assert entities == [spacy_extract_all(text, nlp) for text in texts]
+    assert entities[0] == [
+        {"start": 24, "end": 38, "labels": ["SITE"], "text": "Lake Garibaldi"}
+    ]
+    assert entities[1] == []
@@ -0,0 +1,69 @@
+# Author: Ty Andrews
+# Date: 2023-06-23
+
+import os
+import sys
+import pickle
+
+import pytest
+
+# ensure that the parent directory is on the path for relative imports
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+from src.entity_extraction.prediction.taxa_matcher import TaxaMatcher
+
+
+@pytest.fixture
+def taxa_matcher():
+    # first words mapped to their taxon names, longest first
+    return TaxaMatcher(
+        {
+            "Mentha-type": ["Mentha-type"],
+            "Solanum": ["Solanum dulcamara", "Solanum"],
+            "Mentha": ["Mentha aquatica", "Mentha"],
+            "Betula": ["Betula"],
+            "sphagnum": ["sphagnum"],
+        }
+    )
+
+
+def test_taxa_matcher_longest_name_first(taxa_matcher):
+    assert taxa_matcher.extract("Pollen of Solanum dulcamara and Solanum") == [
+        {"start": 10, "end": 27, "labels": ["TAXA"], "text": "Solanum dulcamara"}
+    ]
+
+
+def test_taxa_matcher_same_start_orders_longest_word_first(taxa_matcher):
+    assert taxa_matcher.extract("Found Mentha-type pollen") == [
+        {"start": 6, "end": 17, "labels": ["TAXA"], "text": "Mentha-type"},
+        {"start": 6, "end": 12, "labels": ["TAXA"], "text": "Mentha"},
+    ]
+
+
+def test_taxa_matcher_requires_preceding_space(taxa_matcher):
+    # a shorter name is tried when the longest is not preceded by a space
+    assert taxa_matcher.extract("At Solanum and xSolanum dulcamara") == [
+        {"start": 3, "end": 10, "labels": ["TAXA"], "text": "Solanum"}
+    ]
+    # only the first occurrence of a name is considered
+    assert taxa_matcher.extract("xBetula and Betula") == []
+
+
+def test_taxa_matcher_skips_lowercase_names(taxa_matcher):
+    assert taxa_matcher.extract("Peat of sphagnum and Betula") == [
+        {"start": 21, "end": 27, "labels": ["TAXA"], "text": "Betula"}
+    ]
+
+
+def test_taxa_matcher_offsets_across_sentences(taxa_matcher):
+    assert taxa_matcher.extract("With Betula. Then Betula") == [
+        {"start": 5, "end": 11, "labels": ["TAXA"], "text": "Betula"},
+        {"start": 18, "end": 24, "labels": ["TAXA"], "text": "Betula"},
+    ]
+
+
+def test_taxa_matcher_pickle_round_trip(taxa_matcher):
+    text = "Pollen of Solanum dulcamara, Mentha-type and Betula"
+    reloaded = pickle.loads(pickle.dumps(taxa_matcher))
+
+    assert reloaded.extract(text) == taxa_matcher.extract(text)
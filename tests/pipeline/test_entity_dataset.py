@@ -0,0 +1,92 @@
+# Author: Ty Andrews
+# Date: 2023-06-22
+
+import os
+import sys
+import json
+
+import pandas as pd
+import pytest
+
+# ensure that the src directory is in the path
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from src.pipeline.entity_dataset import (
+    write_entity_batch,
+    has_entity_dataset,
+    list_entity_articles,
+    read_article_entities,
+)
+from src.pipeline.entity_extraction_pipeline import export_extracted_entities
+
+
+def get_article_entities(gddid, taxa_name="Pinaceae"):
+    return pd.DataFrame(
+        {
+            "gddid": [gddid, gddid],
+            "sentid": [1, 2],
+            "section_name": ["Introduction", "Results"],
+            "text": [
+                "This contains taxa Pinaceae.",
+                "Pinaceae found at 1234 BP.",
+            ],
+            "model_name": ["metaextractor", "metaextractor"],
+            "TAXA": [
+                [{"start": 19, "end": 27, "labels": ["TAXA"], "text": taxa_name}],
+                [{"start": 0, "end": 8, "labels": ["TAXA"], "text": "Pinaceae."}],
+            ],
+            "AGE": [
+                [],
+                [{"start": 18, "end": 25, "labels": ["AGE"], "text": "1234 BP"}],
+            ],
+            "GEOG": [[], []],
+            "ALTI": [[], []],
+            "EMAIL": [[], []],
+            "SITE": [[], []],
+            "REGION": [[], []],
+        }
+    )
+
+
+def test_entity_dataset_matches_json_export(tmpdir):
+    article = get_article_entities("gdd1")
+
+    write_entity_batch([article, get_article_entities("gdd2")], str(tmpdir))
+    exported = export_extracted_entities(article, str(tmpdir))
+
+    assert has_entity_dataset(str(tmpdir))
+    read_back = read_article_entities(str(tmpdir), "gdd1")
+    exported.pop("date_processed")
+    read_back.pop("date_processed")
+
+    # compare through json so numpy and python integers are treated alike
+    assert json.dumps(read_back) == json.dumps(exported, default=int)
+    assert list(read_back["entities"]["TAXA"]) == ["Pinaceae"]
+    assert len(read_back["entities"]["TAXA"]["Pinaceae"]["sentence"]) == 2
+
+
+def test_entity_dataset_latest_batch_wins(tmpdir):
+    write_entity_batch(
+        [get_article_entities("gdd1"), get_article_entities("gdd2")],
+        str(tmpdir),
+        batch_id="20230601T000000",
+    )
+    write_entity_batch(
+        [get_article_entities("gdd1", taxa_name="Pinaceae sp")],
+        str(tmpdir),
+        batch_id="20230602T000000",
+    )
+
+    articles = list_entity_articles(str(tmpdir))
+    assert sorted(articles["gddid"]) == ["gdd1", "gdd2"]
+
+    assert list(read_article_entities(str(tmpdir), "gdd1")["entities"]["TAXA"]) == [
+        "Pinaceae sp",
+        "Pinaceae",
+    ]
+    assert list(read_article_entities(str(tmpdir), "gdd2")["entities"]["TAXA"]) == [
+        "Pinaceae"
+    ]
+
+    with pytest.raises(FileNotFoundError):
+        read_article_entities(str(tmpdir), "gdd3")
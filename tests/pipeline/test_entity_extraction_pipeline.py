@@ -6,6 +6,7 @@ import sys
 
 import pandas as pd
 import pytest
+import spacy
 from distutils import dir_util
 
 # ensure that the src directory is in the path
@@ -18,6 +19,21 @@ from src.pipeline.entity_extraction_pipeline import (
     post_process_extracted_entities,
     combine_sentence_data,
     recreate_original_sentences_with_labels,
+    load_ner_model,
+    combine_multi_article_sentence_data,
+    extract_entities_from_articles,
+    process_article_groups_in_workers,
+    process_article_group,
+    iter_article_groups,
+    get_article_hash,
+    load_manifest,
+    append_manifest_record,
+    is_article_processed,
+    predict_entity_labels,
+)
+from src.entity_extraction.prediction.ner_cache import (
+    NERPredictionCache,
+    get_model_fingerprint,
 )
 
 from src.entity_extraction.prediction.hf_entity_extraction import load_ner_model_pipeline
@@ -225,6 +241,21 @@ def test_combine_sentence_data_max_word_length(input_data):
     assert len(test_results_df) == 2
 
 
+# test that batches from several articles never span two articles
+def test_combine_multi_article_sentence_data(input_data):
+    second_article = input_data.copy()
+    second_article["gddid"] = "gdd2"
+    multi_article_data = pd.concat([input_data, second_article], ignore_index=True)
+
+    test_results_df = combine_multi_article_sentence_data(
+        multi_article_data, max_word_length=12
+    )
+
+    assert test_results_df["gddid"].tolist() == ["gdd1", "gdd1", "gdd2", "gdd2"]
+    assert test_results_df["batch"].tolist() == [0, 1, 0, 1]
+    assert test_results_df["sentid_list"].tolist() == [[1, 2], [3], [1, 2], [3]]
+
+
 # test that data is combined then recreated correctly
 def test_combine_sentence_data_recreate(raw_extracted_entities, input_data):
     recreated_df = recreate_original_sentences_with_labels(
@@ -244,6 +275,23 @@ def test_combine_sentence_data_recreate(raw_extracted_entities, input_data):
     assert recreated_df["gddid"].iloc[2] == input_data["gddid"].iloc[2]
 
 
+# test that an entity crossing a sentence boundary is kept in both sentences
+def test_recreate_original_sentences_entity_spanning_sentences(
+    raw_extracted_entities,
+):
+    row = raw_extracted_entities.iloc[0].copy()
+    row["SITE"] = [
+        {"text": "BP. This", "start": 35, "end": 43, "labels": ["SITE"]}
+    ]
+
+    recreated_df = recreate_original_sentences_with_labels(row)
+
+    assert [len(ents) for ents in recreated_df["SITE"]] == [1, 1, 0]
+    assert recreated_df["SITE"].iloc[0][0]["start"] == 35
+    assert recreated_df["SITE"].iloc[1][0]["start"] == -4
+    assert recreated_df["SITE"].iloc[1][0]["section_name"] == "Background"
+
+
 # test that data is combined then recreated correctly
 def test_post_process_extracted_entities(raw_extracted_entities, output_data):
     postprocessed_df = post_process_extracted_entities(raw_extracted_entities)
@@ -251,3 +299,212 @@ def test_post_process_extracted_entities(raw_extracted_entities, output_data):
     assert postprocessed_df["AGE"].iloc[0] == output_data["AGE"].iloc[0]
     assert postprocessed_df["TAXA"].iloc[1] == output_data["TAXA"].iloc[1]
     assert postprocessed_df["REGION"].iloc[2] == output_data["REGION"].iloc[2]
+
+
+# a blank spacy pipeline saved to disk stands in for a real model
+@pytest.fixture
+def blank_spacy_model_path(tmpdir):
+    model_path = os.path.join(str(tmpdir), "blank_spacy_model")
+    spacy.blank("en").to_disk(model_path)
+    return model_path
+
+
+# test that the model is loaded once and reused from the registry
+def test_load_ner_model_registry(blank_spacy_model_path):
+    first_model = load_ner_model("spacy", blank_spacy_model_path)
+    second_model = load_ner_model("spacy", blank_spacy_model_path)
+
+    assert first_model is second_model
+
+
+def test_load_ner_model_unsupported_type(blank_spacy_model_path):
+    with pytest.raises(ValueError):
+        load_ner_model("not_a_model_type", blank_spacy_model_path)
+
+
+# test that an injected model is used without loading from the model path
+def test_extract_entities_with_injected_model(input_data):
+    extracted_df = extract_entities(
+        input_data,
+        model_type="spacy",
+        model_path="not_a_real_model",
+        ner_model=spacy.blank("en"),
+    )
+
+    assert extracted_df["model_name"].iloc[0] == "not_a_real_model"
+    assert extracted_df["TAXA"].iloc[0] == []
+
+
+# test that predictions from a pooled stream are scattered back to each article
+def test_extract_entities_from_articles(input_data):
+    ruler_model = spacy.blank("en")
+    ruler = ruler_model.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "TAXA", "pattern": "Pinaceae"}])
+
+    second_article = input_data.iloc[[0]].copy()
+    second_article["gddid"] = "gdd2"
+    multi_article_data = pd.concat([input_data, second_article], ignore_index=True)
+
+    extracted_df = extract_entities_from_articles(
+        multi_article_data,
+        model_type="spacy",
+        model_path="entity_ruler",
+        ner_model=ruler_model,
+        batch_size=1,
+    )
+
+    assert extracted_df["gddid"].tolist() == ["gdd1", "gdd2"]
+    assert [ent["text"] for ent in extracted_df["TAXA"].iloc[0]] == ["Pinaceae"]
+    assert extracted_df["TAXA"].iloc[1] == []
+
+
+# test that article groups are shared across worker processes and written once
+def test_process_article_groups_in_workers(input_data, tmpdir):
+    ruler_model = spacy.blank("en")
+    ruler = ruler_model.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "TAXA", "pattern": "Pinaceae"}])
+    model_path = os.path.join(str(tmpdir), "ruler_model")
+    ruler_model.to_disk(model_path)
+
+    output_path = os.path.join(str(tmpdir), "output")
+    os.makedirs(output_path)
+
+    no_entities_article = input_data.iloc[[0]].copy()
+    no_entities_article["gddid"] = "gdd2"
+    second_article = input_data.copy()
+    second_article["gddid"] = "gdd3"
+
+    process_article_groups_in_workers(
+        [input_data, no_entities_article, second_article],
+        model_type="spacy",
+        model_path=model_path,
+        output_path=output_path,
+        workers=2,
+        max_pending=1,
+    )
+
+    assert sorted(os.listdir(output_path)) == ["gdd1.json", "gdd3.json"]
+
+
+# test that processed articles are recorded and skipped only while unchanged
+def test_manifest_skips_processed_articles(input_data, tmpdir, monkeypatch):
+    monkeypatch.setattr(
+        "src.pipeline.entity_extraction_pipeline.USE_NER_MODEL_TYPE", "spacy"
+    )
+    ruler_model = spacy.blank("en")
+    ruler = ruler_model.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "TAXA", "pattern": "Pinaceae"}])
+
+    no_entities_article = input_data.iloc[[0]].copy()
+    no_entities_article["gddid"] = "gdd2"
+    article_text = pd.concat([input_data, no_entities_article], ignore_index=True)
+
+    manifest = load_manifest(str(tmpdir))
+    assert manifest == {}
+
+    process_article_group(
+        article_text, "entity_ruler", ruler_model, str(tmpdir), manifest
+    )
+
+    manifest = load_manifest(str(tmpdir))
+    assert manifest["gdd1"]["status"] == "completed"
+    assert manifest["gdd2"]["status"] == "no_entities"
+    assert os.path.exists(os.path.join(str(tmpdir), "gdd1.json"))
+
+    input_hash = get_article_hash(input_data)
+    fingerprint = get_model_fingerprint("spacy", "entity_ruler")
+    assert is_article_processed(
+        manifest, "gdd1", "entity_ruler", input_hash, fingerprint
+    )
+    assert not is_article_processed(
+        manifest, "gdd1", "other_model", input_hash, fingerprint
+    )
+
+    changed_text = input_data.copy()
+    changed_text.loc[0, "text"] = "This sentence has changed."
+    assert not is_article_processed(
+        manifest, "gdd1", "entity_ruler", get_article_hash(changed_text), fingerprint
+    )
+    assert not is_article_processed(
+        manifest, "gdd3", "entity_ruler", input_hash, fingerprint
+    )
+
+
+# test that a model saved again into the same path reprocesses its articles
+def test_manifest_reprocesses_changed_model(input_data, tmpdir):
+    model_path = os.path.join(str(tmpdir), "model")
+    os.makedirs(model_path)
+    with open(os.path.join(model_path, "weights.bin"), "w") as f:
+        f.write("original weights")
+
+    manifest = {}
+    input_hash = get_article_hash(input_data)
+    append_manifest_record(
+        str(tmpdir),
+        manifest,
+        "gdd1",
+        "completed",
+        model_path,
+        input_hash,
+        get_model_fingerprint("huggingface", model_path),
+    )
+    assert is_article_processed(
+        manifest, "gdd1", model_path, input_hash,
+        get_model_fingerprint("huggingface", model_path),
+    )
+
+    with open(os.path.join(model_path, "weights.bin"), "w") as f:
+        f.write("retrained weights")
+
+    assert not is_article_processed(
+        manifest, "gdd1", model_path, input_hash,
+        get_model_fingerprint("huggingface", model_path),
+    )
+
+
+# test that an article streamed again in full doesn't share a group with its partial version
+def test_iter_article_groups_not_contiguous(tmpdir):
+    sentences_path = os.path.join(
+        os.path.dirname(__file__), "test_entity_extraction_pipeline", "test_gdd_text"
+    )
+    with open(sentences_path) as f:
+        lines = [line for line in f.read().split("\n") if line.strip()]
+
+    gddids = ["gdd1", "gdd2", "gdd1"] + ["gdd2"] * (len(lines) - 3)
+    input_path = os.path.join(str(tmpdir), "input")
+    os.makedirs(input_path)
+    with open(os.path.join(input_path, "sentences_nlp352"), "w") as f:
+        f.write(
+            "\n".join(
+                "\t".join([gddid] + line.split("\t")[1:])
+                for line, gddid in zip(lines, gddids)
+            )
+            + "\n"
+        )
+
+    groups = list(iter_article_groups(input_path, article_batch_size=16))
+
+    assert [group["gddid"].tolist() for group in groups] == [
+        ["gdd1"],
+        ["gdd1", "gdd1"] + ["gdd2"] * (len(lines) - 2),
+    ]
+
+
+# test that cached windows skip the model and match uncached predictions
+def test_predict_entity_labels_with_cache(tmpdir):
+    ruler_model = spacy.blank("en")
+    ruler = ruler_model.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "TAXA", "pattern": "Pinaceae"}])
+    texts = ["Pollen of Pinaceae.", "No entities here.", "Pollen of Pinaceae."]
+
+    ner_cache = NERPredictionCache(os.path.join(str(tmpdir), "cache.sqlite"), "ruler")
+    uncached_labels = predict_entity_labels(texts, "spacy", ruler_model)
+    cached_labels = predict_entity_labels(texts, "spacy", ruler_model, ner_cache=ner_cache)
+
+    assert cached_labels == uncached_labels
+    assert cached_labels[0] is not cached_labels[2]
+    assert (ner_cache.hits, ner_cache.misses) == (0, 3)
+
+    # the model is never called when every window is cached
+    assert predict_entity_labels(texts, "spacy", None, ner_cache=ner_cache) == uncached_labels
+    assert (ner_cache.hits, ner_cache.misses) == (3, 3)